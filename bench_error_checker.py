@@ -0,0 +1,510 @@
+# Micro-benchmarks for error_checker.py
+#
+#   python bench_error_checker.py categorize [--sizes 20,100,1000,5000] [--output FILE]
+#   python bench_error_checker.py scan [--domains 1000] [--modes sequential,threads,async] [--output FILE]
+#   python bench_error_checker.py head [--sizes 1,16,256] [--output FILE]
+#   python bench_error_checker.py memory [--domains 1000000] [--output FILE]
+#   python bench_error_checker.py output [--domains 20000] [--workers 64] [--output FILE]
+#   python bench_error_checker.py patterns [--sizes 1000,10000,50000] [--output FILE]
+#
+# Every benchmark prints one JSON document so runs can be compared over time.
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import re
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import error_checker
+
+def naive_categorize(content, hosting_patterns):
+    # The original nested-loop categorize_response, kept as the baseline
+    for provider, keywords in hosting_patterns.items():
+        for keyword in keywords:
+            if keyword in content:
+                return f"{provider}_error"
+    for code in error_checker.GENERIC_ERROR_CODES:
+        if code in content:
+            return f"custom_{code}"
+    return "custom"
+
+def synthetic_patterns(size, seed=1):
+    # Built-in patterns padded with made-up provider signatures up to `size` keywords
+    rng = random.Random(seed)
+    patterns = dict(error_checker.load_hosting_patterns())
+    count = sum(len(v) for v in patterns.values())
+    words = ["hosting", "parked", "domain", "expired", "reserved", "Serwis", "Strona", "server", "for sale", "welcome"]
+    provider = 0
+    while count < size:
+        keywords = [f"{rng.choice(words)} by provider{provider}-{i} {rng.choice(words)}" for i in range(4)]
+        patterns[f"provider{provider}"] = keywords
+        count += len(keywords)
+        provider += 1
+    return patterns
+
+def synthetic_bodies(patterns, count=50, size=20000, seed=2):
+    # Error pages of roughly `size` characters; a quarter contain a keyword near the end
+    rng = random.Random(seed)
+    filler = "<div class='content'><p>The requested resource could not be served at this time.</p></div>\n"
+    keywords = [k for v in patterns.values() for k in v]
+    bodies = []
+    for i in range(count):
+        body = "<html><head><title>Error</title></head><body>" + filler * (size // len(filler))
+        if i % 4 == 0:
+            body += rng.choice(keywords)
+        bodies.append(body + "</body></html>")
+    return bodies
+
+def time_per_call(func, bodies, patterns, min_seconds=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for body in bodies:
+            func(body, patterns)
+        calls += len(bodies)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+def bench_categorize(args):
+    runs = []
+    for size in args.sizes or [20, 100, 1000, 5000]:
+        patterns = synthetic_patterns(size)
+        bodies = synthetic_bodies(patterns)
+        compile_start = time.perf_counter()
+        matcher = error_checker.PatternMatcher(patterns)
+        compile_seconds = time.perf_counter() - compile_start
+        for body in bodies:
+            assert error_checker.categorize_response(body, matcher) == naive_categorize(body, patterns)
+        naive = time_per_call(naive_categorize, bodies, patterns)
+        compiled = time_per_call(error_checker.categorize_response, bodies, matcher)
+        body_bytes = sum(len(b) for b in bodies) / len(bodies)
+        runs.append({
+            "keywords": sum(len(v) for v in patterns.values()),
+            "compile_ms": round(compile_seconds * 1000, 3),
+            "naive_us_per_page": round(naive * 1e6, 1),
+            "compiled_us_per_page": round(compiled * 1e6, 1),
+            "naive_mb_per_s": round(body_bytes / naive / 1e6, 1),
+            "compiled_mb_per_s": round(body_bytes / compiled / 1e6, 1),
+            "speedup": round(naive / compiled, 2),
+        })
+    return {"benchmark": "categorize", "page_chars": int(body_bytes), "runs": runs}
+
+def bench_patterns(args):
+    # Start-up with a --patterns file: parsing and compiling it as every run did before,
+    # the first run that also writes the compiled artifact, and later runs loading it
+    runs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes or [1000, 10000, 50000]:
+            patterns = synthetic_patterns(size)
+            path = os.path.join(tmpdir, f"patterns_{size}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(patterns, f)
+            # re keeps compiled patterns in a per-process cache; a new run starts without it
+            re.purge()
+            start = time.perf_counter()
+            error_checker.PatternMatcher(error_checker.load_hosting_patterns(path))
+            uncached = time.perf_counter() - start
+            re.purge()
+            start = time.perf_counter()
+            error_checker.PatternDatabase(path).load()
+            first = time.perf_counter() - start
+            re.purge()
+            start = time.perf_counter()
+            database = error_checker.PatternDatabase(path)
+            matcher = database.load()
+            cached = time.perf_counter() - start
+            assert database.from_cache
+            bodies = synthetic_bodies(patterns)
+            for body in bodies:
+                assert error_checker.categorize_response(body, matcher) == naive_categorize(body, patterns)
+            runs.append({
+                "keywords": sum(len(v) for v in patterns.values()),
+                "source_kib": round(os.path.getsize(path) / 1024),
+                "artifact_kib": round(os.path.getsize(database.cache_path) / 1024),
+                "uncached_load_ms": round(uncached * 1000, 1),
+                "first_load_ms": round(first * 1000, 1),
+                "cached_load_ms": round(cached * 1000, 1),
+                "speedup": round(uncached / cached, 1),
+                "match_us_per_page": round(time_per_call(error_checker.categorize_response, bodies, matcher) * 1e6, 1),
+                "reload_check_us": round(time_per_call(lambda _, __: database.reload(), [None], None, 0.1) * 1e6, 1),
+            })
+    return {"benchmark": "patterns", "runs": runs}
+
+def head_pages(body_chars, count=20, seed=4):
+    # Error pages with a realistic <head> followed by `body_chars` characters of body
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        head = ("<!DOCTYPE html><html><head><meta charset='utf-8'>"
+                f"<title>Page {i} not found</title>"
+                f"<meta name='generator' content='{rng.choice(['Plesk Obsidian', 'WordPress 6.4', 'cPanel'])}'>"
+                + "<link rel='stylesheet' href='/static/site.css'>" * rng.randint(1, 6)
+                + f"<meta http-equiv='refresh' content='5; url=https://ww{i}.sedoparking.com/'>"
+                  f"<link rel='canonical' href='https://example{i}.com/'></head>")
+        row = "<div class='row'><p>The requested resource could not be served at this time.</p></div>\n"
+        pages.append(head + "<body>" + row * (body_chars // len(row)) + "</body></html>")
+    return pages
+
+def bs4_head_signals(content):
+    # What a full BeautifulSoup parse costs to get the same four signals
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    title = soup.title.get_text(" ", strip=True) if soup.title else ""
+    generator = soup.find("meta", attrs={"name": "generator"})
+    refresh = soup.find("meta", attrs={"http-equiv": "refresh"})
+    canonical = soup.find("link", rel="canonical")
+    return error_checker.HeadSignals(title, generator.get("content", "") if generator else "",
+                                     refresh.get("content", "") if refresh else "",
+                                     canonical.get("href", "") if canonical else "")
+
+def bench_head(args):
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        bs4 = None
+    runs = []
+    for size in args.sizes or [1, 16, 256]:
+        # --sizes is in KiB of body for this benchmark
+        pages = head_pages(size * 1024)
+        run = {"body_kib": size}
+        run["head_us_per_page"] = round(time_per_call(lambda page, _: error_checker.extract_head_signals(page, budget=math.inf),
+                                                      pages, None) * 1e6, 1)
+        if bs4:
+            for page in pages:
+                assert bs4_head_signals(page) == error_checker.extract_head_signals(page, budget=math.inf)
+            run["bs4_us_per_page"] = round(time_per_call(lambda page, _: bs4_head_signals(page), pages, None) * 1e6, 1)
+            run["speedup"] = round(run["bs4_us_per_page"] / run["head_us_per_page"], 1)
+        runs.append(run)
+    return {"benchmark": "head", "budget_ms": error_checker.HEAD_PARSE_BUDGET * 1000,
+            "bs4": getattr(bs4, "__version__", None), "runs": runs}
+
+def synthetic_results(count, seed=5):
+    # Results as they arrive from a scan: every status code is a new int object, as
+    # parsed from a response or a progress file, and categories come from a small set
+    rng = random.Random(seed)
+    categories = [f"{provider}_error" for provider in error_checker.load_hosting_patterns()]
+    categories += ["no_error", "unreachable", "dns_nxdomain", "custom", "custom_404"]
+    for i in range(count):
+        category = rng.choice(categories)
+        status = None if category in ("unreachable", "dns_nxdomain") else int("200" if category == "no_error" else rng.choice(["404", "403", "503"]))
+        yield {"domain": f"domain-{i}-{rng.randrange(10**6)}.com", "status_code": status, "category": category}
+
+def measure_bytes(build):
+    tracemalloc.start()
+    try:
+        kept = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+def bench_memory(args):
+    count = args.domains
+
+    def dicts():
+        # What main() kept before: a list of result dicts plus a set of scanned domains
+        results = list(synthetic_results(count))
+        return results, set(r["domain"] for r in results)
+
+    def store():
+        return error_checker.ResultStore(synthetic_results(count))
+
+    def domains_only():
+        # The domain strings themselves, which both representations must keep
+        return [r["domain"] for r in synthetic_results(count)]
+
+    baseline = measure_bytes(domains_only)
+    runs = {name: measure_bytes(build) for name, build in (("dicts", dicts), ("store", store))}
+    report = {"benchmark": "memory", "results": count, "domain_bytes_per_result": round(baseline / count, 1)}
+    for name, size in runs.items():
+        report[f"{name}_bytes_per_result"] = round(size / count, 1)
+        report[f"{name}_overhead_per_result"] = round((size - baseline) / count, 1)
+    report["ratio"] = round(runs["dicts"] / runs["store"], 2)
+    return report
+
+OUTPUT_MODES = {
+    # name: (log records behind a queue, console verbosity, progress bar attached)
+    "direct": (False, error_checker.CONSOLE_VERBOSE, False),
+    "queued_verbose": (True, error_checker.CONSOLE_VERBOSE, True),
+    "queued": (True, error_checker.CONSOLE_NORMAL, True),
+}
+
+def run_output_mode(mode, domains, patterns, workers, tmpdir):
+    # Classifies canned answers in `workers` threads, so the log file and the console
+    # are the only shared resources; the console is a line-buffered file, like a terminal
+    from tqdm import tqdm
+    queued, verbosity, attached = OUTPUT_MODES[mode]
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    for handler in saved_handlers:
+        root.removeHandler(handler)
+    log_handler = logging.FileHandler(os.path.join(tmpdir, f"{mode}.log"))
+    log_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    root.addHandler(log_handler)
+    root.setLevel(logging.INFO)
+    stop_log_writer = error_checker.start_log_writer() if queued else None
+    console = error_checker.CONSOLE
+    console.verbosity = verbosity
+    body = "<html><body><h1>Not Found</h1></body></html>"
+
+    def classify(i):
+        status = 404 if i % 4 else 200
+        return error_checker.classify_response(domains[i], status, body, patterns)
+
+    with open(os.path.join(tmpdir, f"{mode}.out"), "w", buffering=1) as terminal:
+        progress = tqdm(total=len(domains), file=terminal, mininterval=error_checker.CONSOLE_REFRESH_INTERVAL)
+        if attached:
+            console.attach(progress)
+        try:
+            with contextlib.redirect_stdout(terminal):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for result in error_checker.run_in_pool(executor, range(len(domains)), classify, workers * 2):
+                        if attached:
+                            console.result(result)
+                        else:
+                            progress.update(1)
+                # Everything still queued must be written before the clock stops
+                console.detach()
+                if stop_log_writer:
+                    stop_log_writer()
+                elapsed = time.perf_counter() - start
+        finally:
+            progress.close()
+            console.verbosity = error_checker.CONSOLE_VERBOSE
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            log_handler.close()
+            for handler in saved_handlers:
+                root.addHandler(handler)
+            root.setLevel(saved_level)
+    return elapsed
+
+def bench_output(args):
+    patterns = error_checker.compile_patterns(error_checker.load_hosting_patterns())
+    domains = [f"domain-{i}.com" for i in range(args.domains)]
+    runs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mode in OUTPUT_MODES:
+            elapsed = run_output_mode(mode, domains, patterns, args.workers, tmpdir)
+            runs.append({"mode": mode, "seconds": round(elapsed, 3), "domains_per_sec": round(len(domains) / elapsed)})
+    direct = runs[0]["seconds"]
+    for run in runs[1:]:
+        run["speedup"] = round(direct / run["seconds"], 2)
+    return {"benchmark": "output", "domains": len(domains), "workers": args.workers, "runs": runs}
+
+# Share of each scenario in the simulated scan; parked pages cycle through every provider
+SCAN_MIX = {
+    "parked": 40,
+    "ok": 20,
+    "burst": 15,
+    "large": 10,
+    "slow": 10,
+    "reset": 5,
+}
+LARGE_BODY_BYTES = 2 * 1024 * 1024
+
+class StandInHostingHandler(BaseHTTPRequestHandler):
+    # Loopback stand-in for hosting front-ends: /<scenario>/<provider>/<n>
+    protocol_version = "HTTP/1.1"
+    provider_pages = {}
+    slow_ttfb = 0.2
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        scenario, provider = (self.path.split("/") + ["", ""])[1:3]
+        if scenario == "parked":
+            self.send_body(404, self.provider_pages[provider])
+        elif scenario == "slow":
+            time.sleep(self.slow_ttfb)
+            self.send_body(200, b"<html>Welcome</html>")
+        elif scenario == "reset":
+            # Abortive close: the client sees a connection reset instead of a response
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = True
+        elif scenario == "large":
+            self.send_body(500, b"<html><body>" + b"x" * LARGE_BODY_BYTES + b"</body></html>")
+        elif scenario == "burst":
+            self.send_body(503, b"<html>Service Unavailable 503</html>")
+        else:
+            self.send_body(200, b"<html>Welcome</html>")
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients drop connections on purpose (byte cap, early stop), which is not an error here
+        pass
+
+def start_stand_in_server(patterns, slow_ttfb):
+    pages = {provider: f"<html><body><h1>{keywords[0]}</h1></body></html>".encode("utf-8")
+             for provider, keywords in patterns.items() if keywords and keywords[0]}
+    handler = type("Handler", (StandInHostingHandler,), {"provider_pages": pages, "slow_ttfb": slow_ttfb})
+    server = StandInServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def scan_urls(base_url, count, patterns, seed=3):
+    # Deterministic mix of stand-in URLs, shuffled so scenarios interleave
+    providers = [p for p, keywords in patterns.items() if keywords and keywords[0]]
+    total = sum(SCAN_MIX.values())
+    urls = []
+    for scenario, share in SCAN_MIX.items():
+        for i in range(count * share // total):
+            provider = providers[i % len(providers)] if scenario == "parked" else "-"
+            urls.append(f"{base_url}/{scenario}/{provider}/{i}")
+    while len(urls) < count:
+        urls.append(f"{base_url}/ok/-/{len(urls)}")
+    random.Random(seed).shuffle(urls)
+    return urls
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+def run_scan_mode(mode, urls, patterns, args):
+    # Returns (results, per-domain latencies in seconds). Every mode drives Scanner.scan_many,
+    # the engine the command line uses, so the numbers include its queueing, retry queue and
+    # result hand-over. The stand-in URLs need no DNS stage; a domain's latency runs from the
+    # moment the scanner takes it until its result comes out.
+    engines = {
+        "sequential": {"threads": 1},
+        "threads": {"threads": args.workers},
+        "async": {"engine": "async", "concurrency": args.concurrency},
+    }
+    latencies = []
+    started = {}
+
+    def feed():
+        for url in urls:
+            started[url] = time.perf_counter()
+            yield url
+    results = []
+    with error_checker.Scanner(patterns, dns=False, retries=0, timeout=args.timeout, **engines[mode]) as scanner:
+        for result in scanner.scan_many(feed()):
+            latencies.append(time.perf_counter() - started.pop(result["domain"]))
+            results.append(result)
+    return results, latencies
+
+def bench_scan_mode(args):
+    # Runs one execution mode against an already running stand-in server; called in a
+    # fresh process per mode so peak RSS and CPU time belong to that mode alone
+    hosting_patterns = error_checker.load_hosting_patterns()
+    urls = scan_urls(args.base_url, args.domains, hosting_patterns)
+    patterns = error_checker.compile_patterns(hosting_patterns)
+    logging.disable(logging.CRITICAL)
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results, latencies = run_scan_mode(args.mode, urls, patterns, args)
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+    latencies.sort()
+    return {
+        "mode": args.mode,
+        "workers": {"sequential": 1, "threads": args.workers, "async": args.concurrency}[args.mode],
+        "domains": len(results),
+        "seconds": round(elapsed, 3),
+        "domains_per_sec": round(len(results) / elapsed, 1),
+        "latency_ms": {name: round(percentile(latencies, q) * 1000, 2)
+                       for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "cpu_seconds_per_1k": round(cpu * 1000 / len(results), 3),
+        "categories": dict(Counter(r["category"] for r in results).most_common()),
+    }
+
+def bench_scan(args):
+    if args.mode:
+        return bench_scan_mode(args)
+    patterns = error_checker.load_hosting_patterns()
+    server = start_stand_in_server(patterns, args.slow_ttfb)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    runs = []
+    try:
+        for mode in args.modes:
+            command = [sys.executable, os.path.abspath(__file__), "scan", "--mode", mode, "--base-url", base_url,
+                       "--domains", str(args.domains), "--workers", str(args.workers),
+                       "--concurrency", str(args.concurrency), "--timeout", str(args.timeout)]
+            proc = subprocess.run(command, capture_output=True, text=True)
+            if proc.returncode != 0:
+                raise RuntimeError(f"scan benchmark failed in {mode} mode:\n{proc.stderr}")
+            runs.append(json.loads(proc.stdout))
+    finally:
+        server.shutdown()
+    return {"benchmark": "scan", "domains": args.domains, "mix": SCAN_MIX,
+            "slow_ttfb_ms": round(args.slow_ttfb * 1000), "large_body_bytes": LARGE_BODY_BYTES, "runs": runs}
+
+BENCHMARKS = {
+    "categorize": bench_categorize,
+    "scan": bench_scan,
+    "head": bench_head,
+    "memory": bench_memory,
+    "output": bench_output,
+    "patterns": bench_patterns,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for error_checker.py")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS), help="Benchmark to run")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=None,
+                        help="Comma-separated pattern-set sizes for the categorize benchmark (default: 20,100,1000,5000) "
+                             "and the patterns benchmark (default: 1000,10000,50000), "
+                             "or body sizes in KiB for the head benchmark (default: 1,16,256)")
+    parser.add_argument("--domains", type=int, default=1000, help="Stand-in domains per mode for the scan benchmark, or results for the memory and output benchmarks")
+    parser.add_argument("--modes", type=lambda s: s.split(","), default=["sequential", "threads", "async"],
+                        help="Comma-separated execution modes for the scan benchmark")
+    parser.add_argument("--workers", type=int, default=32, help="Threads for the threads mode of the scan benchmark and for the output benchmark")
+    parser.add_argument("--concurrency", type=int, default=200, help="Domains in flight for the async mode")
+    parser.add_argument("--timeout", type=int, default=5, help="Per-request timeout in seconds")
+    parser.add_argument("--slow-ttfb", type=float, default=0.2, help="Time to first byte of the slow scenario (seconds)")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    # Internal: run a single scan mode against an existing server (used by the scan benchmark)
+    parser.add_argument("--mode", choices=["sequential", "threads", "async"], default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    report = BENCHMARKS[args.benchmark](args)
+    if args.mode:
+        print(json.dumps(report))
+        return
+    report["python"] = sys.version.split()[0]
+    report["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,3 @@
-# Auto-install missing dependencies
-import sys
-import subprocess
-
-def ensure_package(pkg, import_name=None):
-    try:
-        __import__(import_name or pkg)
-    except ImportError:
-        print(f"Missing dependency '{pkg}', installing...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
-
-# Ensure required packages
-ensure_package("requests")
-ensure_package("bs4", "bs4")
-ensure_package("colorama")
-# Add tqdm for progress bar
-ensure_package("tqdm")
-
-import requests
 import time
 import logging
 import argparse
@@ -24,18 +5,62 @@ import csv
 import os
 import random
 import signal
+import subprocess
 import sys
 import re
-from bs4 import BeautifulSoup
+import glob
+import gzip
+import hashlib
+import itertools
+import math
 from datetime import datetime
 import json
-from colorama import init, Fore, Style
+import html
 from collections import Counter
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import codecs
+import contextvars
+import threading
+import queue
+import heapq
+import socket
+import functools
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
 
-# Initialize colorama for terminal color support
-init(autoreset=True)
+# Third-party and heavy modules (requests, colorama, tqdm, asyncio, ssl, sqlite3) are
+# imported where they are used, so importing this module stays cheap and side-effect free
+
+_colorama = None
+
+def _load_colorama():
+    # colorama is only cosmetic: without it the terminal output is simply uncolored
+    global _colorama
+    if _colorama is None:
+        try:
+            import colorama
+            colorama.init(autoreset=True)
+            _colorama = colorama
+        except ImportError:
+            _colorama = False
+    return _colorama
+
+class _LazyColors:
+    # Stands in for colorama's Fore/Style until a color is first printed
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        colorama = _load_colorama()
+        value = getattr(getattr(colorama, self._name), attr) if colorama else ""
+        setattr(self, attr, value)
+        return value
+
+Fore = _LazyColors("Fore")
+Style = _LazyColors("Style")
 
 # Output filenames
 CSV_FILE = "scan_results.csv"
@@ -45,6 +70,92 @@ HTML_FILE = "scan_results.html"
 DEFAULT_DELAY_MIN = 60
 DEFAULT_DELAY_MAX = 180
 
+# In-flight domains for --engine async
+DEFAULT_CONCURRENCY = 500
+# Same redirect limit as requests
+MAX_REDIRECTS = 30
+
+# Error bodies are read in chunks up to this many bytes; reading stops early on a hosting match
+DEFAULT_MAX_BODY_BYTES = 512 * 1024
+BODY_CHUNK_SIZE = 16 * 1024
+# Non-error bodies up to this size are drained so the keep-alive connection can be reused
+DRAIN_BODY_LIMIT = 64 * 1024
+
+# Politeness: at most SCHEDULER_MAX_BUFFERED domains wait in the per-host scheduler for
+# their host's token; once that many wait, no more input is read until one is released
+SCHEDULER_MAX_BUFFERED = 10000
+# How often a driver re-polls a domain stream that has nothing ready (e.g. every host
+# waiting for a token) while it waits for in-flight work
+STREAM_POLL_INTERVAL = 0.05
+# Rough duration of one domain scan, used for time estimates
+ESTIMATED_REQUEST_SECONDS = 1.0
+
+# Coalescing: domains scanned per resolved IP before the others on it are inferred
+COALESCE_SAMPLE_SIZE = 3
+
+# DNS pre-resolution stage
+DEFAULT_DNS_WORKERS = 32
+DEFAULT_DNS_CACHE_SIZE = 100000
+DEFAULT_DNS_TTL = 300
+DNS_NEGATIVE_TTL = 60
+
+# Persistent cross-run result cache (--cache-db)
+DEFAULT_CACHE_TTL = 24 * 3600
+# Seconds a writer waits for another process's transaction before giving up on a batch
+CACHE_BUSY_TIMEOUT = 30.0
+
+# Sharded runs (--processes / --shard): each shard writes its partial results here
+SHARD_RESULTS_FILE = "shard_results.jsonl"
+SHARD_POLL_INTERVAL = 1.0
+
+# Incremental rescans (--incremental): earlier results folders rank the input. A domain's
+# priority adds its volatility (share of checks that changed its category), the recency of
+# its last change (halving every CHANGE_HALF_LIFE) and the time since its last check
+# (saturating at STALE_AFTER); domains without history come first
+HISTORY_GLOB = "scan_results_*"
+RUN_DIR_TIME_FORMAT = "%Y%m%d_%H%M%S"
+RUN_METADATA_FILES = ("metrics.json", "unknown_templates.json")
+CHANGE_HALF_LIFE = 7 * 24 * 3600
+STALE_AFTER = 30 * 24 * 3600
+CHANGES_FILE = "changes.csv"
+
+# Per-phase timing histograms; bucket bounds in seconds (Prometheus "le" labels)
+PHASES = ("dns", "connect", "tls", "ttfb", "body", "categorize", "retry_sleep", "checkpoint")
+PHASE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_WRITE_INTERVAL = 10.0
+# Console verbosity (--quiet / default / --verbose). By default the progress bar shows the
+# most frequent result categories, redrawn at most every CONSOLE_REFRESH_INTERVAL seconds;
+# per-domain lines are only printed with --verbose
+CONSOLE_QUIET = 0
+CONSOLE_NORMAL = 1
+CONSOLE_VERBOSE = 2
+CONSOLE_REFRESH_INTERVAL = 0.5
+CONSOLE_TOP_CATEGORIES = 4
+
+# Retries: exponential backoff with +-50% jitter, limited by a global budget of
+# retries per first attempt (plus a small allowance) so dead hosts cannot multiply the load
+RETRY_JITTER = 0.5
+DEFAULT_RETRY_BUDGET = 0.2
+RETRY_BUDGET_MINIMUM = 10
+# https/http attempts: one after the other (off), both at once (race), or http after a delay (stagger)
+SCHEME_MODES = ("off", "race", "stagger")
+DEFAULT_STAGGER_DELAY = 0.25
+
+# Adaptive concurrency (--adaptive): AIMD between --min-threads and --max-threads. A round
+# of answers is unhealthy when more than AIMD_MAX_ERROR_RATE of them are timeouts or
+# overload answers, or when its median latency exceeds AIMD_LATENCY_FACTOR times the baseline
+DEFAULT_MIN_THREADS = 1
+DEFAULT_MAX_THREADS = 64
+OVERLOAD_STATUS_CODES = (429, 503)
+AIMD_MAX_ERROR_RATE = 0.1
+AIMD_LATENCY_FACTOR = 3.0
+AIMD_MIN_ROUND = 8
+CONCURRENCY_HISTORY_INTERVAL = 10.0
+
+# Keep-alive pool sizing: number of hosts kept per session and connections kept per host
+DEFAULT_POOL_HOSTS = 100
+DEFAULT_POOL_SIZE = 4
+
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15",
@@ -53,33 +164,189 @@ USER_AGENTS = [
     "Mozilla/5.0 (iPhone; CPU iPhone OS 17_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
 ]
 
-def signal_handler(sig, frame):
-    print(Fore.RED + "\nScan interrupted by user.")
-    sys.exit(0)
+# Improved regex for domain validation: allows subdomains and sub.sub.domains
+DOMAIN_RE = re.compile(r"^(?!-)[A-Za-z0-9-]{1,63}(?<!-)(\.[A-Za-z0-9-]{1,63})*\.[A-Za-z]{2,}$")
 
-signal.signal(signal.SIGINT, signal_handler)
+# Invalid input lines quoted in the end-of-input report
+INVALID_SAMPLE_SIZE = 5
+# Unique domains kept in memory before they are written to the deduplicator's exact set on disk
+DEDUP_FLUSH_EVERY = 10000
 
 def is_valid_domain(domain):
-    # Improved regex for domain validation: allows subdomains and sub.sub.domains
-    pattern = r"^(?!-)[A-Za-z0-9-]{1,63}(?<!-)(\.[A-Za-z0-9-]{1,63})*\.[A-Za-z]{2,}$"
-    return re.match(pattern, domain) is not None
+    return DOMAIN_RE.match(domain) is not None
 
-def read_domains(file_path):
+class DomainDeduplicator:
+    # Scalable Bloom filter: memory grows by about 4 bytes per unique domain instead of
+    # holding every string. Each new stage doubles in size and halves its error rate.
+    # Every domain is also written, in batches, to a private temporary SQLite file, and a
+    # Bloom hit is only reported as a duplicate once that exact set confirms it, so a
+    # false positive never drops a unique domain.
+    def __init__(self, initial_capacity=1_000_000, error_rate=1e-6, flush_every=DEDUP_FLUSH_EVERY):
+        self.initial_capacity = max(1, initial_capacity)
+        self.error_rate = error_rate
+        self.flush_every = max(1, flush_every)
+        self.false_positives = 0
+        self._stages = []
+        self._add_stage()
+        self._pending = set()
+        self._db = None
+
+    def _add_stage(self):
+        capacity = self.initial_capacity * 2 ** len(self._stages)
+        error_rate = self.error_rate / 2 ** (len(self._stages) + 1)
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        self._stages.append({"bits": bits, "hashes": hashes, "capacity": capacity, "count": 0,
+                             "array": bytearray((bits + 7) // 8)})
+
+    def _seen(self, item):
+        if item in self._pending:
+            return True
+        if self._db is None:
+            return False
+        return self._db.execute("SELECT 1 FROM seen WHERE domain = ?", (item,)).fetchone() is not None
+
+    def _remember(self, item):
+        self._pending.add(item)
+        if len(self._pending) < self.flush_every:
+            return
+        if self._db is None:
+            import sqlite3
+            # An empty name is a private on-disk database that SQLite deletes on close
+            self._db = sqlite3.connect("", check_same_thread=False)
+            self._db.execute("CREATE TABLE seen (domain TEXT PRIMARY KEY) WITHOUT ROWID")
+        with self._db:
+            self._db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((d,) for d in self._pending))
+        self._pending.clear()
+
+    def add(self, item):
+        # Returns False if the item was seen before
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for stage in self._stages:
+            array = stage["array"]
+            bits = stage["bits"]
+            for i in range(stage["hashes"]):
+                pos = (h1 + i * h2) % bits
+                if not array[pos >> 3] & (1 << (pos & 7)):
+                    break
+            else:
+                if self._seen(item):
+                    return False
+                self.false_positives += 1
+                self._remember(item)
+                return True
+        self._remember(item)
+        stage = self._stages[-1]
+        if stage["count"] >= stage["capacity"]:
+            self._add_stage()
+            stage = self._stages[-1]
+        array = stage["array"]
+        bits = stage["bits"]
+        for i in range(stage["hashes"]):
+            pos = (h1 + i * h2) % bits
+            array[pos >> 3] |= 1 << (pos & 7)
+        stage["count"] += 1
+        return True
+
+    @property
+    def memory_bytes(self):
+        return sum(len(stage["array"]) for stage in self._stages)
+
+class InputStats:
+    # Aggregated counters for the input reader, reported once instead of per line
+    def __init__(self):
+        self.lines = 0
+        self.valid = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.invalid_samples = []
+
+    def report(self):
+        logging.info(f"Input: {self.lines} lines, {self.valid} domains, {self.invalid} invalid, {self.duplicates} duplicates")
+        if self.invalid:
+            samples = ", ".join(repr(s) for s in self.invalid_samples)
+            logging.warning(f"Skipped {self.invalid} invalid domains, e.g. {samples}")
+            print(Fore.YELLOW + f"Skipped {self.invalid} invalid domains (e.g. {samples})")
+        if self.duplicates:
+            print(Fore.YELLOW + f"Skipped {self.duplicates} duplicate domains")
+
+def open_domain_source(file_path):
+    # "-" reads from stdin; *.gz files are decompressed on the fly
+    if file_path == "-":
+        return sys.stdin
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rt", encoding="utf-8", errors="replace")
+    return open(file_path, "r", encoding="utf-8", errors="replace")
+
+def count_input_lines(file_path):
+    # Quick upper bound for progress and time estimates; None for streams we cannot re-read
+    if file_path == "-" or file_path.endswith(".gz") or not os.path.isfile(file_path):
+        return None
+    count = 0
+    last = b"\n"
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            count += chunk.count(b"\n")
+            last = chunk[-1:]
+    return count if last == b"\n" else count + 1
+
+def _iter_domain_lines(f, stats, deduplicator):
+    try:
+        for line in f:
+            stats.lines += 1
+            domain = line.strip()
+            if not domain:
+                continue
+            if DOMAIN_RE.match(domain) is None:
+                stats.invalid += 1
+                if len(stats.invalid_samples) < INVALID_SAMPLE_SIZE:
+                    stats.invalid_samples.append(domain[:100])
+                continue
+            if deduplicator is not None and not deduplicator.add(domain.lower()):
+                stats.duplicates += 1
+                continue
+            stats.valid += 1
+            yield domain
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def iter_domains(file_path, stats=None, deduplicator=None):
+    # Lazily yields valid, de-duplicated domains so scanning starts before the input is read
     try:
-        with open(file_path, 'r') as f:
-            domains = [line.strip() for line in f if line.strip()]
+        f = open_domain_source(file_path)
     except Exception as e:
         logging.error(f"Failed to read input file '{file_path}': {e}")
         print(Fore.RED + f"Error reading input file '{file_path}': {e}")
         sys.exit(1)
-    valid_domains = []
-    for d in domains:
-        if is_valid_domain(d):
-            valid_domains.append(d)
-        else:
-            logging.warning(f"Invalid domain skipped: {d}")
-            print(Fore.YELLOW + f"Skipping invalid domain: {d}")
-    return valid_domains
+    return _iter_domain_lines(f, stats if stats is not None else InputStats(), deduplicator)
+
+def read_domains(file_path):
+    stats = InputStats()
+    domains = list(iter_domains(file_path, stats, DomainDeduplicator()))
+    stats.report()
+    return domains
+
+class PatternFileError(Exception):
+    # Raised when a --patterns file cannot be read or does not map providers to keyword lists
+    pass
+
+def parse_hosting_patterns(source, path="<patterns>"):
+    # Parses and validates the JSON text (or bytes) of a patterns file
+    try:
+        patterns = json.loads(source)
+    except ValueError as e:
+        raise PatternFileError(f"Invalid JSON in hosting patterns file {path}: {e}") from e
+    if not isinstance(patterns, dict):
+        raise PatternFileError(f"Hosting patterns file {path} must hold an object of provider -> keyword list")
+    for provider, keywords in patterns.items():
+        if not provider:
+            raise PatternFileError(f"Hosting patterns file {path} has an empty provider name")
+        if not isinstance(keywords, list) or not all(isinstance(k, str) for k in keywords):
+            raise PatternFileError(f"Keywords of provider '{provider}' in {path} must be a list of strings")
+    return patterns
 
 def load_hosting_patterns(json_path=None):
     default_patterns = {
@@ -167,101 +434,2260 @@ def load_hosting_patterns(json_path=None):
         ],
         # Add more as needed...
     }
-    if json_path and os.path.exists(json_path):
+    if not json_path:
+        return default_patterns
+    try:
+        with open(json_path, "rb") as f:
+            source = f.read()
+    except OSError as e:
+        raise PatternFileError(f"Cannot read hosting patterns from {json_path}: {e}") from e
+    return parse_hosting_patterns(source, json_path)
+
+# Page fingerprints: only the first FINGERPRINT_MAX_CHARS of a page are fingerprinted, and
+# pages whose 64-bit simhashes differ in at most NEAR_DUPLICATE_BITS bits are one template
+FINGERPRINT_MAX_CHARS = 64 * 1024
+# Keeps every simhash bit count below 2**16 (see _SPREAD_BYTE)
+FINGERPRINT_MAX_TOKENS = 16384
+NEAR_DUPLICATE_BITS = 3
+# Simhash bands for the near-duplicate index; with 4 bands of 16 bits, two hashes within
+# 3 bits of each other always share at least one band
+SIMHASH_BANDS = 4
+CLUSTER_SAMPLE_SIZE = 5
+MAX_UNKNOWN_CLUSTERS = 10000
+# Exact page digests kept by the fingerprint index; the least recently used are dropped
+MAX_EXACT_DIGESTS = 100000
+# Near-duplicate templates kept by the fingerprint index; the least recently used are dropped
+MAX_TEMPLATES = 10000
+
+# Host names, numbers and words; host names and numbers are what differs between
+# otherwise identical parked pages
+_HOST_RE = re.compile(r"\b[a-z0-9-]+(?:\.[a-z0-9-]+)*\.[a-z]{2,}\b")
+_DIGITS_RE = re.compile(r"\d+")
+_TOKEN_RE = re.compile(r"\w+")
+# 8 bits spread into 16-bit lanes, so the simhash bit counts of many features are summed
+# with one big-integer addition per feature instead of 64 separate counters
+_SPREAD_BYTE = [sum(((b >> i) & 1) << (16 * i) for i in range(8)) for b in range(256)]
+
+PageFingerprint = namedtuple("PageFingerprint", ["digest", "simhash", "excerpt"])
+
+def simhash(weights):
+    # 64-bit simhash of a {feature: weight} mapping; total weight must stay below 2**16
+    total = 0
+    count = 0
+    for feature, weight in weights.items():
+        h = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        total += sum(_SPREAD_BYTE[b] << (128 * j) for j, b in enumerate(h)) * weight
+        count += weight
+    value = 0
+    for bit in range(64):
+        if ((total >> (16 * bit)) & 0xFFFF) * 2 > count:
+            value |= 1 << bit
+    return value
+
+def mask_page_text(text):
+    return _DIGITS_RE.sub("0", _HOST_RE.sub("host", text.lower()))
+
+def survives_masking(keyword):
+    # False for keywords such as "ovh.com" that page_fingerprint masks: a template learned
+    # from such a match would also label the same page naming any other host
+    return mask_page_text(keyword) == keyword.lower()
+
+def page_fingerprint(content):
+    # Exact digest of the normalized page plus a simhash of its word pairs
+    text = mask_page_text(content[:FINGERPRINT_MAX_CHARS])
+    tokens = _TOKEN_RE.findall(text)[:FINGERPRINT_MAX_TOKENS]
+    normalized = " ".join(tokens)
+    digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+    pairs = Counter(f"{a} {b}" for a, b in zip(tokens, tokens[1:])) or Counter(tokens)
+    return PageFingerprint(digest, simhash(pairs), normalized[:160])
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+def _simhash_bands(value):
+    width = 64 // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [(band, (value >> (band * width)) & mask) for band in range(SIMHASH_BANDS)]
+
+class FingerprintIndex:
+    # Known page templates (fingerprint -> category) with an exact-digest dict and a banded
+    # simhash index for near-duplicates, plus clusters of unknown templates. Persisted as
+    # JSON between runs; a cluster given a "category" in the file becomes a known template.
+    # Templates and clusters are keyed by simhash, which is unique since a near-duplicate
+    # is never added twice; the bands map each band value to the simhashes that have it.
+    def __init__(self, max_distance=NEAR_DUPLICATE_BITS, max_exact=MAX_EXACT_DIGESTS, max_templates=MAX_TEMPLATES):
+        self.max_distance = max_distance
+        self.max_exact = max_exact
+        self.max_templates = max_templates
+        self.enabled = False
+        self.path = None
+        self.exact_hits = 0
+        self.near_hits = 0
+        self._lock = threading.Lock()
+        self._exact = OrderedDict()
+        self._templates = OrderedDict()
+        self._bands = {}
+        self._clusters = {}
+        self._cluster_bands = {}
+
+    def _nearest(self, bands, items, simhash_value):
+        for key in _simhash_bands(simhash_value):
+            for candidate in bands.get(key, ()):
+                if hamming_distance(candidate, simhash_value) <= self.max_distance:
+                    return items[candidate]
+        return None
+
+    def _add(self, bands, items, item):
+        items[item["simhash"]] = item
+        for key in _simhash_bands(item["simhash"]):
+            bands.setdefault(key, []).append(item["simhash"])
+
+    def _remove(self, bands, items, simhash_value):
+        del items[simhash_value]
+        for key in _simhash_bands(simhash_value):
+            bucket = bands[key]
+            bucket.remove(simhash_value)
+            if not bucket:
+                del bands[key]
+
+    def lookup(self, fingerprint):
+        with self._lock:
+            category = self._exact.get(fingerprint.digest)
+            if category is not None:
+                self._exact.move_to_end(fingerprint.digest)
+                self.exact_hits += 1
+                return category
+            template = self._nearest(self._bands, self._templates, fingerprint.simhash)
+            if template is None:
+                return None
+            self._templates.move_to_end(template["simhash"])
+            self.near_hits += 1
+            return template["category"]
+
+    def _remember_exact(self, digest, category):
+        self._exact[digest] = category
+        self._exact.move_to_end(digest)
+        if len(self._exact) > self.max_exact:
+            self._exact.popitem(last=False)
+
+    def learn(self, fingerprint, category, source="pattern"):
+        with self._lock:
+            if fingerprint.digest:
+                self._remember_exact(fingerprint.digest, category)
+            template = self._nearest(self._bands, self._templates, fingerprint.simhash)
+            if template is not None:
+                self._templates.move_to_end(template["simhash"])
+                return
+            self._add(self._bands, self._templates, {"simhash": fingerprint.simhash, "category": category,
+                                                     "source": source, "excerpt": fingerprint.excerpt})
+            if len(self._templates) > self.max_templates:
+                self._remove(self._bands, self._templates, next(iter(self._templates)))
+
+    def record_unknown(self, fingerprint, domain=None):
+        with self._lock:
+            cluster = self._nearest(self._cluster_bands, self._clusters, fingerprint.simhash)
+            if cluster is None:
+                if len(self._clusters) >= MAX_UNKNOWN_CLUSTERS:
+                    return
+                cluster = {"simhash": fingerprint.simhash, "count": 0, "samples": [], "excerpt": fingerprint.excerpt}
+                self._add(self._cluster_bands, self._clusters, cluster)
+            cluster["count"] += 1
+            if domain and len(cluster["samples"]) < CLUSTER_SAMPLE_SIZE:
+                cluster["samples"].append(domain)
+
+    def unknown_clusters(self, min_count=2):
+        with self._lock:
+            clusters = [c for c in self._clusters.values() if c["count"] >= min_count]
+        return [{"fingerprint": f"{c['simhash']:016x}", "count": c["count"], "sample_domains": c["samples"],
+                 "excerpt": c["excerpt"]} for c in sorted(clusters, key=lambda c: -c["count"])]
+
+    def stats(self):
+        with self._lock:
+            return {"templates": len(self._templates), "exact_hits": self.exact_hits, "near_hits": self.near_hits,
+                    "unknown_clusters": len(self._clusters)}
+
+    def load(self, path):
+        self.path = path
+        self.enabled = True
         try:
-            with open(json_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            print(Fore.YELLOW + f"Warning: Failed to load hosting patterns from {json_path}: {e}")
-    return default_patterns
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return self
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not load fingerprint index '{path}': {e}")
+            print(Fore.RED + f"Could not load fingerprint index '{path}': {e}")
+            return self
+        for template in data.get("templates", []):
+            self.learn(PageFingerprint(template.get("digest", ""), int(template["simhash"], 16), template.get("excerpt", "")),
+                       template["category"], template.get("source", "pattern"))
+        with self._lock:
+            for digest, category in data.get("exact", []):
+                self._remember_exact(digest, category)
+        for cluster in data.get("unknown", []):
+            fingerprint = PageFingerprint("", int(cluster["fingerprint"], 16), cluster.get("excerpt", ""))
+            if cluster.get("category"):
+                # Labeled by hand: from now on this template is known
+                self.learn(fingerprint, cluster["category"], "manual")
+        return self
 
-def advanced_error_detection(content):
-    # Placeholder for advanced heuristics (regex, HTML structure, ML, etc.)
-    # Return a string category or None if not detected
-    return None
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            templates = [{"simhash": f"{t['simhash']:016x}", "category": t["category"], "source": t["source"],
+                          "excerpt": t["excerpt"]} for t in self._templates.values()]
+            # Least recently used first, so a reload keeps the same templates and digests when full
+            exact = [[digest, category] for digest, category in self._exact.items()]
+        data = {"version": 1, "templates": templates, "exact": exact,
+                "unknown": [dict(c, category=None) for c in self.unknown_clusters(min_count=1)]}
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.error(f"Failed to save fingerprint index '{path}': {e}")
+
+FINGERPRINTS = FingerprintIndex()
+
+def advanced_error_detection(content, fingerprint=None):
+    # Known page templates: a page identical or near-identical to one already classified
+    # gets that category from an index lookup. Returns None when nothing is known.
+    if not FINGERPRINTS.enabled:
+        return None
+    return FINGERPRINTS.lookup(fingerprint or page_fingerprint(content))
+
+# <head> signals: at most HEAD_MAX_CHARS of a page are parsed, in HEAD_PARSE_SLICE
+# pieces, and parsing gives up once it used HEAD_PARSE_BUDGET seconds of CPU time
+HEAD_MAX_CHARS = 32 * 1024
+HEAD_PARSE_SLICE = 2048
+HEAD_PARSE_BUDGET = 0.002
+
+# Provider rules for <head> signals. Host names match the meta refresh target and the
+# canonical link (parking services redirect there); other keywords match the title and
+# meta generator of default server and control panel pages, ignoring case. The host-like
+# keywords of the hosting patterns (e.g. "ovh.com") are used as host rules as well.
+DEFAULT_HEAD_RULES = {
+    "sedo": ["sedo.com", "sedoparking.com"],
+    "bodis": ["bodis.com"],
+    "parkingcrew": ["parkingcrew.net"],
+    "afternic": ["afternic.com"],
+    "dan": ["dan.com"],
+    "hugedomains": ["hugedomains.com"],
+    "godaddy": ["godaddy.com"],
+    "plesk": ["Plesk"],
+    "cpanel": ["cPanel", "Future home of something quite cool"],
+    "directadmin": ["DirectAdmin"],
+    "apache": ["Apache2 Ubuntu Default Page", "Apache2 Debian Default Page", "Test Page for the Apache HTTP Server"],
+    "nginx": ["Welcome to nginx"],
+    "iis": ["IIS Windows Server", "IIS7"],
+}
+
+HeadSignals = namedtuple("HeadSignals", ["title", "generator", "refresh", "canonical"])
+
+class _HeadDone(Exception):
+    pass
+
+class HeadParser(HTMLParser):
+    # Collects the title, meta generator/refresh and canonical link, and stops at the
+    # end of <head> (or the first tag that can only appear in <body>)
+    BODY_TAGS = frozenset(["body", "div", "p", "h1", "h2", "table", "main", "section", "article"])
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = []
+        self.generator = ""
+        self.refresh = ""
+        self.canonical = ""
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.BODY_TAGS:
+            raise _HeadDone
+        if tag == "title":
+            self._in_title = True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            name = (attrs.get("name") or "").lower()
+            if name == "generator":
+                self.generator = attrs.get("content") or ""
+            elif (attrs.get("http-equiv") or "").lower() == "refresh":
+                self.refresh = attrs.get("content") or ""
+        elif tag == "link" and "canonical" in (dict(attrs).get("rel") or "").lower().split():
+            self.canonical = dict(attrs).get("href") or ""
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag == "head":
+            raise _HeadDone
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title.append(data)
+
+    def signals(self):
+        return HeadSignals(" ".join("".join(self.title).split()), self.generator.strip(),
+                           self.refresh.strip(), self.canonical.strip())
+
+def extract_head_signals(content, budget=HEAD_PARSE_BUDGET, clock=time.thread_time):
+    # Feeds the page to HeadParser piece by piece and stops at the end of <head>, after
+    # HEAD_MAX_CHARS or when the CPU budget is spent (whatever was found so far is kept)
+    parser = HeadParser()
+    start = clock()
+    try:
+        for pos in range(0, min(len(content), HEAD_MAX_CHARS), HEAD_PARSE_SLICE):
+            parser.feed(content[pos:pos + HEAD_PARSE_SLICE])
+            if clock() - start > budget:
+                METRICS.count("head_parse_budget_exceeded")
+                break
+    except _HeadDone:
+        pass
+    except Exception as e:
+        # HTMLParser is lenient, but a broken page must never fail the scan
+        logging.debug(f"Head parsing stopped: {e}")
+    return parser.signals()
+
+def _refresh_target(refresh):
+    # "5; url=https://example.com/" -> "https://example.com/"
+    _, _, target = refresh.partition("=") if "url" in refresh.lower() else ("", "", "")
+    return target.strip().strip("'\"")
+
+def _url_host(url):
+    try:
+        return (urlsplit(url if "//" in url else "//" + url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+class HeadRules:
+    # Compiled DEFAULT_HEAD_RULES plus the host-like hosting keywords. A host rule matches
+    # the host or any subdomain of it. The other hosting keywords are left out: they are
+    # already found in the raw body, title and generator included.
+    def __init__(self, hosting_patterns, head_rules=DEFAULT_HEAD_RULES):
+        self.host_rules = []
+        self.text_rules = []
+        for provider, keywords in hosting_patterns.items():
+            self.host_rules += [(k.lower(), f"{provider}_error") for k in keywords if DOMAIN_RE.match(k)]
+        for provider, keywords in head_rules.items():
+            for keyword in filter(None, (k.lower() for k in keywords)):
+                rules = self.host_rules if DOMAIN_RE.match(keyword) else self.text_rules
+                rules.append((keyword, f"{provider}_error"))
+
+    def match(self, signals):
+        rule = self.match_rule(signals)
+        return rule[0] if rule else None
+
+    def match_rule(self, signals):
+        # (category, learnable) of the first matching rule, or None. Host rules are never
+        # learnable: page fingerprints mask host names, so the template would not show
+        # which host it points at.
+        hosts = [host for host in (_url_host(_refresh_target(signals.refresh)), _url_host(signals.canonical)) if host]
+        for keyword, category in self.host_rules:
+            for host in hosts:
+                if host == keyword or host.endswith("." + keyword):
+                    return category, False
+        text = f"{signals.title}\n{signals.generator}".lower()
+        if text.strip():
+            for keyword, category in self.text_rules:
+                if keyword in text:
+                    return category, survives_masking(keyword)
+        return None
+
+# Compiled --patterns artifacts; bump PATTERN_CACHE_VERSION when PatternMatcher's attributes
+# or DEFAULT_HEAD_RULES change
+PATTERN_CACHE_VERSION = 3
+PATTERN_CACHE_SUFFIX = ".compiled"
+PATTERN_RELOAD_INTERVAL = 5.0
+
+# Generic error codes looked for in page content, in priority order
+GENERIC_ERROR_CODES = ["404", "500", "403", "502", "503"]
+
+class PatternMatcher:
+    # Hosting keywords and generic error codes compiled once into a single prefix-trie
+    # regex. One pass over the content finds every keyword occurrence; the first-match
+    # priority of the old provider/keyword loops is kept by ranking each keyword.
+    def __init__(self, hosting_patterns):
+        self.hosting_patterns = hosting_patterns
+        self._categories = []
+        # Per keyword rank: whether a page matched by it may teach its template to FINGERPRINTS
+        self._learnable = []
+        self._trie = {}
+        self._always = None
+        self.max_keyword_length = 1
+        entries = [(keyword, f"{provider}_error") for provider, keywords in hosting_patterns.items() for keyword in keywords]
+        self.provider_count = len(entries)
+        entries += [(code, f"custom_{code}") for code in GENERIC_ERROR_CODES]
+        for priority, (keyword, category) in enumerate(entries):
+            self._categories.append(category)
+            self._learnable.append(survives_masking(keyword))
+            if not keyword:
+                # An empty keyword matches any content, as `"" in content` does
+                if self._always is None:
+                    self._always = priority
+                continue
+            self.max_keyword_length = max(self.max_keyword_length, len(keyword))
+            node = self._trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node.setdefault("", priority)
+        self._regex = re.compile(self._trie_regex(self._trie)) if self._trie else None
+        self.head_rules = HeadRules(hosting_patterns)
+
+    @classmethod
+    def _trie_regex(cls, node):
+        # Any complete keyword is enough to mark a candidate position, so stop at the first terminal
+        if "" in node:
+            return ""
+        branches = [re.escape(ch) + cls._trie_regex(child) for ch, child in sorted(node.items())]
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    def to_artifact(self):
+        # Plain JSON data of the validated patterns, the trie and the regex source, so that
+        # loading skips validation and trie building and only runs re.compile
+        return {"hosting_patterns": self.hosting_patterns, "categories": self._categories,
+                "learnable": self._learnable, "trie": self._trie, "always": self._always,
+                "max_keyword_length": self.max_keyword_length, "provider_count": self.provider_count,
+                "regex": self._regex.pattern if self._regex else None,
+                "host_rules": self.head_rules.host_rules, "text_rules": self.head_rules.text_rules}
+
+    @classmethod
+    def from_artifact(cls, data):
+        # Raises KeyError, TypeError, ValueError or re.error for data that is not a to_artifact() dict
+        matcher = cls.__new__(cls)
+        matcher.hosting_patterns = data["hosting_patterns"]
+        matcher._categories = list(data["categories"])
+        matcher._learnable = list(data["learnable"])
+        matcher._trie = data["trie"]
+        matcher._always = data["always"]
+        matcher.max_keyword_length = int(data["max_keyword_length"])
+        matcher.provider_count = int(data["provider_count"])
+        if not (isinstance(matcher.hosting_patterns, dict) and isinstance(matcher._trie, dict)
+                and len(matcher._learnable) == len(matcher._categories) >= matcher.provider_count):
+            raise ValueError("inconsistent compiled patterns")
+        matcher._regex = re.compile(data["regex"]) if data["regex"] is not None else None
+        head_rules = HeadRules.__new__(HeadRules)
+        head_rules.host_rules = [(keyword, category) for keyword, category in data["host_rules"]]
+        head_rules.text_rules = [(keyword, category) for keyword, category in data["text_rules"]]
+        matcher.head_rules = head_rules
+        return matcher
+
+    @property
+    def no_match(self):
+        return self._always if self._always is not None else len(self._categories)
+
+    def is_provider(self, priority):
+        return priority < self.provider_count
+
+    def best_priority(self, content, best=None):
+        # Lowest keyword rank found in content; `best` carries the rank found in earlier chunks
+        best = self.no_match if best is None else best
+        if self._regex is None or best == 0:
+            return best
+        search = self._regex.search
+        trie = self._trie
+        end = len(content)
+        pos = 0
+        while best > 0:
+            match = search(content, pos)
+            if match is None:
+                break
+            start = match.start()
+            # Several keywords may start here; walk the trie to rank all of them
+            node = trie
+            i = start
+            while node is not None:
+                priority = node.get("")
+                if priority is not None and priority < best:
+                    best = priority
+                if i >= end:
+                    break
+                node = node.get(content[i])
+                i += 1
+            pos = start + 1
+        return best
+
+    def categorize(self, content, best=None, domain=None):
+        # `best` may come from a streaming scan of the same content to avoid a second pass
+        fingerprint = page_fingerprint(content) if FINGERPRINTS.enabled and content else None
+        looked_up = False
+        if fingerprint and best is None:
+            # A known template is labeled by an index lookup, without scanning for keywords
+            known = advanced_error_detection(content, fingerprint)
+            if known:
+                return known
+            looked_up = True
+        best = self.best_priority(content) if best is None else best
+        if best < self.provider_count:
+            if fingerprint and self._learnable[best]:
+                FINGERPRINTS.learn(fingerprint, self._categories[best])
+            return self._categories[best]
+        # Title, meta generator/refresh and canonical link, parsed within a CPU budget
+        rule = self.head_rules.match_rule(extract_head_signals(content)) if content else None
+        if rule:
+            head, learnable = rule
+            if fingerprint and learnable:
+                FINGERPRINTS.learn(fingerprint, head)
+            return head
+        # Advanced heuristics
+        adv = None if looked_up else advanced_error_detection(content, fingerprint)
+        if adv:
+            return adv
+        if fingerprint:
+            FINGERPRINTS.record_unknown(fingerprint, domain)
+        # If no hosting-specific error/parked page detected, fall back to generic error codes in content
+        if best < len(self._categories):
+            return self._categories[best]
+        return "custom"
+
+_compiled_patterns = {}
+
+def compile_patterns(hosting_patterns):
+    # Accepts a patterns dict or an already compiled PatternMatcher; dicts are compiled once and cached
+    if isinstance(hosting_patterns, PatternMatcher):
+        return hosting_patterns
+    cached = _compiled_patterns.get(id(hosting_patterns))
+    if cached is not None and cached.hosting_patterns is hosting_patterns:
+        return cached
+    if len(_compiled_patterns) >= 8:
+        _compiled_patterns.clear()
+    matcher = PatternMatcher(hosting_patterns)
+    _compiled_patterns[id(hosting_patterns)] = matcher
+    return matcher
+
+class PatternDatabase:
+    # A --patterns file and its compiled artifact (<file>.compiled by default). The artifact
+    # is the JSON of PatternMatcher.to_artifact(), keyed by the artifact format and the
+    # SHA-256 of the source, and is only rebuilt when one of them changes. Nothing in it is
+    # executed: loading parses JSON and compiles the regex. reload() is cheap enough to
+    # poll during a scan: it stats the file and only reads it after a change.
+    # A file that fails validation raises PatternFileError and the current matcher stays.
+    def __init__(self, path, cache_path=None):
+        self.path = path
+        self.cache_path = cache_path or path + PATTERN_CACHE_SUFFIX
+        self.matcher = None
+        self.source_hash = None
+        self.from_cache = False
+        self.reloads = 0
+        self._stat = None
+
+    def _key(self, source_hash):
+        return [PATTERN_CACHE_VERSION, source_hash]
+
+    def load(self):
+        try:
+            stat = os.stat(self.path)
+            with open(self.path, "rb") as f:
+                source = f.read()
+        except OSError as e:
+            raise PatternFileError(f"Cannot read hosting patterns from {self.path}: {e}") from e
+        self._stat = (stat.st_mtime_ns, stat.st_size)
+        source_hash = hashlib.sha256(source).hexdigest()
+        if source_hash == self.source_hash:
+            return self.matcher
+        matcher = self._read_artifact(source_hash)
+        self.from_cache = matcher is not None
+        if matcher is None:
+            matcher = PatternMatcher(parse_hosting_patterns(source, self.path))
+            self._write_artifact(source_hash, matcher)
+        # One assignment each, so readers never see a half-built matcher
+        self.matcher = matcher
+        self.source_hash = source_hash
+        return matcher
+
+    def reload(self):
+        # Returns the new matcher if the source content changed since the last load, else None
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            raise PatternFileError(f"Cannot read hosting patterns from {self.path}: {e}") from e
+        if (stat.st_mtime_ns, stat.st_size) == self._stat:
+            return None
+        previous = self.source_hash
+        matcher = self.load()
+        if self.source_hash == previous:
+            return None
+        self.reloads += 1
+        return matcher
+
+    def _read_artifact(self, source_hash):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("key") != self._key(source_hash):
+                return None
+            return PatternMatcher.from_artifact(data["matcher"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, re.error) as e:
+            logging.warning(f"Ignoring unreadable compiled patterns '{self.cache_path}': {e}")
+            return None
+
+    def _write_artifact(self, source_hash, matcher):
+        # Written to a temporary file and renamed, so concurrent shards never read a partial artifact
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"key": self._key(source_hash), "matcher": matcher.to_artifact()},
+                                   ensure_ascii=False, separators=(",", ":")))
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logging.warning(f"Could not write compiled patterns '{self.cache_path}': {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
 
 def categorize_response(content, hosting_patterns):
-    # Check for each hosting provider's error/parked page
-    for provider, keywords in hosting_patterns.items():
-        for keyword in keywords:
-            if keyword in content:
-                return f"{provider}_error"
-    # Advanced heuristics
-    adv = advanced_error_detection(content)
-    if adv:
-        return adv
-    # If no hosting-specific error/parked page detected, check for generic error codes in content
-    if "404" in content:
-        return "custom_404"
-    if "500" in content:
-        return "custom_500"
-    if "403" in content:
-        return "custom_403"
-    if "502" in content:
-        return "custom_502"
-    if "503" in content:
-        return "custom_503"
-    return "custom"
-
-def scan_domain(domain, hosting_patterns, dry_run=False, retries=2, timeout=5):
-    domain = domain.strip()
-    urls_to_check = [f"https://{domain}", f"http://{domain}"] if not domain.startswith("http") else [domain]
+    # Check for each hosting provider's error/parked page and generic error codes in one pass
+    return compile_patterns(hosting_patterns).categorize(content)
+
+class BodyScanner:
+    # Decodes an error body chunk by chunk (multibyte characters may be split across
+    # chunks) and ranks hosting keywords as it goes. Keywords split across chunks are
+    # found by re-scanning the last max_keyword_length-1 characters with each new chunk.
+    def __init__(self, matcher, encoding="utf-8", max_bytes=DEFAULT_MAX_BODY_BYTES):
+        try:
+            self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.matcher = matcher
+        self.max_bytes = max_bytes
+        self.best = matcher.no_match
+        self.bytes_read = 0
+        self._overlap = matcher.max_keyword_length - 1
+        self._parts = []
+        self._tail = ""
+
+    def _scan(self, text):
+        if not text:
+            return
+        self._parts.append(text)
+        window = self._tail + text
+        self.best = self.matcher.best_priority(window, self.best)
+        self._tail = window[-self._overlap:] if self._overlap else ""
 
-    for url in urls_to_check:
-        headers = {"User-Agent": random.choice(USER_AGENTS)}
+    def feed(self, chunk):
+        # Returns True once there is no point in reading further
+        remaining = self.max_bytes - self.bytes_read
+        if len(chunk) > remaining:
+            chunk = chunk[:remaining]
+        self.bytes_read += len(chunk)
+        self._scan(self._decoder.decode(chunk))
+        return self.matcher.is_provider(self.best) or self.bytes_read >= self.max_bytes
 
+    def finish(self):
+        self._scan(self._decoder.decode(b"", final=True))
+        return "".join(self._parts), self.best
+
+def read_error_body(chunks, content_type, matcher, max_bytes=DEFAULT_MAX_BODY_BYTES):
+    scanner = BodyScanner(matcher, _charset_from_content_type(content_type), max_bytes)
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    return scanner.finish()
+
+def _release_small_body(response):
+    # Drain short bodies so urllib3 can put the connection back in the keep-alive pool
+    try:
+        length = int(response.headers.get("content-length", ""))
+    except ValueError:
+        return
+    if length <= DRAIN_BODY_LIMIT:
+        for _ in response.iter_content(BODY_CHUNK_SIZE):
+            pass
+
+class Histogram:
+    # Fixed-bucket histogram; quantiles are estimated as the upper bound of their bucket
+    def __init__(self, buckets=PHASE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def cumulative(self):
+        return list(itertools.accumulate(self.counts))
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum_seconds": round(self.sum, 6),
+            "p50_seconds": self.quantile(0.50),
+            "p95_seconds": self.quantile(0.95),
+            "p99_seconds": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.cumulative())),
+        }
+
+class ScanMetrics:
+    # Thread-safe phase histograms and counters for one scan, exported as a Prometheus
+    # text file and a JSON dump in the results directory
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.counters = Counter()
+        self.categories = Counter()
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            self.phases[phase].observe(seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_result(self, result):
+        with self._lock:
+            self.categories[result['category']] += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "phases": {phase: histogram.to_dict() for phase, histogram in self.phases.items()},
+                "counters": dict(self.counters),
+                "results": dict(self.categories),
+            }
+
+    def prometheus_text(self):
+        lines = ["# HELP error_checker_phase_seconds Time spent per scan phase.",
+                 "# TYPE error_checker_phase_seconds histogram"]
+        with self._lock:
+            for phase, histogram in self.phases.items():
+                bounds = [str(b) for b in histogram.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.cumulative()):
+                    lines.append(f'error_checker_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {count}')
+                lines.append(f'error_checker_phase_seconds_sum{{phase="{phase}"}} {histogram.sum:.6f}')
+                lines.append(f'error_checker_phase_seconds_count{{phase="{phase}"}} {histogram.count}')
+            lines += ["# HELP error_checker_results_total Scanned domains per result category.",
+                      "# TYPE error_checker_results_total counter"]
+            lines += [f'error_checker_results_total{{category="{category}"}} {count}'
+                      for category, count in sorted(self.categories.items())]
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE error_checker_{name}_total counter", f"error_checker_{name}_total {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, results_dir):
+        # Written to temporary files and renamed, so collectors never read a partial file
+        for name, text in (("metrics.prom", self.prometheus_text()), ("metrics.json", json.dumps(self.to_dict(), indent=2))):
+            path = os.path.join(results_dir, name)
+            try:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(path + ".tmp", path)
+            except Exception as e:
+                logging.error(f"Failed to write metrics file '{path}': {e}")
+
+    def phase_summary(self):
+        with self._lock:
+            return ", ".join(f"{phase} {h.quantile(0.5) * 1000:g}/{h.quantile(0.95) * 1000:g}"
+                             for phase, h in self.phases.items() if h.count)
+
+METRICS = ScanMetrics()
+
+class ConsoleRenderer:
+    # Terminal output of a scan. While a progress bar is attached, workers only append their
+    # per-domain lines to a buffer; the thread consuming results counts them and redraws the
+    # bar (with any buffered lines above it) at most every `interval` seconds, so no worker
+    # waits on the terminal. Without a bar (library use) lines are printed as they come.
+    def __init__(self, verbosity=CONSOLE_VERBOSE, interval=CONSOLE_REFRESH_INTERVAL, clock=time.monotonic):
+        self.verbosity = verbosity
+        self.interval = interval
+        self.clock = clock
+        self.counts = Counter()
+        self._progress = None
+        self._lines = []
+        self._lock = threading.Lock()
+        self._next_draw = 0.0
+
+    def attach(self, progress):
+        self._progress = progress
+        self.counts.clear()
+        self._next_draw = self.clock() + self.interval
+
+    def detach(self):
+        self.draw()
+        self._progress = None
+
+    def line(self, text):
+        # A per-domain status line; safe to call from any worker thread
+        if self.verbosity < CONSOLE_VERBOSE:
+            return
+        if self._progress is None:
+            print(text)
+            return
+        with self._lock:
+            self._lines.append(text)
+
+    def error(self, text):
+        # Shown at every verbosity, above the progress bar while there is one
+        if self._progress is None:
+            print(text)
+            return
+        with self._lock:
+            self._lines.append(text)
+
+    def message(self, text):
+        # Run-level information (estimates, totals); hidden by --quiet
+        if self.verbosity >= CONSOLE_NORMAL:
+            print(text)
+
+    def result(self, result):
+        self.counts[result["category"]] += 1
+        if self._progress is not None:
+            self._progress.update(1)
+            if self.clock() >= self._next_draw:
+                self.draw()
+
+    def draw(self):
+        progress = self._progress
+        if progress is None:
+            return
+        with self._lock:
+            lines, self._lines = self._lines, []
+        if lines:
+            progress.write("\n".join(lines))
+        if self.verbosity >= CONSOLE_NORMAL and self.counts:
+            progress.set_postfix_str(", ".join(f"{category} {count}" for category, count
+                                               in self.counts.most_common(CONSOLE_TOP_CATEGORIES)), refresh=False)
+            progress.refresh()
+        self._next_draw = self.clock() + self.interval
+
+# Quiet for library use; main() sets the verbosity from --quiet/--verbose
+CONSOLE = ConsoleRenderer(verbosity=CONSOLE_QUIET)
+
+def start_log_writer():
+    # Moves the root logger's handlers behind a queue: scanning threads only enqueue their
+    # records and one background thread formats and writes them. Returns a function that
+    # drains the queue and stops the writer; it also runs at exit and may be called more
+    # than once.
+    import atexit
+    import logging.handlers
+
+    class RecordQueueHandler(logging.handlers.QueueHandler):
+        # The stock prepare() formats the record in the logging thread; the queue never
+        # leaves this process, so the record is passed on as is for the writer to format
+        def prepare(self, record):
+            return record
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(RecordQueueHandler(log_queue))
+    listener.start()
+    stopped = False
+
+    def stop():
+        nonlocal stopped
+        if not stopped:
+            stopped = True
+            listener.stop()
+    atexit.register(stop)
+    return stop
+
+# Per-domain phase durations of the scan running in the current thread or asyncio task
+_DOMAIN_TIMINGS = contextvars.ContextVar("domain_timings", default=None)
+
+def record_phase(phase, seconds):
+    METRICS.observe(phase, seconds)
+    timings = _DOMAIN_TIMINGS.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+def timings_ms(timings):
+    return {phase: round(timings[phase] * 1000, 2) for phase in PHASES if phase in timings}
+
+def classify_response(domain, status_code, content, hosting_patterns, best_priority=None):
+    # Shared by the thread and async engines so both produce identical results
+    if 400 <= status_code < 600:
+        start = time.perf_counter()
+        category = compile_patterns(hosting_patterns).categorize(content, best_priority, domain)
+        record_phase("categorize", time.perf_counter() - start)
+        logging.info(f"{domain} returned error {status_code} categorized as {category}")
+    else:
+        category = "no_error"
+        logging.info(f"{domain} returned status {status_code} (no error)")
+
+    color = Fore.RED if status_code >= 500 else Fore.YELLOW if status_code >= 400 else Fore.GREEN
+    CONSOLE.line(color + f"{domain}: {status_code} [{category}]")
+    return {"domain": domain, "status_code": status_code, "category": category}
+
+# DNS stage outcomes; the failures double as result categories
+DNS_OK = "dns_ok"
+DNS_NXDOMAIN = "dns_nxdomain"
+DNS_NO_ADDRESS = "dns_no_address"
+DNS_ERROR = "dns_error"
+
+# End-of-stream marker for domain streams, which may also yield None for "not ready yet"
+_EXHAUSTED = object()
+
+# Default for async_scan_domain's `cache_entry`: look the domain up in the result cache
+_CACHE_LOOKUP = object()
+
+ResolvedDomain = namedtuple("ResolvedDomain", ["domain", "dns_status", "addresses"])
+
+def system_resolver(host):
+    infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+class DnsCache:
+    # Bounded LRU of host -> (status, addresses) with separate TTLs for answers and failures.
+    # Each entry also keeps the duration of its lookup until the HTTP stage consumes it.
+    def __init__(self, max_entries=DEFAULT_DNS_CACHE_SIZE, ttl=DEFAULT_DNS_TTL, negative_ttl=DNS_NEGATIVE_TTL,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                return None
+            expires_at, status, addresses, _ = entry
+            if expires_at <= self.clock():
+                del self._entries[host]
+                return None
+            self._entries.move_to_end(host)
+            return status, addresses
+
+    def put(self, host, status, addresses, seconds=0.0):
+        ttl = self.ttl if status == DNS_OK else self.negative_ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[host] = (self.clock() + ttl, status, addresses, seconds)
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def addresses(self, host):
+        entry = self.get(host)
+        return entry[1] if entry and entry[0] == DNS_OK else ()
+
+    def connect_addresses(self, host):
+        # Addresses for the HTTP stage to connect to. The lookup ran on the DNS pool, outside
+        # the domain's timings, so its duration is added to the first domain that uses it.
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None or entry[0] <= self.clock():
+                return ()
+            expires_at, status, addresses, seconds = entry
+            if seconds:
+                self._entries[host] = (expires_at, status, addresses, 0.0)
+        timings = _DOMAIN_TIMINGS.get()
+        if seconds and timings is not None:
+            timings["dns"] = timings.get("dns", 0.0) + seconds
+        return addresses if status == DNS_OK else ()
+
+    def __len__(self):
+        return len(self._entries)
+
+# Shared with the HTTP stage, which connects to cached addresses instead of resolving again
+DNS_CACHE = DnsCache()
+
+class DnsResolver:
+    # Resolves hosts in parallel ahead of the HTTP stage. `resolver` maps a host name to
+    # a list of addresses and raises socket.gaierror like socket.getaddrinfo does.
+    def __init__(self, resolver=system_resolver, workers=DEFAULT_DNS_WORKERS, cache=None):
+        self.resolver = resolver
+        self.workers = max(1, workers)
+        self.cache = DNS_CACHE if cache is None else cache
+        self.lookups = 0
+        self.cache_hits = 0
+
+    def resolve(self, host):
+        cached = self.cache.get(host)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        self.lookups += 1
+        addresses = []
+        start = time.perf_counter()
+        try:
+            addresses = list(self.resolver(host))
+            status = DNS_OK if addresses else DNS_NO_ADDRESS
+        except socket.gaierror as e:
+            if e.errno == socket.EAI_NONAME:
+                status = DNS_NXDOMAIN
+            elif e.errno in (getattr(socket, "EAI_NODATA", None), getattr(socket, "EAI_ADDRFAMILY", None)):
+                status = DNS_NO_ADDRESS
+            else:
+                status = DNS_ERROR
+        except (OSError, UnicodeError):
+            status = DNS_ERROR
+        seconds = time.perf_counter() - start
+        record_phase("dns", seconds)
+        # Temporary failures are not cached so the HTTP stage can still try
+        if status != DNS_ERROR:
+            self.cache.put(host, status, addresses, seconds)
+        return status, addresses
+
+    def resolve_domain(self, domain):
+        status, addresses = self.resolve(domain_host(domain))
+        return ResolvedDomain(domain, status, addresses)
+
+    def resolve_stream(self, domains):
+        # Yields ResolvedDomain in completion order with a bounded number of lookups in flight
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dns") as executor:
+            yield from run_in_pool(executor, domains, self.resolve_domain, self.workers * 4)
+
+def dns_failure_result(resolved):
+    # Result for domains that cannot be scanned at all because their name does not resolve
+    logging.info(f"{resolved.domain} skipped: {resolved.dns_status}")
+    CONSOLE.line(Fore.MAGENTA + f"{resolved.domain}: no DNS address [{resolved.dns_status}]")
+    return {"domain": resolved.domain, "status_code": None, "category": resolved.dns_status}
+
+def _pinned_new_conn(connection, new_conn):
+    # Connect to the addresses found by the DNS stage, in order, until one accepts (as
+    # socket.create_connection does); Host header, SNI and certificate checks still use
+    # the real host name
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    original = getattr(connection, "_dns_host", None)
+    addresses = DNS_CACHE.connect_addresses(original.rstrip(".")) if original else ()
+    if not addresses:
+        return new_conn()
+    try:
+        for i, address in enumerate(addresses):
+            connection._dns_host = address
+            try:
+                return new_conn()
+            except (ConnectTimeoutError, NewConnectionError) as e:
+                if i + 1 == len(addresses):
+                    raise
+                logging.debug(f"Connecting to {original} at {address} failed ({e}), trying the next address")
+    finally:
+        connection._dns_host = original
+
+class PoolStats:
+    # Thread-safe counters for connection reuse across the sessions of one SessionPool
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def snapshot(self):
+        with self._lock:
+            hits = max(0, self.requests - self.connections)
+            return {"requests": self.requests, "hits": hits, "misses": self.connections}
+
+_POOLED_ADAPTER = None
+
+def pooled_http_adapter():
+    # Keep-alive adapter class whose pools report connection reuse to the PoolStats
+    # passed to the adapter. Built on first use so requests/urllib3 are only imported
+    # by the threads engine.
+    global _POOLED_ADAPTER
+    if _POOLED_ADAPTER is not None:
+        return _POOLED_ADAPTER
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def timed_new_conn(connection, new_conn):
+        start = time.perf_counter()
+        sock = _pinned_new_conn(connection, new_conn)
+        connection._tcp_seconds = time.perf_counter() - start
+        record_phase("connect", connection._tcp_seconds)
+        return sock
+
+    # Pools hand their PoolStats to every connection they create
+    class CountingHTTPConnection(HTTPConnection):
+        def connect(self):
+            self.stats.record_connection()
+            super().connect()
+
+        def _new_conn(self):
+            return timed_new_conn(self, super()._new_conn)
+
+    class CountingHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            self.stats.record_connection()
+            start = time.perf_counter()
+            self._tcp_seconds = 0.0
+            super().connect()
+            # The TCP part was recorded by _new_conn; the rest is the TLS handshake
+            record_phase("tls", time.perf_counter() - start - self._tcp_seconds)
+
+        def _new_conn(self):
+            return timed_new_conn(self, super()._new_conn)
+
+    class CountingPool:
+        def __init__(self, *args, stats, **kwargs):
+            self.stats = stats
+            super().__init__(*args, **kwargs)
+
+        def _new_conn(self):
+            connection = super()._new_conn()
+            connection.stats = self.stats
+            return connection
+
+        def _make_request(self, *args, **kwargs):
+            self.stats.record_request()
+            return super()._make_request(*args, **kwargs)
+
+    class CountingHTTPConnectionPool(CountingPool, HTTPConnectionPool):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSConnectionPool(CountingPool, HTTPSConnectionPool):
+        ConnectionCls = CountingHTTPSConnection
+
+    class PooledHTTPAdapter(HTTPAdapter):
+        def __init__(self, stats, **kwargs):
+            # Set before HTTPAdapter.__init__, which builds the pool manager
+            self.stats = stats
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": functools.partial(CountingHTTPConnectionPool, stats=self.stats),
+                "https": functools.partial(CountingHTTPSConnectionPool, stats=self.stats),
+            }
+
+    _POOLED_ADAPTER = PooledHTTPAdapter
+    return _POOLED_ADAPTER
+
+class SessionPool:
+    # One keep-alive requests.Session per worker thread, so connections to shared
+    # hosting front-ends are reused instead of reopened for every domain
+    def __init__(self, pool_hosts=DEFAULT_POOL_HOSTS, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_hosts = max(1, pool_hosts)
+        self.pool_size = max(1, pool_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._stats = PoolStats()
+
+    def get(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            adapter = pooled_http_adapter()(self._stats, pool_connections=self.pool_hosts, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def stats(self):
+        return self._stats.snapshot()
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+        self._local = threading.local()
+
+def cached_response_result(result_cache, cache_entry):
+    result = result_cache.revalidated_result(cache_entry)
+    logging.info(f"{result['domain']} not modified since last check, keeping {result['category']}")
+    CONSOLE.line(Fore.BLUE + f"{result['domain']}: 304 not modified [{result['category']}]")
+    return result
+
+def domain_urls(domain):
+    return [f"https://{domain}", f"http://{domain}"] if not domain.startswith("http") else [domain]
+
+def retry_delay(attempt, jitter=RETRY_JITTER, rng=random):
+    # 1s, 2s, 4s, ... spread by +-jitter so retries of many domains do not arrive in waves
+    return 2 ** attempt * rng.uniform(1 - jitter, 1 + jitter)
+
+class RetryBudget:
+    # Global retry allowance shared by all workers: at most `ratio` retries per first
+    # attempt, plus `minimum`. ratio=None means unlimited.
+    def __init__(self, ratio=DEFAULT_RETRY_BUDGET, minimum=RETRY_BUDGET_MINIMUM):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.first_attempts = 0
+        self.spent = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def record_attempt(self):
+        with self._lock:
+            self.first_attempts += 1
+
+    def take(self):
+        with self._lock:
+            if self.ratio is not None and self.spent >= self.minimum + self.ratio * self.first_attempts:
+                self.denied += 1
+                return False
+            self.spent += 1
+            return True
+
+class ConcurrencyController:
+    # AIMD limit on requests in flight. Answers are judged in rounds of `limit` answers
+    # (at least AIMD_MIN_ROUND): healthy rounds double the limit until the first overload
+    # (slow start) and add one slot after that; an unhealthy round halves it. Answers to
+    # requests sent before the last decrease are ignored, so one overload is not punished
+    # twice. `history` holds (seconds since start, limit), at most one per interval.
+    def __init__(self, minimum=DEFAULT_MIN_THREADS, maximum=DEFAULT_MAX_THREADS, initial=None,
+                 max_error_rate=AIMD_MAX_ERROR_RATE, latency_factor=AIMD_LATENCY_FACTOR, min_round=AIMD_MIN_ROUND,
+                 history_interval=CONCURRENCY_HISTORY_INTERVAL, clock=time.monotonic):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial or self.minimum))
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+        self.min_round = max(1, min_round)
+        self.history_interval = history_interval
+        self.clock = clock
+        self.epoch = 0
+        self.slow_start = True
+        self.baseline = None
+        self.decreases = 0
+        self.peak = self.limit
+        self._latencies = []
+        self._overloaded = 0
+        self._start = clock()
+        self.history = [(0.0, self.limit)]
+
+    def observe(self, seconds, overloaded=False, epoch=None):
+        if epoch is not None and epoch < self.epoch:
+            return
+        self._latencies.append(seconds)
+        self._overloaded += bool(overloaded)
+        if len(self._latencies) < max(self.min_round, self.limit):
+            return
+        median = sorted(self._latencies)[len(self._latencies) // 2]
+        error_rate = self._overloaded / len(self._latencies)
+        self._latencies = []
+        self._overloaded = 0
+        slow = self.baseline is not None and median > self.latency_factor * self.baseline
+        # The baseline follows the fastest rounds but drifts up slowly, so one lucky round does not stick
+        self.baseline = median if self.baseline is None else min(median, self.baseline * 1.05)
+        if error_rate > self.max_error_rate or slow:
+            self.slow_start = False
+            self.decreases += 1
+            self.epoch += 1
+            logging.info(f"Concurrency {self.limit} -> {max(self.minimum, self.limit // 2)}: "
+                         f"{error_rate:.0%} overloaded, median latency {median * 1000:.0f}ms")
+            self._set(max(self.minimum, self.limit // 2))
+        elif self.slow_start:
+            self._set(min(self.maximum, self.limit * 2))
+        else:
+            self._set(min(self.maximum, self.limit + 1))
+
+    def _set(self, limit):
+        if limit == self.limit:
+            return
+        self.limit = limit
+        self.peak = max(self.peak, limit)
+        now = self.clock() - self._start
+        if len(self.history) > 1 and now - self.history[-1][0] < self.history_interval:
+            self.history[-1] = (self.history[-1][0], limit)
+        else:
+            self.history.append((now, limit))
+
+def fetch_url(domain, url, matcher, timeout=5, session=None, max_body_bytes=DEFAULT_MAX_BODY_BYTES, result_cache=None):
+    # One request for one URL of a domain; raises requests.RequestException on failure
+    import requests
+    cache_entry = result_cache.get(domain) if result_cache else None
+    headers = {"User-Agent": random.choice(USER_AGENTS)}
+    headers.update(ResultCache.conditional_headers(cache_entry))
+    METRICS.count("requests")
+    timings = _DOMAIN_TIMINGS.get()
+    connecting = timings.get("connect", 0.0) + timings.get("tls", 0.0)
+    start = time.perf_counter()
+    response = (session or requests).get(url, timeout=timeout, headers=headers, stream=True)
+    # Connection setup inside get() is recorded by the pooled connections themselves
+    connecting = timings.get("connect", 0.0) + timings.get("tls", 0.0) - connecting
+    record_phase("ttfb", max(0.0, time.perf_counter() - start - connecting))
+    with response:
+        status_code = response.status_code
+        logging.debug(f"Received status {status_code} for {url}")
+        if status_code == 304 and cache_entry:
+            return cached_response_result(result_cache, cache_entry)
+        # Only error pages are categorized, so other bodies are never read
+        start = time.perf_counter()
+        if 400 <= status_code < 600:
+            content, best = read_error_body(response.iter_content(BODY_CHUNK_SIZE),
+                                            response.headers.get("content-type"), matcher, max_body_bytes)
+        else:
+            _release_small_body(response)
+            content, best = "", None
+        record_phase("body", time.perf_counter() - start)
+    result = classify_response(domain, status_code, content, matcher, best_priority=best)
+    if result_cache:
+        result_cache.store(result, {k.lower(): v for k, v in response.headers.items()}, content)
+    return result
+
+def dry_run_result(domain, url):
+    logging.info(f"[DRY RUN] Would scan {url}")
+    CONSOLE.line(Fore.CYAN + f"[DRY RUN] {url}")
+    return {"domain": domain, "status_code": None, "category": "dry_run"}
+
+def unreachable_result(domain):
+    return {"domain": domain, "status_code": None, "category": "unreachable"}
+
+def scan_domain(domain, hosting_patterns, dry_run=False, retries=2, timeout=5, session=None,
+                max_body_bytes=DEFAULT_MAX_BODY_BYTES, result_cache=None, timings=None, retry_budget=None):
+    # Scans one domain in the calling thread, sleeping between retries. Per-phase
+    # durations are added to `timings` if given (and always to METRICS).
+    token = _DOMAIN_TIMINGS.set({} if timings is None else timings)
+    try:
+        return _scan_domain(domain, hosting_patterns, dry_run, retries, timeout, session, max_body_bytes,
+                            result_cache, retry_budget)
+    finally:
+        _DOMAIN_TIMINGS.reset(token)
+
+def _scan_domain(domain, hosting_patterns, dry_run, retries, timeout, session, max_body_bytes, result_cache,
+                 retry_budget):
+    import requests
+    domain = domain.strip()
+    matcher = compile_patterns(hosting_patterns)
+
+    for url in domain_urls(domain):
         if dry_run:
-            logging.info(f"[DRY RUN] Would scan {url}")
-            print(Fore.CYAN + f"[DRY RUN] {url}")
-            return {"domain": domain, "status_code": None, "category": "dry_run"}
+            return dry_run_result(domain, url)
+        if retry_budget:
+            retry_budget.record_attempt()
 
         attempt = 0
         while attempt <= retries:
             try:
                 logging.info(f"Scanning {url} (attempt {attempt+1})")
-                response = requests.get(url, timeout=timeout, headers=headers)
-                content = response.text
-                status_code = response.status_code
+                return fetch_url(domain, url, matcher, timeout, session, max_body_bytes, result_cache)
+            except requests.RequestException as e:
+                logging.warning(f"Request to {url} failed: {e}")
+                if attempt < retries and (retry_budget is None or retry_budget.take()):
+                    sleep_time = retry_delay(attempt)
+                    CONSOLE.line(Fore.MAGENTA + f"{domain}: Error ({e}), retrying in {sleep_time:.1f}s...")
+                    METRICS.count("retries")
+                    time.sleep(sleep_time)
+                    record_phase("retry_sleep", sleep_time)
+                    attempt += 1
+                else:
+                    break
+        CONSOLE.line(Fore.MAGENTA + f"{domain}: Unreachable after {attempt+1} attempts")
+        logging.error(f"{domain} unreachable after {attempt+1} attempts")
+    return unreachable_result(domain)
+
+class RetryQueue:
+    # Work items that become ready at a given time (retries after backoff, staggered http attempts)
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+
+    def push(self, delay, item):
+        heapq.heappush(self._heap, (self.clock() + delay, next(self._seq), item))
+
+    def pop_ready(self):
+        if self._heap and self._heap[0][0] <= self.clock():
+            return heapq.heappop(self._heap)[2]
+        return None
+
+    def next_delay(self):
+        return max(0.0, self._heap[0][0] - self.clock()) if self._heap else None
+
+    def __len__(self):
+        return len(self._heap)
+
+class DomainScan:
+    # One domain's progress through its URL attempts in scan_domains_queued
+    __slots__ = ("domain", "urls", "outstanding", "result", "timings")
+
+    def __init__(self, domain, timings=None):
+        self.domain = domain.strip()
+        self.urls = domain_urls(self.domain)
+        self.outstanding = 0
+        self.result = None
+        self.timings = {} if timings is None else timings
 
-                logging.debug(f"Received status {status_code} for {url}")
+def scan_domains_queued(executor, domains, attempt, max_in_flight, retries=2, retry_budget=None, schemes="off",
+                        stagger_delay=DEFAULT_STAGGER_DELAY, with_timings=False, backoff=retry_delay,
+                        clock=time.monotonic, controller=None):
+    # Thread-engine driver: a worker slot runs exactly one request. Failed requests go to
+    # a delayed-retry queue, so backoff never blocks a worker, and with schemes="race" or
+    # "stagger" the https and http URLs of a domain run side by side and the first
+    # definitive answer wins. `attempt(domain, url)` returns a result or raises
+    # requests.RequestException. Yields results in completion order. `domains` may
+    # yield None when no domain is ready until in-flight results have been consumed,
+    # and finished results (dicts), which are passed through.
+    # With a ConcurrencyController, its limit replaces max_in_flight and every answer,
+    # timeout or failure is reported to it.
+    import requests
+    retry_queue = RetryQueue(clock)
+    in_flight = {}
+    domains = iter(domains)
+    exhausted = False
 
-                if 400 <= status_code < 600:
-                    category = categorize_response(content, hosting_patterns)
-                    logging.info(f"{domain} returned error {status_code} categorized as {category}")
+    def run(scan, url):
+        token = _DOMAIN_TIMINGS.set(scan.timings)
+        start = time.perf_counter()
+        try:
+            return attempt(scan.domain, url), None, time.perf_counter() - start
+        except requests.RequestException as e:
+            return None, e, time.perf_counter() - start
+        finally:
+            _DOMAIN_TIMINGS.reset(token)
+
+    def schedule(scan, index, tries, delay=0.0):
+        scan.outstanding += 1
+        if tries == 0 and retry_budget:
+            retry_budget.record_attempt()
+        retry_queue.push(delay, (scan, index, tries))
+
+    def finish(scan, result):
+        scan.result = result
+        if with_timings:
+            result = dict(result, timings_ms=timings_ms(scan.timings))
+        return result
+
+    while True:
+        starved = False
+        while len(in_flight) < (controller.limit if controller else max_in_flight):
+            item = retry_queue.pop_ready()
+            if item is None:
+                domain = _EXHAUSTED if exhausted else next(domains, _EXHAUSTED)
+                if domain is _EXHAUSTED:
+                    exhausted = True
+                    break
+                if domain is None:
+                    starved = True
+                    break
+                if isinstance(domain, dict):
+                    # An earlier stage already has this domain's result (cache, DNS, coalescing)
+                    yield domain
+                    continue
+                scan = DomainScan(domain)
+                if schemes == "off":
+                    schedule(scan, 0, 0)
                 else:
-                    category = "no_error"
-                    logging.info(f"{domain} returned status {status_code} (no error)")
+                    for index in range(len(scan.urls)):
+                        schedule(scan, index, 0, 0.0 if schemes == "race" else index * stagger_delay)
+                continue
+            scan, index, tries = item
+            if scan.result is not None:
+                # Another scheme already answered; the staggered attempt is not needed
+                scan.outstanding -= 1
+                continue
+            logging.info(f"Scanning {scan.urls[index]} (attempt {tries+1})")
+            in_flight[executor.submit(run, scan, scan.urls[index])] = (scan, index, tries, controller and controller.epoch)
 
-                color = Fore.RED if status_code >= 500 else Fore.YELLOW if status_code >= 400 else Fore.GREEN
-                print(color + f"{domain}: {status_code} [{category}]")
-                return {"domain": domain, "status_code": status_code, "category": category}
+        timeout = retry_queue.next_delay()
+        if starved:
+            # The stream has nothing ready yet (hosts waiting for tokens); ask again shortly
+            timeout = STREAM_POLL_INTERVAL if timeout is None else min(timeout, STREAM_POLL_INTERVAL)
+        if not in_flight:
+            if exhausted and not retry_queue:
+                return
+            time.sleep(timeout)
+            continue
 
-            except requests.RequestException as e:
-                logging.warning(f"Request to {url} failed: {e}")
-                if attempt < retries:
-                    sleep_time = 2 ** attempt
-                    print(Fore.MAGENTA + f"{domain}: Error ({e}), retrying in {sleep_time}s...")
-                    time.sleep(sleep_time)
+        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            scan, index, tries, epoch = in_flight.pop(future)
+            scan.outstanding -= 1
+            result, error, seconds = future.result()
+            if controller:
+                overloaded = isinstance(error, requests.Timeout) or (
+                    result is not None and result["status_code"] in OVERLOAD_STATUS_CODES)
+                controller.observe(seconds, overloaded, epoch)
+            if scan.result is not None:
+                continue
+            if result is not None:
+                yield finish(scan, result)
+                continue
+            url = scan.urls[index]
+            logging.warning(f"Request to {url} failed: {error}")
+            if tries < retries and (retry_budget is None or retry_budget.take()):
+                delay = backoff(tries)
+                CONSOLE.line(Fore.MAGENTA + f"{scan.domain}: Error ({error}), retrying in {delay:.1f}s...")
+                METRICS.count("retries")
+                # Backoff time is part of the domain's latency although no worker waits for it
+                METRICS.observe("retry_sleep", delay)
+                scan.timings["retry_sleep"] = scan.timings.get("retry_sleep", 0.0) + delay
+                schedule(scan, index, tries + 1, delay)
+                continue
+            CONSOLE.line(Fore.MAGENTA + f"{scan.domain}: Unreachable after {tries+1} attempts")
+            logging.error(f"{scan.domain} unreachable after {tries+1} attempts")
+            if schemes == "off" and index + 1 < len(scan.urls):
+                schedule(scan, index + 1, 0)
+            elif scan.outstanding == 0:
+                yield finish(scan, unreachable_result(scan.domain))
+
+class TokenBucket:
+    # Classic token bucket: `burst` requests at once, then `rate` requests per second
+    def __init__(self, rate, burst=1, now=0.0):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_at(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+def domain_host(domain):
+    return urlsplit(domain).hostname if "://" in domain else domain
+
+def resolve_host_key(domain):
+    # Rate-limit key for a domain: its resolved IP, or the host name if it does not resolve
+    host = domain_host(domain)
+    addresses = DNS_CACHE.addresses(host)
+    if addresses:
+        return addresses[0]
+    try:
+        return socket.gethostbyname(host)
+    except (OSError, UnicodeError):
+        return host
+
+class HostScheduler:
+    # Per-host politeness. Domains are queued per rate-limit key (resolved IP by default);
+    # keys with a token are released in the order they became ready, keys waiting for one
+    # sit in a timer heap. The input is only read while no key is ready, so domains on
+    # unrelated hosts run at full speed while others wait for a shared host, up to
+    # `max_buffered` waiting domains; beyond that the input waits too. The scheduler never
+    # sleeps: when every key waits it yields None and the driver keeps collecting in-flight
+    # results. Finished results (dicts) in the stream are passed through right away.
+    def __init__(self, rate, burst=1, key_func=resolve_host_key, clock=time.monotonic,
+                 max_buffered=SCHEDULER_MAX_BUFFERED):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_buffered = max(1, max_buffered)
+        self.key_func = key_func
+        self.clock = clock
+        self._buckets = {}
+        self.waited_seconds = 0.0
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, self.clock())
+        return bucket
+
+    def iter_ready(self, domains):
+        domains = iter(domains)
+        queues = {}
+        ready = deque()
+        timers = []
+        seq = itertools.count()
+        exhausted = False
+        blocked_since = None
+        buffered = 0
+
+        def enqueue(key, now):
+            ready_at = self._bucket(key).ready_at(now)
+            if ready_at <= now:
+                ready.append(key)
+            else:
+                heapq.heappush(timers, (ready_at, next(seq), key))
+
+        while True:
+            now = self.clock()
+            while timers and timers[0][0] <= now:
+                ready.append(heapq.heappop(timers)[2])
+            if ready:
+                if blocked_since is not None:
+                    self.waited_seconds += now - blocked_since
+                    blocked_since = None
+                key = ready.popleft()
+                self._bucket(key).consume(now)
+                domain = queues[key].popleft()
+                buffered -= 1
+                if queues[key]:
+                    enqueue(key, now)
+                else:
+                    del queues[key]
+                yield domain
+                continue
+            if not exhausted and buffered < self.max_buffered:
+                domain = next(domains, _EXHAUSTED)
+                if domain is _EXHAUSTED:
+                    exhausted = True
+                elif domain is None or isinstance(domain, dict):
+                    yield domain
+                else:
+                    key = self.key_func(domain)
+                    buffered += 1
+                    if key in queues:
+                        queues[key].append(domain)
+                    else:
+                        queues[key] = deque([domain])
+                        enqueue(key, now)
+                continue
+            if not queues:
+                return
+            # Every buffered domain waits for its host's token (and the input for room)
+            if blocked_since is None:
+                blocked_since = now
+                logging.debug(f"Waiting {timers[0][0] - now:.1f}s for host {timers[0][2]}")
+            yield None
+
+    @staticmethod
+    def estimate_seconds(total, workers=1, request_seconds=ESTIMATED_REQUEST_SECONDS):
+        # Lower bound from worker throughput. Hosts are only known after DNS resolution, so
+        # the extra wait of domains sharing a host cannot be estimated up front.
+        return total * request_seconds / max(1, workers)
+
+def coalesce_key(domain):
+    # Domains are grouped by their first resolved address; None if it is not cached
+    addresses = DNS_CACHE.addresses(domain_host(domain))
+    return addresses[0] if addresses else None
+
+def response_signature(result):
+    return result["status_code"], result["category"]
+
+def is_inferable(result):
+    # Only an HTTP answer with a parking or hosting-error category is shared by every
+    # domain on an address. no_error, generic error codes and failures say nothing about
+    # the other sites on it.
+    category = result["category"]
+    return (result["status_code"] is not None and category not in ("no_error", "unreachable", "dry_run")
+            and not category.startswith(("custom", "dns_")))
+
+class CoalesceGroup:
+    # Domains on one address: the samples being scanned, their signatures and the
+    # members waiting for the verdict
+    __slots__ = ("key", "started", "signatures", "held", "verdict")
+
+    def __init__(self, key):
+        self.key = key
+        self.started = 0
+        self.signatures = []
+        self.held = []
+        self.verdict = None  # None while sampling, then the shared result or False
+
+class Coalescer:
+    # Parking and default-vhost IPs serve the same page for thousands of domains. The
+    # first `sample_size` domains of each address are scanned; when they all got the same
+    # parking or hosting-error page (see is_inferable), the other domains on that address
+    # get the shared result without a request, marked "confidence": "inferred". Any other
+    # group is scanned in full.
+    def __init__(self, sample_size=COALESCE_SAMPLE_SIZE, key_func=coalesce_key):
+        self.sample_size = max(1, sample_size)
+        self.key_func = key_func
+        self._groups = {}
+        self._samples = {}
+        self._released = deque()
+        self.inferred = 0
+        self.split_groups = 0
+
+    def admit(self, domains):
+        # Yields the domains that need a request and the inferred results of the others.
+        # Once the input is exhausted, yields None while held domains wait for their samples.
+        domains = iter(domains)
+        exhausted = False
+        while True:
+            if self._released:
+                yield self._released.popleft()
+                continue
+            if exhausted:
+                if not self._samples:
+                    return
+                yield None
+                continue
+            domain = next(domains, _EXHAUSTED)
+            if domain is _EXHAUSTED:
+                exhausted = True
+                continue
+            if isinstance(domain, dict):
+                yield domain
+                continue
+            key = self.key_func(domain)
+            if key is None:
+                yield domain
+                continue
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = CoalesceGroup(key)
+            if group.verdict:
+                yield self._inferred_result(domain, group)
+            elif group.verdict is False:
+                yield domain
+            elif group.started < self.sample_size:
+                group.started += 1
+                self._samples[domain] = group
+                yield domain
+            else:
+                group.held.append(domain)
+
+    def observe(self, result):
+        # Called with every result; once all samples of a group are in, returns the
+        # inferred results of its held domains (if the samples agreed)
+        group = self._samples.pop(result["domain"], None)
+        if group is None:
+            return []
+        group.signatures.append(response_signature(result))
+        if len(group.signatures) < self.sample_size:
+            return []
+        if len(set(group.signatures)) == 1 and is_inferable(result):
+            group.verdict = result
+            logging.info(f"{group.key}: {self.sample_size} samples agree on {response_signature(result)}, "
+                         f"inferring {len(group.held)} held domains")
+            inferred = [self._inferred_result(domain, group) for domain in group.held]
+        else:
+            group.verdict = False
+            self.split_groups += 1
+            logging.info(f"{group.key}: samples disagree or are not a hosting page ({group.signatures}), "
+                         f"scanning all domains")
+            self._released.extend(group.held)
+            inferred = []
+        group.held = []
+        return inferred
+
+    def _inferred_result(self, domain, group):
+        self.inferred += 1
+        status_code, category = response_signature(group.verdict)
+        logging.info(f"{domain} inferred as {status_code} [{category}] from samples on {group.key}")
+        CONSOLE.line(Fore.BLUE + f"{domain}: {status_code} [{category}] (inferred from {group.key})")
+        return {"domain": domain, "status_code": status_code, "category": category, "confidence": "inferred"}
+
+    def stats(self):
+        return {"groups": len(self._groups), "inferred": self.inferred, "split_groups": self.split_groups}
+
+def run_in_pool(executor, items, fn, max_in_flight):
+    # Submits lazily so that at most max_in_flight items are queued or running;
+    # yields results as they complete
+    items = iter(items)
+    pending = set()
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_in_flight:
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            pending.add(executor.submit(fn, item))
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+class AsyncFetchError(Exception):
+    # Raised by the async engine for protocol errors (bad status line, too many redirects, ...)
+    pass
+
+def _charset_from_content_type(content_type):
+    match = re.search(r"charset=[\"']?([\w.:-]+)", content_type or "", re.IGNORECASE)
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+async def _async_read_head(reader, timeout):
+    import asyncio
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    if not status_line:
+        raise AsyncFetchError("Connection closed without a response")
+    parts = status_line.decode("latin-1").split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        raise AsyncFetchError(f"Malformed status line: {status_line[:100]!r}")
+    status_code = int(parts[1])
+
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status_code, headers
+
+async def _async_iter_body(reader, status_code, headers, timeout):
+    # Yields the response body in chunks of at most BODY_CHUNK_SIZE bytes
+    import asyncio
+    if status_code in (204, 304) or 100 <= status_code < 200:
+        return
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), timeout)
+            size = int(size_line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                return
+            while size > 0:
+                chunk = await asyncio.wait_for(reader.readexactly(min(size, BODY_CHUNK_SIZE)), timeout)
+                size -= len(chunk)
+                yield chunk
+            await asyncio.wait_for(reader.readexactly(2), timeout)
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            chunk = await asyncio.wait_for(reader.readexactly(min(remaining, BODY_CHUNK_SIZE)), timeout)
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        while True:
+            chunk = await asyncio.wait_for(reader.read(BODY_CHUNK_SIZE), timeout)
+            if not chunk:
+                return
+            yield chunk
+
+async def _async_read_error_body(reader, status_code, headers, timeout, matcher, max_bytes):
+    scanner = BodyScanner(matcher, _charset_from_content_type(headers.get("content-type")), max_bytes)
+    body = _async_iter_body(reader, status_code, headers, timeout)
+    try:
+        async for chunk in body:
+            if scanner.feed(chunk):
+                break
+    finally:
+        await body.aclose()
+    return scanner.finish()
+
+async def async_fetch(url, headers, matcher, timeout=5, ssl_context=None, max_body_bytes=DEFAULT_MAX_BODY_BYTES):
+    # Minimal HTTP/1.1 GET on asyncio streams; follows redirects like requests.get.
+    # Returns (status_code, content, best_priority, headers); only error bodies are read.
+    import asyncio
+    import ssl
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        is_https = parts.scheme == "https"
+        port = parts.port or (443 if is_https else 80)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        host_header = parts.netloc.rpartition("@")[2]
+        if is_https and ssl_context is None:
+            ssl_context = ssl.create_default_context()
+
+        # Pre-resolved addresses are tried in order; without any, open_connection resolves
+        addresses = DNS_CACHE.connect_addresses(parts.hostname) or [parts.hostname]
+        # TLS is started separately where supported (3.11+) so it can be timed on its own
+        tls_on_connect = is_https and not hasattr(asyncio.StreamWriter, "start_tls")
+        start = time.perf_counter()
+        for i, address in enumerate(addresses):
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(address, port, ssl=ssl_context if tls_on_connect else None,
+                                            server_hostname=parts.hostname if tls_on_connect else None),
+                    timeout)
+                break
+            except (OSError, asyncio.TimeoutError) as e:
+                if i + 1 == len(addresses):
+                    raise
+                logging.debug(f"Connecting to {parts.hostname} at {address} failed ({e!r}), trying the next address")
+        record_phase("connect", time.perf_counter() - start)
+        try:
+            if is_https and not tls_on_connect:
+                start = time.perf_counter()
+                await asyncio.wait_for(writer.start_tls(ssl_context, server_hostname=parts.hostname), timeout)
+                record_phase("tls", time.perf_counter() - start)
+            start = time.perf_counter()
+            request_lines = [f"GET {path} HTTP/1.1", f"Host: {host_header}"]
+            request_lines += [f"{name}: {value}" for name, value in headers.items()]
+            request_lines += ["Accept: */*", "Accept-Encoding: identity", "Connection: close", "", ""]
+            writer.write("\r\n".join(request_lines).encode("latin-1"))
+            await asyncio.wait_for(writer.drain(), timeout)
+            status_code, response_headers = await _async_read_head(reader, timeout)
+            record_phase("ttfb", time.perf_counter() - start)
+
+            location = response_headers.get("location")
+            if status_code in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            if 400 <= status_code < 600:
+                start = time.perf_counter()
+                content, best = await _async_read_error_body(reader, status_code, response_headers, timeout,
+                                                             matcher, max_body_bytes)
+                record_phase("body", time.perf_counter() - start)
+                return status_code, content, best, response_headers
+            return status_code, "", None, response_headers
+        finally:
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), timeout)
+            except Exception:
+                pass
+    raise AsyncFetchError(f"Exceeded {MAX_REDIRECTS} redirects")
+
+async def async_scan_domain(domain, hosting_patterns, dry_run=False, retries=2, timeout=5, ssl_context=None,
+                            max_body_bytes=DEFAULT_MAX_BODY_BYTES, result_cache=None, timings=None, retry_budget=None,
+                            schemes="off", stagger_delay=DEFAULT_STAGGER_DELAY, cache_entry=_CACHE_LOOKUP):
+    # Async counterpart of scan_domain: same https->http fallback, retries, result shape and
+    # timings. Backoff is a coroutine sleep, and schemes="race"/"stagger" runs the https
+    # and http URLs side by side, keeping the first definitive answer. `cache_entry` is
+    # the domain's result_cache entry (or None) if the caller already looked it up.
+    token = _DOMAIN_TIMINGS.set({} if timings is None else timings)
+    try:
+        domain = domain.strip()
+        urls = domain_urls(domain)
+        if dry_run:
+            return dry_run_result(domain, urls[0])
+        matcher = compile_patterns(hosting_patterns)
+
+        def scan_url(url, delay=0.0):
+            return _async_scan_url(domain, url, matcher, retries, timeout, ssl_context, max_body_bytes,
+                                   result_cache, retry_budget, delay, cache_entry)
+
+        if schemes == "off" or len(urls) == 1:
+            for url in urls:
+                result = await scan_url(url)
+                if result is not None:
+                    return result
+            return unreachable_result(domain)
+        return await _async_first_answer([scan_url(url, 0.0 if schemes == "race" else i * stagger_delay)
+                                          for i, url in enumerate(urls)], domain)
+    finally:
+        _DOMAIN_TIMINGS.reset(token)
+
+async def _async_first_answer(coroutines, domain):
+    import asyncio
+    pending = {asyncio.ensure_future(coroutine) for coroutine in coroutines}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result() is not None:
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    return unreachable_result(domain)
+
+async def _async_scan_url(domain, url, matcher, retries, timeout, ssl_context, max_body_bytes, result_cache,
+                          retry_budget, delay=0.0, cache_entry=_CACHE_LOOKUP):
+    # Attempts one URL with retries; returns the result or None if it stayed unreachable.
+    # Result cache reads and writes are SQLite calls, so they run in the default executor.
+    import asyncio
+    loop = asyncio.get_running_loop()
+    if delay:
+        await asyncio.sleep(delay)
+    if not result_cache:
+        cache_entry = None
+    elif cache_entry is _CACHE_LOOKUP:
+        cache_entry = await loop.run_in_executor(None, result_cache.get, domain)
+    headers = {"User-Agent": random.choice(USER_AGENTS)}
+    headers.update(ResultCache.conditional_headers(cache_entry))
+    if retry_budget:
+        retry_budget.record_attempt()
+
+    attempt = 0
+    while attempt <= retries:
+        try:
+            logging.info(f"Scanning {url} (attempt {attempt+1})")
+            METRICS.count("requests")
+            status_code, content, best, response_headers = await async_fetch(
+                url, headers, matcher, timeout=timeout, ssl_context=ssl_context, max_body_bytes=max_body_bytes)
+            logging.debug(f"Received status {status_code} for {url}")
+            if status_code == 304 and cache_entry:
+                return await loop.run_in_executor(None, cached_response_result, result_cache, cache_entry)
+            result = classify_response(domain, status_code, content, matcher, best_priority=best)
+            if result_cache:
+                await loop.run_in_executor(None, result_cache.store, result, response_headers, content)
+            return result
+
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, AsyncFetchError) as e:
+            logging.warning(f"Request to {url} failed: {e!r}")
+            if attempt < retries and (retry_budget is None or retry_budget.take()):
+                sleep_time = retry_delay(attempt)
+                CONSOLE.line(Fore.MAGENTA + f"{domain}: Error ({e!r}), retrying in {sleep_time:.1f}s...")
+                METRICS.count("retries")
+                await asyncio.sleep(sleep_time)
+                record_phase("retry_sleep", sleep_time)
                 attempt += 1
-        print(Fore.MAGENTA + f"{domain}: Unreachable after {retries+1} attempts")
-        logging.error(f"{domain} unreachable after {retries+1} attempts")
-    return {"domain": domain, "status_code": None, "category": "unreachable"}
+            else:
+                break
+    CONSOLE.line(Fore.MAGENTA + f"{domain}: Unreachable after {attempt+1} attempts")
+    logging.error(f"{domain} unreachable after {attempt+1} attempts")
+    return None
 
-def write_csv(results, csv_file):
+def _raise_open_files_limit(wanted):
+    # Thousands of sockets need more file descriptors than the usual soft limit of 1024
     try:
-        with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-            # Write a comment header for context
-            f.write("# Domain scan results - domain,status_code,category\n")
-            writer = csv.DictWriter(f, fieldnames=["domain", "status_code", "category"], quoting=csv.QUOTE_ALL)
-            writer.writeheader()
-            # Optionally, add a separator line for readability
-            f.write("#" + "-"*60 + "\n")
-            for row in results:
-                writer.writerow(row)
-        logging.info(f"Results written to CSV: {csv_file}")
-    except Exception as e:
-        logging.error(f"Failed to write CSV file '{csv_file}': {e}")
-        print(Fore.RED + f"Error writing CSV file '{csv_file}': {e}")
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        if soft != resource.RLIM_INFINITY and soft < target:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ImportError, ValueError, OSError) as e:
+        logging.debug(f"Could not raise open files limit: {e}")
+
+async def async_scan_domains(domains, hosting_patterns, concurrency=DEFAULT_CONCURRENCY, on_result=None,
+                             dns_resolver=None, with_timings=False, prepare=None, **scan_kwargs):
+    # Keeps at most `concurrency` domains in flight; tasks are created lazily so memory stays bounded.
+    # Results are handed to on_result if given, otherwise collected and returned. An on_result
+    # coroutine function is awaited, so a slow consumer holds back new domains without
+    # blocking the loop. `hosting_patterns` may also be a function returning the current
+    # patterns, called as each domain is taken, so a reload applies from the next domain on.
+    # `prepare(domain)` runs in a worker thread before the request and
+    # returns a finished result (cache hit, DNS failure), the domain to scan, or a
+    # (domain, cache entry) pair so a stale entry is revalidated without a second lookup;
+    # by default it resolves the domain with `dns_resolver`.
+    import asyncio
+    import inspect
+    import ssl
+    ssl_context = ssl.create_default_context()
+    results = []
+    pending = set()
+    loop = asyncio.get_running_loop()
+    if prepare is None and dns_resolver:
+        def prepare(domain):
+            resolved = dns_resolver.resolve_domain(domain)
+            if resolved.dns_status in (DNS_NXDOMAIN, DNS_NO_ADDRESS):
+                return dns_failure_result(resolved)
+            return domain
+    workers = dns_resolver.workers if dns_resolver else DEFAULT_DNS_WORKERS
+    dns_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dns") if prepare else None
+    deliver_async = inspect.iscoroutinefunction(on_result)
+
+    async def resolve_and_scan(domain, patterns):
+        kwargs = scan_kwargs
+        if prepare:
+            domain = await loop.run_in_executor(dns_executor, prepare, domain)
+            if isinstance(domain, dict):
+                return domain
+            if isinstance(domain, tuple):
+                domain, cache_entry = domain
+                kwargs = dict(scan_kwargs, cache_entry=cache_entry)
+        if not with_timings:
+            return await async_scan_domain(domain, patterns, ssl_context=ssl_context, **kwargs)
+        timings = {}
+        result = await async_scan_domain(domain, patterns, ssl_context=ssl_context, timings=timings, **kwargs)
+        return dict(result, timings_ms=timings_ms(timings))
+
+    async def collect(done):
+        for task in done:
+            result = task.result()
+            if deliver_async:
+                await on_result(result)
+            elif on_result:
+                on_result(result)
+            else:
+                results.append(result)
+
+    try:
+        for domain in domains:
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                await collect(done)
+            patterns = hosting_patterns() if callable(hosting_patterns) else hosting_patterns
+            pending.add(asyncio.ensure_future(resolve_and_scan(domain, patterns)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            await collect(done)
+    finally:
+        if dns_executor:
+            dns_executor.shutdown(wait=False)
+    return results
+
+def run_async_scan(domains, hosting_patterns, concurrency=DEFAULT_CONCURRENCY, on_result=None, dns_resolver=None,
+                   prepare=None, **scan_kwargs):
+    import asyncio
+    concurrency = max(1, concurrency)
+    _raise_open_files_limit(concurrency + 256)
+    return asyncio.run(async_scan_domains(domains, hosting_patterns, concurrency=concurrency, on_result=on_result,
+                                          dns_resolver=dns_resolver, prepare=prepare, **scan_kwargs))
+
+class Scanner:
+    # Embeddable scan engine that owns the compiled patterns, keep-alive sessions, DNS
+    # resolver, politeness scheduler, retry budget and concurrency limits. A long-lived
+    # process can run many batches through one Scanner with warm connections and caches;
+    # main() is a thin command-line wrapper around it. `host_rate` enables per-host
+    # politeness, `result_cache` is a ResultCache owned by the caller, and
+    # `coalesce_samples=K` enables coalescing with K samples per address.
+    def __init__(self, hosting_patterns=None, *, engine="threads", threads=1, concurrency=DEFAULT_CONCURRENCY,
+                 dry_run=False, timeout=5, retries=2, retry_budget=DEFAULT_RETRY_BUDGET, schemes="off",
+                 stagger_delay=DEFAULT_STAGGER_DELAY, max_body_bytes=DEFAULT_MAX_BODY_BYTES, host_rate=None,
+                 host_burst=1, dns=True, dns_workers=DEFAULT_DNS_WORKERS, pool_hosts=DEFAULT_POOL_HOSTS,
+                 pool_size=DEFAULT_POOL_SIZE, result_cache=None, coalesce_samples=0,
+                 adaptive=False, min_threads=DEFAULT_MIN_THREADS, max_threads=DEFAULT_MAX_THREADS, with_timings=False):
+        if engine not in ("threads", "async"):
+            raise ValueError(f"Unknown engine: {engine}")
+        self.matcher = compile_patterns(load_hosting_patterns() if hosting_patterns is None else hosting_patterns)
+        self.engine = engine
+        self.threads = max(1, threads)
+        self.concurrency = max(1, concurrency)
+        self.dry_run = dry_run
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_budget = RetryBudget(retry_budget)
+        self.schemes = schemes
+        self.stagger_delay = stagger_delay
+        self.max_body_bytes = max_body_bytes
+        self.with_timings = with_timings
+        self.result_cache = result_cache
+        self.session_pool = SessionPool(pool_hosts=pool_hosts, pool_size=pool_size)
+        self.dns_resolver = DnsResolver(workers=dns_workers) if dns and not dry_run else None
+        # Delays and coalescing only apply to the thread engine; the async engine resolves inside its tasks
+        threaded = engine == "threads"
+        self.scheduler = HostScheduler(host_rate, burst=host_burst) if host_rate and threaded and not dry_run else None
+        self.coalesce_samples = coalesce_samples if threaded and self.dns_resolver else 0
+        self.coalescer = None
+        self.controller = ConcurrencyController(min_threads, max_threads, initial=self.threads) if adaptive and threaded else None
+        self._executor = None
+        self._dns_executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for executor in (self._executor, self._dns_executor):
+            if executor:
+                executor.shutdown(wait=True)
+        self._executor = self._dns_executor = None
+        self.session_pool.close()
+
+    def scan(self, domain):
+        return next(self.scan_many([domain]))
+
+    def reload_patterns(self, hosting_patterns):
+        # Domains started from now on use the new patterns, with either engine; those in
+        # flight finish with the old ones
+        self.matcher = compile_patterns(hosting_patterns)
+
+    def scan_many(self, domains, deadline=None):
+        # Yields one result per domain in completion order: cached results, DNS failures,
+        # inferred and scanned results alike. Domains are only taken from `domains` when
+        # there is room for them, so huge or endless iterables are fine, and a consumer
+        # that stops reading stops the scan. After `deadline` (time.monotonic()) no further
+        # domain is handed to a worker; domains waiting for a host token are dropped.
+        if self.engine == "async":
+            yield from self._scan_many_async(domains if deadline is None else until_deadline(domains, deadline))
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.controller.maximum if self.controller else self.threads)
+        domains = iter(domains)
+        if self.dns_resolver:
+            if self._dns_executor is None:
+                self._dns_executor = ThreadPoolExecutor(max_workers=self.dns_resolver.workers, thread_name_prefix="dns")
+            domains = run_in_pool(self._dns_executor, domains, self._prepare, self.dns_resolver.workers * 4)
+        elif self.result_cache:
+            domains = map(self._prepare, domains)
+        coalescer = self.coalescer = Coalescer(self.coalesce_samples) if self.coalesce_samples else None
+        if coalescer:
+            # Ahead of the scheduler, so inferred domains do not wait for host tokens
+            domains = coalescer.admit(domains)
+        if self.scheduler:
+            domains = self.scheduler.iter_ready(domains)
+        if deadline is not None:
+            # Checked as domains are released to the workers, after any wait for a host token
+            domains = until_deadline(domains, deadline)
+        # Each worker runs one request at a time; retries wait in a queue, not in a worker
+        for result in scan_domains_queued(self._executor, domains, self._attempt, self.threads, retries=self.retries,
+                                          retry_budget=self.retry_budget, schemes=self.schemes,
+                                          stagger_delay=self.stagger_delay, with_timings=self.with_timings,
+                                          controller=self.controller):
+            yield result
+            if coalescer:
+                yield from coalescer.observe(result)
+
+    def _prepare(self, domain, with_cache_entry=False):
+        # Runs ahead of the HTTP stage (in the DNS threads): a fresh cached result or a
+        # DNS failure finishes the domain without any request. With `with_cache_entry`
+        # a domain left to scan comes back as (domain, cache entry) for the async engine.
+        cache_entry = None
+        if self.result_cache:
+            cache_entry = self.result_cache.get(domain)
+            cached = self.result_cache.reuse(cache_entry)
+            if cached:
+                return cached
+        if self.dns_resolver:
+            resolved = self.dns_resolver.resolve_domain(domain)
+            if resolved.dns_status in (DNS_NXDOMAIN, DNS_NO_ADDRESS):
+                return dns_failure_result(resolved)
+        return (domain, cache_entry) if with_cache_entry else domain
+
+    def _prepare_async(self, domain):
+        return self._prepare(domain, with_cache_entry=True)
+
+    def _attempt(self, domain, url):
+        if self.dry_run:
+            return dry_run_result(domain, url)
+        return fetch_url(domain, url, self.matcher, timeout=self.timeout, session=self.session_pool.get(),
+                         max_body_bytes=self.max_body_bytes, result_cache=self.result_cache)
+
+    def _scan_many_async(self, domains):
+        # The event loop runs in a helper thread and hands results over through a bounded
+        # queue. Blocking work stays off the loop: cache lookups and DNS run in _prepare's
+        # worker threads, cache writes in the loop's executor, and while the consumer is behind, a helper thread waits for room
+        # in the queue and the loop stops taking new domains until it has.
+        import asyncio
+        results = queue.Queue(maxsize=self.concurrency)
+        stopped = threading.Event()
+        done = object()
+        failure = []
+
+        def until_stopped(domains):
+            for domain in domains:
+                if stopped.is_set():
+                    return
+                yield domain
+
+        async def deliver(result):
+            if not stopped.is_set():
+                await asyncio.get_running_loop().run_in_executor(None, results.put, result)
+
+        def run():
+            try:
+                run_async_scan(until_stopped(domains), lambda: self.matcher, concurrency=self.concurrency, on_result=deliver,
+                               prepare=self._prepare_async if self.result_cache or self.dns_resolver else None,
+                               dns_resolver=self.dns_resolver, dry_run=self.dry_run, retries=self.retries,
+                               timeout=self.timeout, max_body_bytes=self.max_body_bytes, result_cache=self.result_cache,
+                               with_timings=self.with_timings, retry_budget=self.retry_budget, schemes=self.schemes,
+                               stagger_delay=self.stagger_delay)
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                if not stopped.is_set():
+                    results.put(done)
+
+        thread = threading.Thread(target=run, name="async-scan", daemon=True)
+        thread.start()
+        try:
+            while True:
+                result = results.get()
+                if result is done:
+                    break
+                yield result
+        finally:
+            stopped.set()
+            # Unblock a pending put; the loop thread finishes the domains in flight on its own
+            try:
+                while True:
+                    results.get_nowait()
+            except queue.Empty:
+                pass
+        if failure:
+            raise failure[0]
 
 def status_md_emoji(category):
     # Use emoji or color-like cues for markdown
@@ -276,35 +2702,12 @@ def status_md_emoji(category):
         "custom_502": "🟠",
         "custom_503": "🟠",
         "unreachable": "⚫",
+        "dns_nxdomain": "⚫",
+        "dns_no_address": "⚫",
         "dry_run": "⚪"
     }
     return mapping.get(category, "⚪")
 
-def write_md(results, md_file):
-    try:
-        # Summary by category
-        summary = Counter(r['category'] for r in results)
-        with open(md_file, 'w', encoding='utf-8') as f:
-            f.write("# Domain Scan Results\n\n")
-            f.write("## Summary\n\n")
-            f.write("| Category | Count |\n|---|---|\n")
-            for cat, count in summary.items():
-                f.write(f"| {status_md_emoji(cat)} `{cat}` | **{count}** |\n")
-            f.write("\n---\n\n")
-            f.write("## Detailed Results\n\n")
-            f.write("|  | Domain | Status Code | Category |\n")
-            f.write("|:-:|:-------|:-----------:|:---------|\n")
-            for r in results:
-                emoji = status_md_emoji(r['category'])
-                domain = f"`{r['domain']}`"
-                status = r['status_code'] if r['status_code'] is not None else "-"
-                cat = f"`{r['category']}`"
-                f.write(f"| {emoji} | {domain} | {status} | {cat} |\n")
-        logging.info(f"Results written to Markdown: {md_file}")
-    except Exception as e:
-        logging.error(f"Failed to write Markdown file '{md_file}': {e}")
-        print(Fore.RED + f"Error writing Markdown file '{md_file}': {e}")
-
 def html_row_color(category):
     # Return a background color for each category
     mapping = {
@@ -318,14 +2721,121 @@ def html_row_color(category):
         "custom_502": "#ffe6cc",
         "custom_503": "#ffe6cc",
         "unreachable": "#f2f2f2",   # light gray
+        "dns_nxdomain": "#f2f2f2",
+        "dns_no_address": "#f2f2f2",
         "dry_run": "#f9f9f9"
     }
     return mapping.get(category, "#ffffff")
 
-def write_html(results, html_file):
-    try:
-        with open(html_file, 'w', encoding='utf-8') as f:
-            f.write("""
+# Rows buffered by the report writers before they are flushed to disk
+REPORT_FLUSH_EVERY = 100
+# Rows per HTML page; larger runs are split into linked pages
+DEFAULT_HTML_PAGE_SIZE = 5000
+
+class ReportWriter:
+    # Base class for incremental report writers: opened at scan start, fed one result
+    # at a time and finalized at close. A failing writer logs the error and disables
+    # itself so the scan keeps going.
+    label = "report"
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.summary = Counter()
+        self.failed = False
+        self._guard(self._open)
+
+    def _guard(self, func, *args):
+        if self.failed:
+            return
+        try:
+            func(*args)
+        except Exception as e:
+            self.failed = True
+            logging.error(f"Failed to write {self.label} file '{self.path}': {e}")
+            print(Fore.RED + f"Error writing {self.label} file '{self.path}': {e}")
+
+    def write(self, result):
+        self.rows += 1
+        self.summary[result['category']] += 1
+        self._guard(self._write, result)
+        if self.rows % REPORT_FLUSH_EVERY == 0:
+            self._guard(self._flush)
+
+    def close(self):
+        self._guard(self._close)
+        if not self.failed:
+            self.failed = True  # closed; ignore further writes
+            logging.info(f"Results written to {self.label}: {self.path}")
+
+    def _open(self):
+        self._file = open(self.path, 'w', newline='', encoding='utf-8')
+
+    def _write(self, result):
+        raise NotImplementedError
+
+    def _flush(self):
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+class CsvReportWriter(ReportWriter):
+    label = "CSV"
+    fieldnames = ["domain", "status_code", "category"]
+
+    def __init__(self, path, timings=False, confidence=False):
+        # Optional per-domain timings column, e.g. "connect=1.2;ttfb=30.5;body=0.4" (milliseconds),
+        # and a confidence column that is "inferred" for coalesced results
+        if confidence:
+            self.fieldnames = self.fieldnames + ["confidence"]
+        if timings:
+            self.fieldnames = self.fieldnames + ["timings_ms"]
+        super().__init__(path)
+
+    def _open(self):
+        super()._open()
+        # Write a comment header for context
+        self._file.write("# Domain scan results - " + ",".join(self.fieldnames) + "\n")
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, quoting=csv.QUOTE_ALL, extrasaction='ignore')
+        self._writer.writeheader()
+        # Optionally, add a separator line for readability
+        self._file.write("#" + "-"*60 + "\n")
+
+    def _write(self, result):
+        if "timings_ms" in result:
+            result = dict(result, timings_ms=";".join(f"{k}={v}" for k, v in result["timings_ms"].items()))
+        self._writer.writerow(result)
+
+class MarkdownReportWriter(ReportWriter):
+    # Detailed rows are streamed; the summary section is appended at close
+    label = "Markdown"
+
+    def _open(self):
+        super()._open()
+        self._file.write("# Domain Scan Results\n\n")
+        self._file.write("## Detailed Results\n\n")
+        self._file.write("|  | Domain | Status Code | Category |\n")
+        self._file.write("|:-:|:-------|:-----------:|:---------|\n")
+
+    def _write(self, r):
+        emoji = status_md_emoji(r['category'])
+        domain = f"`{r['domain']}`"
+        status = r['status_code'] if r['status_code'] is not None else "-"
+        cat = f"`{r['category']}`"
+        if r.get("confidence") == "inferred":
+            cat += " *(inferred)*"
+        self._file.write(f"| {emoji} | {domain} | {status} | {cat} |\n")
+
+    def _close(self):
+        self._file.write("\n---\n\n")
+        self._file.write("## Summary\n\n")
+        self._file.write("| Category | Count |\n|---|---|\n")
+        for cat, count in self.summary.items():
+            self._file.write(f"| {status_md_emoji(cat)} `{cat}` | **{count}** |\n")
+        super()._close()
+
+HTML_HEAD = """
 <html>
 <head>
 <title>Scan Results</title>
@@ -340,52 +2850,269 @@ def write_html(results, html_file):
     .cat-iq_parked { background: #e6f0ff; }
     .cat-custom_500 { background: #ffe6e6; }
     .cat-custom_403, .cat-custom_502, .cat-custom_503 { background: #ffe6cc; }
-    .cat-unreachable { background: #f2f2f2; }
+    .cat-unreachable, .cat-dns_nxdomain, .cat-dns_no_address { background: #f2f2f2; }
     .cat-custom { background: #f3e6ff; }
     .cat-dry_run { background: #f9f9f9; }
     .emoji { font-size: 1.2em; }
+    .pages { text-align: center; margin: 1em; }
 </style>
 </head>
 <body>
 <h2>Domain Scan Results</h2>
-<table>
+"""
+
+HTML_TABLE_HEADER = """<table>
 <tr>
     <th></th>
     <th>Domain</th>
     <th>Status Code</th>
     <th>Category</th>
 </tr>
-""")
-            for r in results:
-                emoji = status_md_emoji(r['category'])
-                cat_class = f"cat-{r['category']}"
-                color = html_row_color(r['category'])
-                domain = r['domain']
-                status = r['status_code'] if r['status_code'] is not None else "-"
-                cat = r['category']
-                f.write(f"<tr class='{cat_class}' style='background:{color}'>"
-                        f"<td class='emoji'>{emoji}</td>"
-                        f"<td><code>{domain}</code></td>"
-                        f"<td>{status}</td>"
-                        f"<td><code>{cat}</code></td>"
-                        f"</tr>\n")
-            f.write("</table>\n</body>\n</html>")
-        logging.info(f"Results written to HTML: {html_file}")
-    except Exception as e:
-        logging.error(f"Failed to write HTML file '{html_file}': {e}")
-        print(Fore.RED + f"Error writing HTML file '{html_file}': {e}")
+"""
+
+class HtmlReportWriter(ReportWriter):
+    # Rows go into pages of page_size rows: scan_results.html, scan_results_page2.html, ...
+    # Every page links to its neighbours; the summary is added to the last page at close.
+    label = "HTML"
+
+    def __init__(self, path, page_size=DEFAULT_HTML_PAGE_SIZE):
+        self.page_size = max(1, page_size)
+        self.page = 1
+        self._page_rows = 0
+        super().__init__(path)
+
+    def page_path(self, page):
+        if page == 1:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f"{root}_page{page}{ext or '.html'}"
+
+    def _page_link(self, page, text):
+        return f"<a href='{os.path.basename(self.page_path(page))}'>{text}</a>"
+
+    def _open(self):
+        self._file = open(self.page_path(self.page), 'w', encoding='utf-8')
+        self._file.write(HTML_HEAD)
+        if self.page > 1:
+            self._file.write(f"<div class='pages'>Page {self.page} &middot; {self._page_link(1, 'first')} &middot; "
+                             f"{self._page_link(self.page - 1, 'previous')}</div>\n")
+        self._file.write(HTML_TABLE_HEADER)
+
+    def _end_page(self, last):
+        self._file.write("</table>\n")
+        if not last:
+            self._file.write(f"<div class='pages'>{self._page_link(self.page + 1, 'next page')}</div>\n")
+        else:
+            self._file.write("<h3>Summary</h3>\n<table>\n<tr><th></th><th>Category</th><th>Count</th></tr>\n")
+            for cat, count in self.summary.items():
+                self._file.write(f"<tr class='cat-{html.escape(cat)}'><td class='emoji'>{status_md_emoji(cat)}</td>"
+                                 f"<td><code>{html.escape(cat)}</code></td><td>{count}</td></tr>\n")
+            self._file.write("</table>\n")
+            if self.page > 1:
+                self._file.write(f"<div class='pages'>{self.page} pages &middot; {self._page_link(1, 'first page')}</div>\n")
+        self._file.write("</body>\n</html>")
+        self._file.close()
+
+    def _write(self, r):
+        if self._page_rows >= self.page_size:
+            self._end_page(last=False)
+            self.page += 1
+            self._page_rows = 0
+            self._open()
+        self._page_rows += 1
+        emoji = status_md_emoji(r['category'])
+        cat_class = f"cat-{r['category']}"
+        color = html_row_color(r['category'])
+        domain = html.escape(r['domain'])
+        status = r['status_code'] if r['status_code'] is not None else "-"
+        cat = html.escape(r['category'])
+        inferred = " <em>(inferred)</em>" if r.get("confidence") == "inferred" else ""
+        self._file.write(f"<tr class='{html.escape(cat_class)}' style='background:{color}'>"
+                         f"<td class='emoji'>{emoji}</td>"
+                         f"<td><code>{domain}</code></td>"
+                         f"<td>{status}</td>"
+                         f"<td><code>{cat}</code>{inferred}</td>"
+                         f"</tr>\n")
+
+    def _close(self):
+        self._end_page(last=True)
+
+class JsonReportWriter(ReportWriter):
+    # Streams a compact JSON array; it becomes valid JSON when closed
+    label = "JSON"
+
+    def _open(self):
+        super()._open()
+        self._file.write("[")
+
+    def _write(self, result):
+        self._file.write(("\n" if self.rows == 1 else ",\n") + json.dumps(result, separators=(",", ":")))
+
+    def _close(self):
+        self._file.write("\n]\n")
+        super()._close()
+
+class JsonlReportWriter(ReportWriter):
+    # One JSON object per line, written through with no buffering
+    label = "JSONL"
+
+    def _open(self):
+        self._file = open(self.path, 'w', encoding='utf-8', buffering=1)
+
+    def _write(self, result):
+        self._file.write(json.dumps(result, separators=(",", ":")) + "\n")
+
+class ChangesReportWriter(CsvReportWriter):
+    # Category transitions of an incremental scan, one row per domain whose category
+    # differs from its last earlier result
+    label = "changes CSV"
+    fieldnames = ["domain", "previous_category", "category", "previous_status_code", "status_code", "previous_check"]
+
+class ReportWriters:
+    # Fans every result out to all open writers, honouring --errors-only. `complete`
+    # writers (a shard's partial results) get every result regardless, since they feed
+    # a later merge that applies --errors-only itself.
+    def __init__(self, writers, errors_only=False, complete=()):
+        self.writers = writers
+        self.errors_only = errors_only
+        self.complete = list(complete)
+
+    def write(self, result):
+        for writer in self.complete:
+            writer.write(result)
+        if self.errors_only and result['category'] == "no_error":
+            return
+        for writer in self.writers:
+            writer.write(result)
+
+    def close(self):
+        for writer in self.writers + self.complete:
+            writer.close()
+
+class ResultStore:
+    # Compact in-memory results for multi-million domain runs. Instead of a dict per
+    # result, each domain maps to a small integer code for its (status_code, category,
+    # confidence) combination; the combinations are interned once in a shared table and
+    # there are only a few hundred of them. The same mapping answers "already scanned?"
+    # and keeps insertion order. Other fields (timings_ms) are kept per domain. Adding a
+    # domain again replaces its result in place. Iterating yields result dicts.
+    FIELDS = ("domain", "status_code", "category", "confidence")
+
+    def __init__(self, results=()):
+        self._codes = {}
+        self._keys = []
+        self._rows = {}
+        self._extras = {}
+        self.extend(results)
+
+    def _code(self, key):
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self._keys)
+            self._keys.append(key)
+        return code
+
+    def append(self, result):
+        domain = result["domain"]
+        self._rows[domain] = self._code((result["status_code"], result["category"], result.get("confidence")))
+        if len(result) > 3:
+            extras = {k: v for k, v in result.items() if k not in self.FIELDS}
+            if extras:
+                self._extras[domain] = extras
+                return
+        if self._extras:
+            self._extras.pop(domain, None)
+
+    def extend(self, results):
+        for result in results:
+            self.append(result)
+
+    def _result(self, domain, code):
+        status_code, category, confidence = self._keys[code]
+        result = {"domain": domain, "status_code": status_code, "category": category}
+        if confidence is not None:
+            result["confidence"] = confidence
+        extras = self._extras.get(domain)
+        if extras:
+            result.update(extras)
+        return result
+
+    def get(self, domain):
+        code = self._rows.get(domain)
+        return None if code is None else self._result(domain, code)
+
+    def __contains__(self, domain):
+        return domain in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        for domain, code in self._rows.items():
+            yield self._result(domain, code)
+
+    def category_counts(self):
+        # Counted on the integer codes, without building a dict per result
+        counts = Counter()
+        for code, count in Counter(self._rows.values()).items():
+            counts[self._keys[code][1]] += count
+        return counts
+
+    def excluding(self, category):
+        return ResultStore(r for r in self if r["category"] != category)
+
+def _write_report(writer, results):
+    for result in results:
+        writer.write(result)
+    writer.close()
+
+def write_csv(results, csv_file):
+    _write_report(CsvReportWriter(csv_file), results)
+
+def write_md(results, md_file):
+    _write_report(MarkdownReportWriter(md_file), results)
+
+def write_html(results, html_file, page_size=DEFAULT_HTML_PAGE_SIZE):
+    _write_report(HtmlReportWriter(html_file, page_size), results)
 
 def write_json(results, json_file):
+    _write_report(JsonReportWriter(json_file), results)
+
+def write_jsonl(results, jsonl_file):
+    _write_report(JsonlReportWriter(jsonl_file), results)
+
+def write_pdf(results, pdf_file):
+    # Optional: needs reportlab, which is only imported when a PDF is requested
+    try:
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+    except ImportError:
+        logging.warning("reportlab is not installed; skipping PDF output")
+        print(Fore.YELLOW + "PDF output needs reportlab (pip install reportlab); skipping PDF.")
+        return
     try:
-        with open(json_file, 'w') as f:
-            json.dump(results, f, indent=2)
-        logging.info(f"Results written to JSON: {json_file}")
+        rows = [["Domain", "Status Code", "Category"]]
+        style = [("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#222222")),
+                 ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+                 ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#bbbbbb"))]
+        for i, r in enumerate(results, 1):
+            rows.append([r['domain'], r['status_code'] if r['status_code'] is not None else "-", r['category']])
+            style.append(("BACKGROUND", (0, i), (-1, i), colors.HexColor(html_row_color(r['category']))))
+        table = Table(rows, repeatRows=1)
+        table.setStyle(TableStyle(style))
+        SimpleDocTemplate(pdf_file, pagesize=A4).build([table])
+        logging.info(f"Results written to PDF: {pdf_file}")
     except Exception as e:
-        logging.error(f"Failed to write JSON file '{json_file}': {e}")
-        print(Fore.RED + f"Error writing JSON file '{json_file}': {e}")
+        logging.error(f"Failed to write PDF file '{pdf_file}': {e}")
+        print(Fore.RED + f"Error writing PDF file '{pdf_file}': {e}")
 
-def summarize_results(results, summary_file=None):
-    summary = Counter(r['category'] for r in results)
+def summarize_results(results, summary_file=None, cache_stats=None, coalesce_stats=None, concurrency_history=None,
+                      change_stats=None):
+    if isinstance(results, ResultStore):
+        summary = results.category_counts()
+    else:
+        summary = Counter(r['category'] for r in results)
     print(Style.BRIGHT + "\nSummary:")
     lines = []
     for category, count in summary.items():
@@ -400,12 +3127,37 @@ def summarize_results(results, summary_file=None):
             "custom_502": Fore.MAGENTA,
             "custom_503": Fore.MAGENTA,
             "unreachable": Fore.MAGENTA,
+            "dns_nxdomain": Fore.MAGENTA,
+            "dns_no_address": Fore.MAGENTA,
             "dry_run": Fore.CYAN
         }.get(category, Fore.WHITE)
         line = f"{category}: {count}"
         print(color + line)
         logging.info(f"Summary: {line}")
         lines.append(line)
+    if cache_stats:
+        line = (f"cache: {cache_stats['hits']} hits, {cache_stats['revalidated']} revalidated, "
+                f"{cache_stats['misses']} misses")
+        print(Fore.WHITE + line)
+        logging.info(f"Summary: {line}")
+        lines.append(line)
+    if coalesce_stats:
+        line = (f"coalesced: {coalesce_stats['inferred']} results inferred from samples on "
+                f"{coalesce_stats['groups']} addresses ({coalesce_stats['split_groups']} addresses scanned in full)")
+        print(Fore.WHITE + line)
+        logging.info(f"Summary: {line}")
+        lines.append(line)
+    if change_stats:
+        line = (f"changes: {change_stats['changes']} category transitions since earlier runs, "
+                f"{change_stats['unscanned']} domains left for a later run")
+        print(Fore.WHITE + line)
+        logging.info(f"Summary: {line}")
+        lines.append(line)
+    if concurrency_history:
+        line = "concurrency over time: " + ", ".join(f"{format_seconds(t)}={n}" for t, n in concurrency_history)
+        print(Fore.WHITE + line)
+        logging.info(f"Summary: {line}")
+        lines.append(line)
     if summary_file:
         try:
             with open(summary_file, "w") as f:
@@ -413,19 +3165,462 @@ def summarize_results(results, summary_file=None):
         except Exception as e:
             logging.error(f"Failed to write summary file: {e}")
 
-def save_progress(progress_file, results):
+class ProgressJournal:
+    # Append-only JSONL checkpoint log. A single writer thread drains a queue and
+    # fsyncs in batches, so checkpoint cost stays constant per domain.
+    _STOP = object()
+
+    def __init__(self, progress_file, resume=True, fsync_every=100, fsync_interval=1.0):
+        self.progress_file = progress_file
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        if resume:
+            _truncate_partial_line(progress_file)
+        self._file = open(progress_file, "a" if resume else "w", encoding="utf-8")
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="progress-journal", daemon=True)
+        self._thread.start()
+
+    def append(self, result):
+        self._queue.put(result)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _run(self):
+        unsynced = 0
+        last_sync = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                item = None
+            try:
+                if item is self._STOP:
+                    self._sync()
+                    return
+                start = time.perf_counter()
+                if item is not None:
+                    self._file.write(json.dumps(item, separators=(",", ":")) + "\n")
+                    unsynced += 1
+                if unsynced and (unsynced >= self.fsync_every or time.monotonic() - last_sync >= self.fsync_interval):
+                    self._sync()
+                    unsynced = 0
+                    last_sync = time.monotonic()
+                if item is not None:
+                    record_phase("checkpoint", time.perf_counter() - start)
+            except Exception as e:
+                logging.error(f"Failed to save progress: {e}")
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        if not self._file.closed:
+            self._file.close()
+
+def _truncate_partial_line(path):
+    # Drop a half-written last record (e.g. after a crash) so new records start on a fresh line
     try:
-        with open(progress_file, 'w') as f:
-            json.dump(results, f)
-    except Exception as e:
-        logging.error(f"Failed to save progress: {e}")
+        with open(path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            pos = size
+            while pos > 0:
+                step = min(65536, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    pos += newline + 1
+                    break
+            if pos < size:
+                f.truncate(pos)
+    except FileNotFoundError:
+        pass
 
-def load_progress(progress_file):
+def iter_progress(progress_file):
+    # Streams the records of a progress journal (or shard results file) without reading it all
     try:
-        with open(progress_file, 'r') as f:
-            return json.load(f)
+        f = open(progress_file, "r", encoding="utf-8")
     except Exception:
-        return []
+        return
+    with f:
+        first = f.readline()
+        # Older runs wrote the whole results list as one JSON array
+        if first.lstrip().startswith("["):
+            try:
+                yield from json.loads(first + f.read())
+            except ValueError:
+                pass
+            return
+        decode = json.JSONDecoder().decode
+        for number, line in enumerate(itertools.chain([first], f), 1):
+            try:
+                yield decode(line)
+            except ValueError:
+                if not line.endswith("\n"):
+                    logging.warning(f"Ignoring truncated last record in {progress_file}")
+                elif line.strip():
+                    logging.warning(f"Ignoring corrupt record on line {number} of {progress_file}")
+
+def load_progress(progress_file):
+    return list(iter_progress(progress_file))
+
+class ResultCache:
+    # Persistent per-domain result store shared across runs (SQLite). Entries younger
+    # than `ttl` seconds are reused as is; older ones are revalidated with conditional
+    # requests so an unchanged page costs a 304 instead of a full download.
+    # Several processes (--processes shards) may share one file: writes are buffered in
+    # memory and flushed in one short transaction, lock waits are bounded by
+    # `busy_timeout`, and SQLite errors are logged instead of failing the scan.
+    _COLUMNS = ("status_code", "category", "etag", "last_modified", "fingerprint", "checked_at")
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL, commit_every=500, clock=time.time,
+                 busy_timeout=CACHE_BUSY_TIMEOUT):
+        self.path = path
+        self.ttl = ttl
+        self.commit_every = max(1, commit_every)
+        self.clock = clock
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        import sqlite3
+        self._errors = sqlite3.Error
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS results (
+            domain TEXT PRIMARY KEY,
+            status_code INTEGER,
+            category TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fingerprint TEXT,
+            checked_at REAL NOT NULL)""")
+
+    def get(self, domain):
+        with self._lock:
+            row = self._pending.get(domain)
+            if row is None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT status_code, category, etag, last_modified, fingerprint, checked_at "
+                        "FROM results WHERE domain = ?", (domain,)).fetchone()
+                except self._errors as e:
+                    logging.warning(f"Result cache lookup for {domain} failed: {e}")
+        if row is None:
+            return None
+        return dict(zip(self._COLUMNS, row), domain=domain)
+
+    def is_fresh(self, entry):
+        return entry is not None and self.clock() - entry["checked_at"] < self.ttl
+
+    def fresh_result(self, domain):
+        # Cached result if it is still within the TTL, otherwise None
+        return self.reuse(self.get(domain))
+
+    def reuse(self, entry):
+        # Like fresh_result, for an entry the caller has already looked up
+        if not self.is_fresh(entry):
+            return None
+        with self._lock:
+            self.hits += 1
+        return {"domain": entry["domain"], "status_code": entry["status_code"], "category": entry["category"]}
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def revalidated_result(self, entry):
+        # The server answered 304: the cached result is still valid
+        row = tuple(entry[key] for key in self._COLUMNS[:-1]) + (self.clock(),)
+        with self._lock:
+            self.revalidated += 1
+            self._queue(entry["domain"], row)
+        return {"domain": entry["domain"], "status_code": entry["status_code"], "category": entry["category"]}
+
+    def store(self, result, headers=None, content=None):
+        # Only actual HTTP answers are cached; unreachable domains are retried next run
+        if result.get("status_code") is None:
+            return
+        headers = headers or {}
+        fingerprint = hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest() if content else None
+        row = (result["status_code"], result["category"], headers.get("etag"), headers.get("last-modified"),
+               fingerprint, self.clock())
+        with self._lock:
+            self.misses += 1
+            self._queue(result["domain"], row)
+
+    def _queue(self, domain, row):
+        self._pending[domain] = row
+        if len(self._pending) >= self.commit_every:
+            self._flush()
+
+    def _flush(self):
+        # One short write transaction per batch, so other processes sharing the file
+        # wait for at most one flush. A batch that cannot be written is dropped: those
+        # domains are simply scanned again next run.
+        if not self._pending:
+            return
+        rows = [(domain,) + row for domain, row in self._pending.items()]
+        self._pending = {}
+        try:
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO results (domain, status_code, category, etag, last_modified, "
+                    "fingerprint, checked_at) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        except self._errors as e:
+            logging.warning(f"Could not write {len(rows)} entries to result cache '{self.path}': {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+def shard_index(domain, count):
+    # Stable across processes and machines, unlike the built-in hash()
+    digest = hashlib.blake2b(domain.lower().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N (e.g. 0/4)")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected 0 <= i < N")
+    return index, count
+
+def _strip_options(argv, names):
+    # Drops `--name value` and `--name=value` options from a command line
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in names:
+            skip = True
+        elif arg.split("=", 1)[0] not in names:
+            stripped.append(arg)
+    return stripped
+
+def shard_dirs_for(results_dir, count):
+    return [os.path.join(results_dir, f"shard_{i}") for i in range(count)]
+
+def split_limit(limit, count):
+    # Splits a --max-domains limit across `count` shards so that the shares add up to it
+    return [limit // count + (i < limit % count) for i in range(count)]
+
+def ask_resume(progress_files, choice="ask"):
+    # Whether to resume from the given existing progress files: `choice` is "yes", "no"
+    # or "ask", which prompts on the terminal
+    if not progress_files:
+        return False
+    for path in progress_files:
+        print(Fore.YELLOW + f"Found progress file: {path}")
+    if choice == "ask":
+        choice = "yes" if input("Resume previous scan? (y/n): ").strip().lower() == "y" else "no"
+    if choice == "no":
+        print(Fore.YELLOW + "Starting a new scan. Previous progress will be overwritten.")
+    return choice == "yes"
+
+def run_shards(argv, count, results_dir, total=None, max_domains=None, resume=False):
+    # Runs `count` copies of this script, one per shard, each with its own thread or
+    # async pool and its own results folder. Progress is followed through the shards'
+    # JSONL partial results. The shards cannot prompt (their stdin is closed), so the
+    # caller decides whether they resume. Returns the shard folders.
+    child_argv = _strip_options(argv, ("--processes", "--shard", "--results-dir", "--max-domains", "--resume"))
+    shard_dirs = shard_dirs_for(results_dir, count)
+    limits = split_limit(max_domains, count) if max_domains is not None else [None] * count
+    processes = []
+    for i, shard_dir in enumerate(shard_dirs):
+        os.makedirs(shard_dir, exist_ok=True)
+        console = open(os.path.join(shard_dir, "console.txt"), "w")
+        command = [sys.executable, os.path.abspath(__file__), *child_argv,
+                   "--shard", f"{i}/{count}", "--results-dir", shard_dir, "--resume", "yes" if resume else "no"]
+        if limits[i] is not None:
+            command += ["--max-domains", str(limits[i])]
+        processes.append((subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=console, stderr=subprocess.STDOUT),
+                          console))
+        logging.info(f"Started shard {i}/{count} (pid {processes[-1][0].pid})")
+
+    from tqdm import tqdm
+    offsets = [0] * count
+    progress = tqdm(total=total, desc=f"Scanning ({count} processes)", unit="domain",
+                    disable=CONSOLE.verbosity == CONSOLE_QUIET)
+
+    def poll_progress():
+        for i, shard_dir in enumerate(shard_dirs):
+            try:
+                with open(os.path.join(shard_dir, SHARD_RESULTS_FILE), "rb") as f:
+                    f.seek(offsets[i])
+                    chunk = f.read()
+            except FileNotFoundError:
+                continue
+            done = chunk.rfind(b"\n") + 1
+            offsets[i] += done
+            progress.update(chunk.count(b"\n", 0, done))
+
+    try:
+        while any(process.poll() is None for process, _ in processes):
+            poll_progress()
+            time.sleep(SHARD_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        # The shards received the same SIGINT and save their own progress
+        for process, _ in processes:
+            process.wait()
+        raise
+    finally:
+        for _, console in processes:
+            console.close()
+    poll_progress()
+    progress.close()
+    for i, (process, _) in enumerate(processes):
+        if process.returncode != 0:
+            logging.error(f"Shard {i}/{count} exited with code {process.returncode}")
+            print(Fore.RED + f"Shard {i}/{count} failed (exit code {process.returncode}), see {shard_dirs[i]}/console.txt")
+    return shard_dirs
+
+def merge_shard_results(paths):
+    # Combines partial results of shard folders (or their JSONL files) into one
+    # ResultStore; a domain found in several inputs keeps its last result
+    merged = ResultStore()
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, SHARD_RESULTS_FILE)
+        if not os.path.exists(path):
+            logging.warning(f"No shard results found at {path}")
+            print(Fore.YELLOW + f"No shard results found at {path}")
+            continue
+        merged.extend(iter_progress(path))
+    return merged
+
+def run_started_at(run_dir):
+    # Start time of a results folder from its scan_results_<timestamp> name, else its mtime
+    match = re.search(r"(\d{8}_\d{6})$", os.path.basename(os.path.normpath(run_dir)))
+    if match:
+        try:
+            return datetime.strptime(match.group(1), RUN_DIR_TIME_FORMAT).timestamp()
+        except ValueError:
+            pass
+    return os.path.getmtime(run_dir)
+
+def iter_csv_results(path):
+    # Rows of a CSV report (comment lines skipped) as result dicts
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(line for line in f if not line.startswith("#"))
+            if not reader.fieldnames or not {"domain", "category"} <= set(reader.fieldnames):
+                return
+            for row in reader:
+                status = row.get("status_code") or ""
+                yield {"domain": row["domain"], "status_code": int(status) if status.isdigit() else None,
+                       "category": row["category"]}
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        logging.warning(f"Could not read results from {path}: {e}")
+
+def iter_run_results(run_dir):
+    # Results of an earlier run folder, from the first file holding any: JSON Lines (the
+    # journal of an interrupted run, shard results, --jsonl), then JSON, then CSV reports
+    try:
+        names = os.listdir(run_dir)
+    except OSError:
+        return
+    json_names = sorted((n for n in names if n.endswith((".jsonl", ".json")) and n not in RUN_METADATA_FILES),
+                        key=lambda n: (not n.endswith(".jsonl"), n))
+    csv_names = sorted(n for n in names if n.endswith(".csv") and n != CHANGES_FILE)
+    for name in json_names + csv_names:
+        path = os.path.join(run_dir, name)
+        found = False
+        for record in (iter_csv_results(path) if name.endswith(".csv") else iter_progress(path)):
+            if isinstance(record, dict) and "domain" in record and "category" in record:
+                found = True
+                yield record
+        if found:
+            return
+
+class RunHistory:
+    # Per-domain summary of earlier runs, folded in chronological order into one small
+    # list per domain: [category, status_code, last checked, last changed, checks, changes]
+    def __init__(self):
+        self.domains = {}
+        self.runs = []
+
+    @classmethod
+    def load(cls, pattern=HISTORY_GLOB, exclude=()):
+        excluded = {os.path.abspath(path) for path in exclude}
+        run_dirs = [path for path in glob.glob(pattern) if os.path.isdir(path) and os.path.abspath(path) not in excluded]
+        history = cls()
+        for started_at, run_dir in sorted((run_started_at(path), path) for path in run_dirs):
+            history.add_run(iter_run_results(run_dir), started_at)
+            history.runs.append(run_dir)
+        return history
+
+    def add_run(self, results, started_at):
+        for result in results:
+            category = result["category"]
+            if category == "dry_run":
+                continue
+            entry = self.domains.get(result["domain"])
+            if entry is None:
+                self.domains[result["domain"]] = [category, result.get("status_code"), started_at, None, 1, 0]
+                continue
+            if entry[2] == started_at:
+                continue  # listed twice in one run
+            if entry[0] != category:
+                entry[3] = started_at
+                entry[5] += 1
+            entry[0], entry[1], entry[2] = category, result.get("status_code"), started_at
+            entry[4] += 1
+
+    def __len__(self):
+        return len(self.domains)
+
+    def priority(self, domain, now):
+        entry = self.domains.get(domain)
+        if entry is None:
+            return math.inf
+        _, _, checked, changed, checks, changes = entry
+        volatility = changes / (checks - 1) if checks > 1 else 0.0
+        recency = 0.5 ** (max(0.0, now - changed) / CHANGE_HALF_LIFE) if changed is not None else 0.0
+        staleness = min(1.0, max(0.0, now - checked) / STALE_AFTER)
+        return volatility + recency + staleness
+
+    def prioritize(self, domains, now=None):
+        # Highest priority first; equal priorities keep their input order
+        now = time.time() if now is None else now
+        return sorted(domains, key=lambda domain: -self.priority(domain, now))
+
+    def change(self, result):
+        # The category transition of `result` against its domain's last earlier result, or None
+        entry = self.domains.get(result["domain"])
+        if entry is None or entry[0] == result["category"] or result["category"] == "dry_run":
+            return None
+        return {"domain": result["domain"], "previous_category": entry[0], "category": result["category"],
+                "previous_status_code": entry[1], "status_code": result.get("status_code"),
+                "previous_check": datetime.fromtimestamp(entry[2]).strftime("%Y-%m-%d %H:%M:%S")}
+
+def until_deadline(items, deadline, clock=time.monotonic):
+    # Stops taking items once `deadline` has passed; items already taken are still scanned
+    for item in items:
+        if clock() >= deadline:
+            logging.info("Time budget reached; no further domains are started")
+            return
+        yield item
 
 def format_seconds(seconds):
     # Helper to format seconds as H:M:S
@@ -449,37 +3644,86 @@ def main():
     parser.add_argument('--delay-min', type=int, default=DEFAULT_DELAY_MIN, help='Minimum delay between requests (seconds)')
     parser.add_argument('--delay-max', type=int, default=DEFAULT_DELAY_MAX, help='Maximum delay between requests (seconds)')
     parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Set log level')
-    parser.add_argument('--patterns', default=None, help='Path to JSON file with hosting error/parked page patterns')
+    parser.add_argument('--patterns', default=None, help='Path to JSON file with hosting error/parked page patterns; reloaded when it changes during a scan')
+    parser.add_argument('--patterns-cache', default=None, help=f'Compiled patterns artifact (default: the --patterns file plus {PATTERN_CACHE_SUFFIX})')
     parser.add_argument('--log-console', action='store_true', help='Also log to console')
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument('--quiet', action='store_true', help='No progress bar or per-domain output, only warnings and the final summary')
+    verbosity.add_argument('--verbose', action='store_true', help='Print a line per domain above the progress bar (default: result counts only)')
     parser.add_argument('--threads', type=int, default=1, help='Number of parallel threads (default: 1)')
+    parser.add_argument('--adaptive', action='store_true', help='Adapt the number of requests in flight (AIMD) between --min-threads and --max-threads, starting at --threads')
+    parser.add_argument('--min-threads', type=int, default=DEFAULT_MIN_THREADS, help=f'Lower bound for --adaptive (default: {DEFAULT_MIN_THREADS})')
+    parser.add_argument('--max-threads', type=int, default=DEFAULT_MAX_THREADS, help=f'Upper bound for --adaptive (default: {DEFAULT_MAX_THREADS})')
     parser.add_argument('--no-delay', action='store_true', help='Skip delay between requests')
+    parser.add_argument('--host-rate', type=float, default=None, help='Requests per second allowed per host (default: one per average of --delay-min/--delay-max)')
+    parser.add_argument('--host-burst', type=int, default=1, help='Requests a host may receive back to back before --host-rate applies (default: 1)')
     parser.add_argument('--only-unscanned', action='store_true', help='Only scan domains not present in previous results')
     parser.add_argument('--errors-only', action='store_true', help='Only output domains with errors (not no_error)')
-    parser.add_argument('--max-domains', type=int, default=None, help='Limit the number of domains to scan')
+    parser.add_argument('--max-domains', type=int, default=None, help='Limit the number of domains to scan (split across shards with --processes)')
+    parser.add_argument('--resume', default='ask', choices=['ask', 'yes', 'no'], help='Resume from an existing progress file without asking (yes), start over (no) or ask (default)')
+    parser.add_argument('--incremental', action='store_true', help='Scan volatile, recently changed and long unchecked domains first, based on earlier results folders (see --history), and write changes.csv')
+    parser.add_argument('--history', default=HISTORY_GLOB, help=f'Glob of earlier results folders used by --incremental (default: {HISTORY_GLOB})')
+    parser.add_argument('--time-budget', type=float, default=None, help='Stop starting new domains after this many seconds')
     parser.add_argument('--json', default=None, help='Output JSON file path')
+    parser.add_argument('--jsonl', default=None, help='Output JSON Lines file path (streamed as results arrive)')
+    parser.add_argument('--html-page-size', type=int, default=DEFAULT_HTML_PAGE_SIZE, help=f'Rows per HTML page (default: {DEFAULT_HTML_PAGE_SIZE})')
     parser.add_argument('--pdf', default=None, help='Output PDF file path')
     parser.add_argument('--timeout', type=int, default=5, help='Timeout for HTTP requests (seconds)')
     parser.add_argument('--retries', type=int, default=2, help='Number of retries for failed requests')
+    parser.add_argument('--retry-budget', type=float, default=DEFAULT_RETRY_BUDGET, help=f'Retries allowed per first attempt across the whole scan, plus {RETRY_BUDGET_MINIMUM} (default: {DEFAULT_RETRY_BUDGET})')
+    parser.add_argument('--schemes', default='off', choices=SCHEME_MODES, help='Try https then http (off, default), both at once (race) or http after --stagger-delay (stagger)')
+    parser.add_argument('--stagger-delay', type=float, default=DEFAULT_STAGGER_DELAY, help=f'Seconds before the http attempt starts with --schemes stagger (default: {DEFAULT_STAGGER_DELAY})')
+    parser.add_argument('--max-body-bytes', type=int, default=DEFAULT_MAX_BODY_BYTES, help=f'Maximum bytes read from an error page body (default: {DEFAULT_MAX_BODY_BYTES})')
+    parser.add_argument('--no-dns', action='store_true', help='Skip the DNS pre-resolution stage')
+    parser.add_argument('--dns-workers', type=int, default=DEFAULT_DNS_WORKERS, help=f'Parallel DNS lookups (default: {DEFAULT_DNS_WORKERS})')
+    parser.add_argument('--dns-cache-size', type=int, default=DEFAULT_DNS_CACHE_SIZE, help=f'Host names kept in the DNS cache (default: {DEFAULT_DNS_CACHE_SIZE})')
+    parser.add_argument('--dns-ttl', type=int, default=DEFAULT_DNS_TTL, help=f'Seconds a DNS answer is cached (default: {DEFAULT_DNS_TTL})')
+    parser.add_argument('--pool-hosts', type=int, default=DEFAULT_POOL_HOSTS, help=f'Hosts kept in each keep-alive session pool (default: {DEFAULT_POOL_HOSTS})')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, help=f'Keep-alive connections kept per host (default: {DEFAULT_POOL_SIZE})')
+    parser.add_argument('--cache-db', default=None, help='SQLite file caching results across runs; unchanged pages are revalidated with conditional requests')
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_CACHE_TTL, help=f'Seconds a cached result is reused without any request (default: {DEFAULT_CACHE_TTL})')
+    parser.add_argument('--fingerprint-db', default=None, help='JSON file of known page templates, kept across runs; near-identical pages are labeled by fingerprint and unknown templates are reported')
+    parser.add_argument('--coalesce', action='store_true', help='Infer the result of domains on an IP whose sampled domains all got the same parking or hosting-error page, instead of scanning them')
+    parser.add_argument('--coalesce-samples', type=int, default=COALESCE_SAMPLE_SIZE, help=f'Domains scanned per resolved IP before the others on it are inferred with --coalesce (default: {COALESCE_SAMPLE_SIZE})')
+    parser.add_argument('--timings', action='store_true', help='Add per-domain phase timings (ms) to the CSV, JSON and JSONL outputs')
+    parser.add_argument('--processes', type=int, default=1, help='Split the input into N shards scanned by N worker processes, then merge the results (default: 1)')
+    parser.add_argument('--shard', type=parse_shard, default=None, help='Only scan shard i of N (0-based, e.g. 0/4) and write its partial results; see --merge')
+    parser.add_argument('--merge', nargs='+', default=None, metavar='DIR', help='Merge partial results of --shard runs (results folders or shard_results.jsonl files) instead of scanning')
+    parser.add_argument('--results-dir', default=None, help='Results folder (default: scan_results_<timestamp>)')
+    parser.add_argument('--engine', default='threads', choices=['threads', 'async'], help='Scan engine: thread pool (default) or asyncio')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help=f'Domains in flight with --engine async (default: {DEFAULT_CONCURRENCY})')
     args = parser.parse_args()
+    if args.processes > 1 and (args.shard or args.merge):
+        parser.error("--processes cannot be combined with --shard or --merge")
+    if args.processes > 1 and args.input == "-":
+        parser.error("--processes cannot read the input from stdin; every shard reads the input file itself")
+    # Coalescing needs the resolved addresses of the DNS stage, which the async engine does not have up front
+    if args.coalesce and (args.engine != "threads" or args.no_dns):
+        parser.error("--coalesce needs the thread engine and the DNS stage (not --engine async or --no-dns)")
+    coalescing = args.coalesce and not args.dry_run
 
     # Load hosting patterns
-    hosting_patterns = load_hosting_patterns(args.patterns)
+    pattern_db = None
+    try:
+        if args.patterns:
+            pattern_db = PatternDatabase(args.patterns, args.patterns_cache)
+            hosting_patterns = pattern_db.load()
+        else:
+            hosting_patterns = compile_patterns(load_hosting_patterns())
+    except PatternFileError as e:
+        parser.error(str(e))
 
     # Create a timestamped results directory
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    results_dir = f"scan_results_{timestamp}"
+    results_dir = args.results_dir or f"scan_results_{timestamp}"
     os.makedirs(results_dir, exist_ok=True)
 
     # Update output file paths to be inside the results directory
     csv_path = os.path.join(results_dir, os.path.basename(args.csv))
     md_path = os.path.join(results_dir, os.path.basename(args.md))
     html_path = os.path.join(results_dir, os.path.basename(args.html))
-    # --- Always set a default PDF path if not provided ---
-    if args.pdf:
-        pdf_path = os.path.join(results_dir, os.path.basename(args.pdf))
-    else:
-        pdf_path = os.path.join(results_dir, "scan_results.pdf")
-    progress_file = os.path.join(results_dir, "progress.json")
+    pdf_path = os.path.join(results_dir, os.path.basename(args.pdf)) if args.pdf else None
+    progress_file = os.path.join(results_dir, "progress.jsonl")
     summary_path = os.path.join(results_dir, "summary.txt")
 
     # Update log file to be inside the results directory
@@ -494,102 +3738,276 @@ def main():
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         console.setFormatter(formatter)
         logging.getLogger().addHandler(console)
+    start_log_writer()
+    CONSOLE.verbosity = CONSOLE_QUIET if args.quiet else CONSOLE_VERBOSE if args.verbose else CONSOLE_NORMAL
+
+    def open_reports():
+        writers = [CsvReportWriter(csv_path, timings=args.timings, confidence=coalescing), MarkdownReportWriter(md_path), HtmlReportWriter(html_path, args.html_page_size)]
+        if args.json:
+            writers.append(JsonReportWriter(os.path.join(results_dir, os.path.basename(args.json))))
+        if args.jsonl:
+            writers.append(JsonlReportWriter(os.path.join(results_dir, os.path.basename(args.jsonl))))
+        complete = [JsonlReportWriter(os.path.join(results_dir, SHARD_RESULTS_FILE))] if args.shard else []
+        return ReportWriters(writers, errors_only=args.errors_only, complete=complete)
+
+    def write_merged(results):
+        reports = open_reports()
+        for result in results:
+            reports.write(result)
+        reports.close()
+        if args.errors_only:
+            results = results.excluding("no_error")
+        if args.pdf:
+            write_pdf(results, pdf_path)
+        summarize_results(results, summary_file=summary_path)
+        logging.info(f"Merged {len(results)} results into {results_dir}")
+
+    if args.merge:
+        write_merged(merge_shard_results(args.merge))
+        return
+    if args.processes > 1:
+        num_domains = count_input_lines(args.input)
+        if num_domains is not None and args.max_domains is not None:
+            num_domains = min(num_domains, args.max_domains)
+        progress_files = [os.path.join(d, "progress.jsonl") for d in shard_dirs_for(results_dir, args.processes)]
+        resume = ask_resume([f for f in progress_files if os.path.exists(f)], args.resume)
+        scan_start = time.monotonic()
+        shard_dirs = run_shards(sys.argv[1:], args.processes, results_dir, total=num_domains,
+                                max_domains=args.max_domains, resume=resume)
+        results = merge_shard_results(shard_dirs)
+        elapsed = time.monotonic() - scan_start
+        rate = len(results) / elapsed if elapsed > 0 else 0.0
+        CONSOLE.message(Fore.CYAN + f"Scanned {len(results)} domains in {format_seconds(elapsed)} ({rate:.1f} domains/sec, {args.processes} processes)")
+        logging.info(f"Throughput: {len(results)} domains in {elapsed:.2f}s ({rate:.2f} domains/sec, {args.processes} processes)")
+        write_merged(results)
+        return
 
-    domains = read_domains(args.input)
+    input_stats = InputStats()
+    domains = iter_domains(args.input, input_stats, DomainDeduplicator())
+    if args.shard:
+        shard, shard_count = args.shard
+        domains = (d for d in domains if shard_index(d, shard_count) == shard)
 
     # Resume logic
-    results = []
-    already_scanned = set()
-    if os.path.exists(progress_file):
-        print(Fore.YELLOW + f"Found progress file: {progress_file}")
-        choice = input("Resume previous scan? (y/n): ").strip().lower()
-        if choice == "y":
-            results = load_progress(progress_file)
-            already_scanned = set(r['domain'] for r in results)
-            print(Fore.YELLOW + f"Resuming scan. {len(already_scanned)} domains already scanned.")
-        else:
-            print(Fore.YELLOW + "Starting a new scan. Previous progress will be overwritten.")
+    # Results of this run (and the resumed one); also answers "already scanned?"
+    results = ResultStore()
+    resume = ask_resume([progress_file] if os.path.exists(progress_file) else [], args.resume)
+    if resume:
+        results.extend(iter_progress(progress_file))
+        print(Fore.YELLOW + f"Resuming scan. {len(results)} domains already scanned.")
 
     # --- Only scan unscanned domains if requested ---
+    domains_to_scan = domains
     if args.only_unscanned:
-        domains_to_scan = [d for d in domains if d not in already_scanned]
-    else:
-        domains_to_scan = domains
+        domains_to_scan = (d for d in domains_to_scan if d not in results)
+
+    # --- Rank by earlier runs; the whole input is read to sort it ---
+    history = None
+    if args.incremental:
+        history = RunHistory.load(args.history, exclude=[results_dir])
+        domains_to_scan = history.prioritize(domains_to_scan)
+        ranked_domains = domains_to_scan
+        CONSOLE.message(Fore.CYAN + f"Incremental scan: {len(history)} of {len(ranked_domains)} domains have history "
+                                    f"in {len(history.runs)} earlier runs")
 
     # --- Limit max domains if requested ---
     if args.max_domains is not None:
-        domains_to_scan = domains_to_scan[:args.max_domains]
+        domains_to_scan = itertools.islice(domains_to_scan, args.max_domains)
 
-    num_domains = len(domains_to_scan)
-    avg_delay = (args.delay_min + args.delay_max) / 2
+    # The input is streamed, so only an upper bound of its size is known up front
+    num_domains = len(ranked_domains) if history is not None else count_input_lines(args.input)
+    if num_domains is not None and args.shard and history is None:
+        num_domains = math.ceil(num_domains / args.shard[1])
+    if num_domains is not None and args.max_domains is not None:
+        num_domains = min(num_domains, args.max_domains)
     threads = max(1, args.threads)
-    # Only apply delay if not dry-run and not --no-delay
-    if not args.dry_run and not args.no_delay:
-        estimated_total_seconds = (num_domains * avg_delay) / threads
-        print(Fore.CYAN + f"Estimated scan time for {num_domains} domains with {threads} thread(s): {format_seconds(estimated_total_seconds)}")
-    else:
-        print(Fore.CYAN + f"Estimated scan time: <1s (dry-run or no-delay mode)")
+    # Per-host politeness applies unless dry-run or --no-delay
+    host_rate = None
+    if args.engine == "threads" and not args.dry_run and not args.no_delay:
+        host_rate = args.host_rate or 2.0 / max(1, args.delay_min + args.delay_max)
 
     interrupted = False
+    journal = ProgressJournal(progress_file, resume=resume)
+    result_cache = ResultCache(args.cache_db, ttl=args.cache_ttl) if args.cache_db and not args.dry_run else None
+    if args.fingerprint_db:
+        FINGERPRINTS.load(args.fingerprint_db)
+    DNS_CACHE.max_entries = args.dns_cache_size
+    DNS_CACHE.ttl = args.dns_ttl
+    scanner = Scanner(hosting_patterns, engine=args.engine, threads=threads, concurrency=args.concurrency,
+                      dry_run=args.dry_run, timeout=args.timeout, retries=args.retries, retry_budget=args.retry_budget,
+                      schemes=args.schemes, stagger_delay=args.stagger_delay, max_body_bytes=args.max_body_bytes,
+                      host_rate=host_rate, host_burst=args.host_burst, dns=not args.no_dns, dns_workers=args.dns_workers,
+                      pool_hosts=args.pool_hosts, pool_size=args.pool_size, result_cache=result_cache,
+                      coalesce_samples=args.coalesce_samples if coalescing else 0, adaptive=args.adaptive,
+                      min_threads=args.min_threads, max_threads=args.max_threads, with_timings=args.timings)
+    scheduler = scanner.scheduler
+    controller = scanner.controller
+    if args.engine == "async":
+        CONSOLE.message(Fore.CYAN + f"Async engine: up to {args.concurrency} domains in flight, delays are not applied")
+    elif scheduler:
+        if num_domains is not None:
+            estimated_total_seconds = scheduler.estimate_seconds(num_domains, workers=threads)
+            CONSOLE.message(Fore.CYAN + f"Estimated scan time for up to {num_domains} domains with {threads} thread(s): at least {format_seconds(estimated_total_seconds)} "
+                              f"(more for shared hosts: at most {host_rate * 60:.2f} requests/min per host)")
+    else:
+        CONSOLE.message(Fore.CYAN + f"Estimated scan time: <1s (dry-run or no-delay mode)")
+    if controller:
+        CONSOLE.message(Fore.CYAN + f"Adaptive concurrency: {controller.minimum}-{controller.maximum} requests in flight, "
+                          f"starting at {controller.limit}")
+
+    def save_fingerprints():
+        if not FINGERPRINTS.enabled:
+            return
+        FINGERPRINTS.save()
+        clusters = FINGERPRINTS.unknown_clusters()
+        try:
+            with open(os.path.join(results_dir, "unknown_templates.json"), "w", encoding="utf-8") as f:
+                json.dump(clusters, f, indent=2)
+        except OSError as e:
+            logging.error(f"Failed to write unknown templates report: {e}")
+        return clusters
+
+    # Reports are written incrementally as results arrive
+    reports = open_reports()
+    for result in results:
+        reports.write(result)
+    changes = ChangesReportWriter(os.path.join(results_dir, CHANGES_FILE)) if history is not None else None
 
     def handle_interrupt(sig, frame):
         nonlocal interrupted
         interrupted = True
+        CONSOLE.detach()
         print(Fore.RED + "\nScan interrupted by user. Saving progress...")
-        save_progress(progress_file, results)
+        journal.close()
+        reports.close()
+        if changes is not None:
+            changes.close()
+        if result_cache:
+            result_cache.close()
+        save_fingerprints()
+        METRICS.write(results_dir)
         print(Fore.YELLOW + f"Progress saved to {progress_file}. You can resume later.")
         sys.exit(0)
 
     signal.signal(signal.SIGINT, handle_interrupt)
 
-    def scan_and_save(domain):
-        if domain in already_scanned:
-            return None
-        result = scan_domain(domain, hosting_patterns, dry_run=args.dry_run, retries=args.retries, timeout=args.timeout)
-        save_progress(progress_file, results + [result])
-        return result
-
     # --- Progress bar setup ---
-    progress_iter = tqdm(domains_to_scan, desc="Scanning", unit="domain")
+    from tqdm import tqdm
+    progress_iter = tqdm(total=num_domains, desc="Scanning", unit="domain", disable=args.quiet,
+                         mininterval=CONSOLE_REFRESH_INTERVAL)
+    CONSOLE.attach(progress_iter)
+
+    scan_start = time.monotonic()
+    scanned_before = len(results)
+    pending_domains = (d for d in domains_to_scan if d not in results)
+    deadline = scan_start + args.time_budget if args.time_budget is not None else None
+    metrics_written = time.monotonic()
+    patterns_checked = time.monotonic()
+
+    def reload_patterns():
+        try:
+            matcher = pattern_db.reload()
+        except PatternFileError as e:
+            logging.error(f"{e}; keeping the current patterns")
+            CONSOLE.error(Fore.RED + f"{e}; keeping the current patterns")
+            return
+        if matcher:
+            scanner.reload_patterns(matcher)
+            logging.info(f"Reloaded hosting patterns from {pattern_db.path} (sha256 {pattern_db.source_hash[:12]})")
+
+    def record(result):
+        nonlocal metrics_written, patterns_checked
+        results.append(result)
+        journal.append(result)
+        reports.write(result)
+        if changes is not None:
+            change = history.change(result)
+            if change:
+                changes.write(change)
+        METRICS.record_result(result)
+        CONSOLE.result(result)
+        if time.monotonic() - metrics_written >= METRICS_WRITE_INTERVAL:
+            METRICS.write(results_dir)
+            metrics_written = time.monotonic()
+        if pattern_db and time.monotonic() - patterns_checked >= PATTERN_RELOAD_INTERVAL:
+            reload_patterns()
+            patterns_checked = time.monotonic()
 
     try:
-        if args.threads > 1:
-            with ThreadPoolExecutor(max_workers=args.threads) as executor:
-                future_to_domain = {executor.submit(scan_and_save, domain): domain for domain in domains_to_scan if domain not in already_scanned}
-                for future in tqdm(as_completed(future_to_domain), total=len(future_to_domain), desc="Scanning", unit="domain"):
-                    result = future.result()
-                    if result:
-                        results.append(result)
-        else:
-            for domain in progress_iter:
-                if domain in already_scanned:
-                    continue
-                result = scan_domain(domain, hosting_patterns, dry_run=args.dry_run, retries=args.retries, timeout=args.timeout)
-                results.append(result)
-                save_progress(progress_file, results)
-                if not args.dry_run and not args.no_delay:
-                    delay = random.randint(args.delay_min, args.delay_max)
-                    print(Fore.WHITE + f"Sleeping for {delay} seconds before next request...")
-                    logging.debug(f"Sleeping for {delay} seconds before next request")
-                    time.sleep(delay)
+        for result in scanner.scan_many(pending_domains, deadline=deadline):
+            record(result)
+        CONSOLE.detach()
+        progress_iter.close()
     except KeyboardInterrupt:
         handle_interrupt(None, None)
 
+    input_stats.report()
+    elapsed = time.monotonic() - scan_start
+    scanned_now = len(results) - scanned_before
+    rate = scanned_now / elapsed if elapsed > 0 else 0.0
+    CONSOLE.message(Fore.CYAN + f"Scanned {scanned_now} domains in {format_seconds(elapsed)} ({rate:.1f} domains/sec, engine: {args.engine})")
+    logging.info(f"Throughput: {scanned_now} domains in {elapsed:.2f}s ({rate:.2f} domains/sec, engine: {args.engine})")
+    if scanner.dns_resolver:
+        logging.info(f"DNS stage: {scanner.dns_resolver.lookups} lookups, {scanner.dns_resolver.cache_hits} cache hits")
+    phase_summary = METRICS.phase_summary()
+    if phase_summary:
+        CONSOLE.message(Fore.CYAN + f"Phase timings p50/p95 (ms): {phase_summary}")
+        logging.info(f"Phase timings p50/p95 (ms): {phase_summary}")
+    retry_budget = scanner.retry_budget
+    if retry_budget.denied:
+        print(Fore.YELLOW + f"Retry budget exhausted: {retry_budget.denied} retries skipped ({retry_budget.spent} retries made)")
+    logging.info(f"Retries: {retry_budget.spent} made, {retry_budget.denied} skipped by the retry budget")
+    concurrency_history = None
+    if controller:
+        concurrency_history = controller.history
+        CONSOLE.message(Fore.CYAN + f"Adaptive concurrency: final {controller.limit}, peak {controller.peak}, "
+                          f"{controller.decreases} back-offs")
+    coalesce_stats = None
+    if scanner.coalescer:
+        coalesce_stats = scanner.coalescer.stats()
+        logging.info(f"Coalescing: {coalesce_stats}")
+    if scheduler:
+        logging.info(f"Politeness scheduler waited {scheduler.waited_seconds:.1f}s in total")
+    if args.engine == "threads":
+        pool_stats = scanner.session_pool.stats()
+        hit_rate = 100.0 * pool_stats["hits"] / pool_stats["requests"] if pool_stats["requests"] else 0.0
+        CONSOLE.message(Fore.CYAN + f"Connection pool: {pool_stats['requests']} requests, {pool_stats['hits']} reused, "
+                          f"{pool_stats['misses']} new connections ({hit_rate:.1f}% reuse)")
+        logging.info(f"Connection pool stats: {pool_stats}")
+    scanner.close()
+    clusters = save_fingerprints()
+    if clusters is not None:
+        stats = FINGERPRINTS.stats()
+        CONSOLE.message(Fore.CYAN + f"Fingerprints: {stats['templates']} known templates, {stats['exact_hits']} exact and "
+                          f"{stats['near_hits']} near-duplicate matches, {len(clusters)} unknown templates seen more than once")
+        logging.info(f"Fingerprint index: {stats}")
+        for cluster in clusters[:5]:
+            CONSOLE.message(Fore.CYAN + f"  {cluster['count']} pages like {', '.join(cluster['sample_domains'][:3])}: {cluster['excerpt'][:80]}")
+    cache_stats = None
+    if result_cache:
+        cache_stats = result_cache.stats()
+        result_cache.close()
+
+    reports.close()
+    change_stats = None
+    if changes is not None:
+        changes.close()
+        change_stats = {"changes": changes.rows, "unscanned": sum(1 for d in ranked_domains if d not in results)}
+        CONSOLE.message(Fore.CYAN + f"{changes.rows} category changes written to {changes.path}")
+
     # --- Filter errors only if requested ---
     output_results = results
     if args.errors_only:
-        output_results = [r for r in results if r['category'] != "no_error"]
+        output_results = results.excluding("no_error")
 
-    write_csv(output_results, csv_path)
-    write_md(output_results, md_path)
-    write_html(output_results, html_path)
-    if args.json:
-        write_json(output_results, os.path.join(results_dir, os.path.basename(args.json)))
-    # --- Always write PDF, using pdf_path ---
-    write_pdf(output_results, pdf_path)
-    summarize_results(output_results, summary_file=summary_path)
+    if args.pdf:
+        write_pdf(output_results, pdf_path)
+    summarize_results(output_results, summary_file=summary_path, cache_stats=cache_stats, coalesce_stats=coalesce_stats,
+                      concurrency_history=concurrency_history, change_stats=change_stats)
 
     # Remove progress file after successful completion
+    journal.close()
+    METRICS.write(results_dir)
     if os.path.exists(progress_file):
         os.remove(progress_file)
 
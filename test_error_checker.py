@@ -1,5 +1,186 @@
+import gzip
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from error_checker import is_valid_domain, categorize_response, load_hosting_patterns
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from error_checker import (is_valid_domain, categorize_response, load_hosting_patterns,
+                           scan_domain, async_scan_domain, run_async_scan, SessionPool, ProgressJournal, load_progress,
+                           PatternMatcher, read_error_body, HostScheduler, DnsCache, DnsResolver, DNS_CACHE,
+                           iter_domains, read_domains, InputStats, DomainDeduplicator,
+                           ReportWriters, CsvReportWriter, MarkdownReportWriter, HtmlReportWriter,
+                           JsonReportWriter, JsonlReportWriter, ResultCache,
+                           shard_index, parse_shard, merge_shard_results, write_jsonl, split_limit, ask_resume,
+                           Histogram, ScanMetrics, RetryBudget, retry_delay, scan_domains_queued,
+                           FingerprintIndex, PageFingerprint, page_fingerprint, hamming_distance, Coalescer,
+                           extract_head_signals, HeadSignals, ResultStore, summarize_results,
+                           ConcurrencyController, Scanner, ConsoleRenderer, start_log_writer,
+                           CONSOLE_NORMAL, CONSOLE_QUIET, RunHistory, ChangesReportWriter, until_deadline,
+                           PatternDatabase, PatternFileError)
+import error_checker
+
+class StandInHostingHandler(BaseHTTPRequestHandler):
+    # Local stand-in for hosting front-ends, used instead of the network
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, chunked=False, headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(data), 7):
+                piece = data[i:i + 7]
+                self.wfile.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/ok":
+            self.send_body(200, "<html>Welcome</html>")
+        elif self.path == "/parked":
+            self.send_body(404, "<html>This domain is parked</html>")
+        elif self.path == "/chunked":
+            self.send_body(500, "<html>Strona utrzymywana na serwerach nazwa.pl</html>", chunked=True)
+        elif self.path == "/redirect":
+            self.send_body(302, "", headers={"Location": "/parked"})
+        elif self.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self.send_body(404, "<html>This domain is parked</html>", headers={"ETag": '"v1"'})
+        else:
+            self.send_body(503, "<html>Service Unavailable 503</html>")
+
+class LocalServerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHostingHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+class TestDomainReader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_streams_gzip_validates_and_deduplicates(self):
+        path = os.path.join(self.tmpdir.name, "domains.txt.gz")
+        with gzip.open(path, "wt") as f:
+            f.write("example.com\n\nbad_domain\nEXAMPLE.com\nsub.example.org\nexample.com\n-x.com\n")
+        stats = InputStats()
+        domains = iter_domains(path, stats, DomainDeduplicator())
+        self.assertEqual(next(domains), "example.com")
+        self.assertEqual(stats.lines, 1)
+        self.assertEqual(list(domains), ["sub.example.org"])
+        self.assertEqual((stats.valid, stats.invalid, stats.duplicates), (2, 2, 2))
+        self.assertEqual(stats.invalid_samples, ["bad_domain", "-x.com"])
+
+    def test_read_domains_keeps_order(self):
+        path = os.path.join(self.tmpdir.name, "domains.txt")
+        with open(path, "w") as f:
+            f.write("b.com\na.com\nb.com\n")
+        self.assertEqual(read_domains(path), ["b.com", "a.com"])
+
+    def test_deduplicator_grows_without_losing_entries(self):
+        dedup = DomainDeduplicator(initial_capacity=100)
+        self.assertTrue(all(dedup.add(f"d{i}.com") for i in range(1000)))
+        self.assertFalse(any(dedup.add(f"d{i}.com") for i in range(1000)))
+        self.assertLess(dedup.memory_bytes, 1000 * 8)
+
+    def test_bloom_false_positives_are_not_dropped(self):
+        # A deliberately tiny filter: most unique domains hit set bits, and the exact set
+        # on disk must still let every one of them through
+        dedup = DomainDeduplicator(initial_capacity=1, error_rate=0.5, flush_every=50)
+        dedup._add_stage = lambda: None
+        self.assertTrue(all(dedup.add(f"d{i}.com") for i in range(500)))
+        self.assertGreater(dedup.false_positives, 0)
+        self.assertFalse(any(dedup.add(f"d{i}.com") for i in range(500)))
+
+class TestReportWriters(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.rows = [{"domain": f"d{i}.com", "status_code": 404 if i % 2 else 200,
+                      "category": "custom_404" if i % 2 else "no_error"} for i in range(5)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_rows_are_on_disk_before_close(self):
+        jsonl = JsonlReportWriter(self.path("r.jsonl"))
+        jsonl.write(self.rows[0])
+        with open(self.path("r.jsonl")) as f:
+            self.assertEqual(json.loads(f.read()), self.rows[0])
+        jsonl.close()
+
+    def test_streamed_outputs_and_errors_only(self):
+        writers = [CsvReportWriter(self.path("r.csv")), MarkdownReportWriter(self.path("r.md")),
+                   JsonReportWriter(self.path("r.json"))]
+        # A shard's partial results are merged later, so they keep the no_error rows
+        reports = ReportWriters(writers, errors_only=True, complete=[JsonlReportWriter(self.path("shard.jsonl"))])
+        for row in self.rows:
+            reports.write(row)
+        reports.close()
+        errors = [r for r in self.rows if r["category"] != "no_error"]
+        with open(self.path("r.json")) as f:
+            self.assertEqual(json.load(f), errors)
+        with open(self.path("shard.jsonl")) as f:
+            self.assertEqual([json.loads(line) for line in f], self.rows)
+        with open(self.path("r.csv")) as f:
+            self.assertEqual(sum(1 for line in f if 'custom_404' in line), 2)
+        with open(self.path("r.md")) as f:
+            self.assertTrue(f.read().rstrip().endswith("| 🟡 `custom_404` | **2** |"))
+
+    def test_html_is_paginated(self):
+        writer = HtmlReportWriter(self.path("r.html"), page_size=2)
+        for row in self.rows:
+            writer.write(row)
+        writer.close()
+        pages = [self.path(name) for name in ("r.html", "r_page2.html", "r_page3.html")]
+        for page in pages:
+            with open(page) as f:
+                self.assertTrue(f.read().endswith("</html>"))
+        with open(pages[0]) as f:
+            self.assertIn("r_page2.html", f.read())
+        with open(pages[2]) as f:
+            content = f.read()
+        self.assertIn("<h3>Summary</h3>", content)
+        self.assertEqual(content.count("<code>d"), 1)
 
 class TestErrorChecker(unittest.TestCase):
     def test_is_valid_domain(self):
@@ -15,5 +196,1054 @@ class TestErrorChecker(unittest.TestCase):
         self.assertEqual(categorize_response("404 Not Found", patterns), "custom_404")
         self.assertEqual(categorize_response("Some random text", patterns), "custom")
 
+class TestPatternMatcher(unittest.TestCase):
+    def test_priority_order_is_kept(self):
+        # Provider/keyword order wins over position in the content, including overlapping keywords
+        matcher = PatternMatcher({"first": ["bcd"], "second": ["abc", "x"], "third": ["abcdef"]})
+        self.assertEqual(categorize_response("abcdef", matcher), "first_error")
+        self.assertEqual(categorize_response("x abc", matcher), "second_error")
+        self.assertEqual(categorize_response("503 then 404", matcher), "custom_404")
+        self.assertEqual(categorize_response("nothing", matcher), "custom")
+
+    def test_matches_nested_loops_on_builtin_patterns(self):
+        patterns = load_hosting_patterns()
+        matcher = PatternMatcher(patterns)
+        keywords = [k for v in patterns.values() for k in v] + ["500", "502 503", "plain"]
+        for i, keyword in enumerate(keywords):
+            content = f"<p>{keywords[-i]}</p> {keyword} <b>{keywords[i // 2]}</b>"
+            expected = next((f"{p}_error" for p, kws in patterns.items() for k in kws if k in content), None)
+            expected = expected or next((f"custom_{c}" for c in ("404", "500", "403", "502", "503") if c in content), "custom")
+            self.assertEqual(categorize_response(content, matcher), expected)
+
+    def test_empty_keyword_matches_everything(self):
+        self.assertEqual(categorize_response("404", PatternMatcher({"any": [""]})), "any_error")
+
+class TestPatternDatabase(unittest.TestCase):
+    def write(self, path, patterns, mtime):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(patterns if isinstance(patterns, str) else json.dumps(patterns))
+        os.utime(path, (mtime, mtime))
+
+    def test_artifact_is_reused_until_the_source_changes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "patterns.json")
+            self.write(path, {"acme": ["Parked by Acme"]}, 1000)
+            first = PatternDatabase(path)
+            first.load()
+            self.assertFalse(first.from_cache)
+            database = PatternDatabase(path)
+            matcher = database.load()
+            self.assertTrue(database.from_cache)
+            self.assertEqual(matcher.categorize("<p>Parked by Acme</p>"), "acme_error")
+            self.assertIsNone(database.reload())
+            # Touched but unchanged: nothing to swap
+            os.utime(path, (2000, 2000))
+            self.assertIsNone(database.reload())
+            self.write(path, {"acme": ["Parked by Acme"], "zeta": ["Zeta parking"]}, 3000)
+            reloaded = database.reload()
+            self.assertIsNot(reloaded, matcher)
+            self.assertEqual(reloaded.categorize("<p>Zeta parking</p>"), "zeta_error")
+            self.assertEqual((database.matcher, database.reloads), (reloaded, 1))
+            with mock.patch("error_checker.PATTERN_CACHE_VERSION", 0):
+                rebuilt = PatternDatabase(path)
+                rebuilt.load()
+            self.assertFalse(rebuilt.from_cache)
+
+    def test_artifact_is_plain_json_and_a_broken_one_is_rebuilt(self):
+        patterns = {"acme": ["Parked by Acme", "acme-hosting.com"], "nginx": ["Welcome to nginx"]}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "patterns.json")
+            self.write(path, patterns, 1000)
+            database = PatternDatabase(path)
+            database.load()
+            with open(database.cache_path, encoding="utf-8") as f:
+                artifact = json.load(f)
+            fresh = PatternMatcher(patterns).to_artifact()
+            self.assertEqual(artifact["matcher"], json.loads(json.dumps(fresh)))
+            loaded = PatternMatcher.from_artifact(artifact["matcher"])
+            self.assertEqual(loaded.categorize("<link rel='canonical' href='https://www.acme-hosting.com/'>"), "acme_error")
+            for broken in ("not json", json.dumps({"key": artifact["key"], "matcher": {"regex": "("}})):
+                with open(database.cache_path, "w", encoding="utf-8") as f:
+                    f.write(broken)
+                rebuilt = PatternDatabase(path)
+                with self.assertLogs(level="WARNING"):
+                    rebuilt.load()
+                self.assertFalse(rebuilt.from_cache)
+                self.assertEqual(rebuilt.matcher.categorize("<p>Parked by Acme</p>"), "acme_error")
+
+    def test_invalid_patterns_are_reported_and_the_current_matcher_kept(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "patterns.json")
+            self.write(path, {"acme": ["Parked by Acme"]}, 1000)
+            database = PatternDatabase(path)
+            matcher = database.load()
+            for mtime, broken in enumerate(('{"acme": ["Parked by', '{"acme": "Parked by Acme"}', '["Acme"]'), 2000):
+                self.write(path, broken, mtime)
+                with self.assertRaises(PatternFileError):
+                    database.reload()
+                self.assertIs(database.matcher, matcher)
+                with self.assertRaises(PatternFileError):
+                    load_hosting_patterns(path)
+            with self.assertRaises(PatternFileError):
+                load_hosting_patterns(os.path.join(tmpdir, "missing.json"))
+
+class TestStreamingBody(unittest.TestCase):
+    def test_split_keyword_and_multibyte_characters(self):
+        matcher = PatternMatcher(load_hosting_patterns())
+        body = ("x" * 100 + "Serwis nie istnieje lub wygasł").encode("utf-8")
+        chunks = [body[i:i + 3] for i in range(0, len(body), 3)]
+        content, best = read_error_body(chunks, "text/html; charset=utf-8", matcher)
+        self.assertTrue(content.endswith("wygasł"))
+        self.assertEqual(matcher.categorize(content, best), "homepl_error")
+
+    def test_stops_on_first_hosting_match_and_at_byte_cap(self):
+        matcher = PatternMatcher(load_hosting_patterns())
+        consumed = []
+
+        def chunks():
+            for chunk in (b"404 ", b"Hosted by OVH", b"never read"):
+                consumed.append(chunk)
+                yield chunk
+
+        content, best = read_error_body(chunks(), None, matcher)
+        self.assertEqual(len(consumed), 2)
+        self.assertEqual(matcher.categorize(content, best), "ovh_error")
+        content, best = read_error_body([b"500 " * 100, b"Hosted by OVH"], None, matcher, max_bytes=10)
+        self.assertEqual(content, "500 500 50")
+        self.assertEqual(matcher.categorize(content, best), "custom_500")
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class TestHostScheduler(unittest.TestCase):
+    def test_shared_host_is_throttled_and_others_run_at_full_speed(self):
+        clock = FakeClock()
+        hosts = {"a1.com": "10.0.0.1", "a2.com": "10.0.0.1", "a3.com": "10.0.0.1", "b.com": "10.0.0.2", "c.com": "10.0.0.3"}
+        scheduler = HostScheduler(rate=0.1, burst=1, key_func=hosts.get, clock=clock)
+        released = self.release(scheduler, clock, ["a1.com", "a2.com", "a3.com", "b.com", "c.com"])
+        self.assertEqual(released, [("a1.com", 0.0), ("b.com", 0.0), ("c.com", 0.0), ("a2.com", 10.0), ("a3.com", 20.0)])
+        self.assertEqual(scheduler.waited_seconds, 20.0)
+
+    def release(self, scheduler, clock, domains):
+        # Consumes iter_ready like the driver, with a clock that advances a second per poll
+        released = []
+        for domain in scheduler.iter_ready(domains):
+            if domain is None:
+                clock.now += 1.0
+            else:
+                released.append((domain, clock.now))
+        return released
+
+    def test_many_domains_on_one_host_do_not_hold_back_others(self):
+        clock = FakeClock()
+        scheduler = HostScheduler(rate=1 / 120, burst=1, key_func=lambda d: "10.0.0.1" if d.startswith("parked") else d,
+                                  clock=clock)
+        domains = [f"parked{i}.com" for i in range(3000)] + ["other.com"]
+        stream = scheduler.iter_ready(domains)
+        first = [next(stream), next(stream)]
+        self.assertEqual(first, ["parked0.com", "other.com"])
+        self.assertEqual(clock.now, 0.0)
+        self.assertIsNone(next(stream))
+        clock.now = 120.0
+        self.assertEqual(next(stream), "parked1.com")
+
+    def test_input_is_not_read_beyond_the_buffer_limit(self):
+        clock = FakeClock()
+        pulled = []
+
+        def domains():
+            for i in itertools.count():
+                pulled.append(i)
+                yield f"parked{i}.com"
+        scheduler = HostScheduler(rate=1 / 120, key_func=lambda d: "10.0.0.1", clock=clock, max_buffered=100)
+        stream = scheduler.iter_ready(domains())
+        self.assertEqual(next(stream), "parked0.com")
+        self.assertEqual([next(stream) for _ in range(3)], [None, None, None])
+        self.assertEqual(len(pulled), 101)
+
+    def test_estimate_is_the_worker_bound(self):
+        self.assertEqual(HostScheduler.estimate_seconds(100, workers=4, request_seconds=1.0), 25.0)
+
+def stub_resolver(table):
+    # Resolver over a dict; missing names behave like NXDOMAIN
+    def resolve(host):
+        if host not in table:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return table[host]
+    return resolve
+
+class TestDnsStage(LocalServerTestCase):
+    def test_resolve_stream_with_stub_resolver(self):
+        calls = []
+        table = {"up.test": ["192.0.2.1"], "empty.test": []}
+
+        def resolver(host):
+            calls.append(host)
+            return stub_resolver(table)(host)
+
+        dns = DnsResolver(resolver=resolver, workers=4, cache=DnsCache())
+        resolved = {r.domain: (r.dns_status, r.addresses) for r in dns.resolve_stream(["up.test", "gone.test", "empty.test"])}
+        self.assertEqual(resolved, {"up.test": ("dns_ok", ["192.0.2.1"]), "gone.test": ("dns_nxdomain", []),
+                                    "empty.test": ("dns_no_address", [])})
+        dns.resolve("up.test")
+        dns.resolve("gone.test")
+        self.assertEqual(sorted(calls), ["empty.test", "gone.test", "up.test"])
+        self.assertEqual(dns.cache_hits, 2)
+
+    def test_cache_ttl_and_size_bound(self):
+        clock = FakeClock()
+        cache = DnsCache(max_entries=2, ttl=10, negative_ttl=1, clock=clock)
+        cache.put("a.test", "dns_ok", ["192.0.2.1"])
+        cache.put("b.test", "dns_nxdomain", [])
+        clock.now = 5
+        self.assertEqual(cache.addresses("a.test"), ["192.0.2.1"])
+        self.assertIsNone(cache.get("b.test"))
+        cache.put("c.test", "dns_ok", ["192.0.2.3"])
+        cache.put("d.test", "dns_ok", ["192.0.2.4"])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("a.test"))
+        clock.now = 20
+        self.assertIsNone(cache.get("d.test"))
+
+    def test_http_stage_uses_resolved_address(self):
+        # The name only exists in the DNS cache, so this fails unless the address is pinned
+        port = self.server.server_address[1]
+        DNS_CACHE.put("pinned-stand-in.test", "dns_ok", ["127.0.0.1"])
+        patterns = load_hosting_patterns()
+        url = f"http://pinned-stand-in.test:{port}/parked"
+        self.assertEqual(scan_domain(url, patterns, retries=0, session=SessionPool().get())["category"], "godaddy_error")
+        self.assertEqual(run_async_scan([url], patterns, retries=0)[0]["category"], "godaddy_error")
+
+    def test_http_stage_falls_back_to_the_next_address(self):
+        # 127.0.0.2 refuses the connection (the stand-in only listens on 127.0.0.1); the
+        # lookup's duration goes to the first scan that uses the answer
+        port = self.server.server_address[1]
+        patterns = load_hosting_patterns()
+        for name, scan in (("threads", lambda url, timings: scan_domain(url, patterns, retries=0, session=SessionPool().get(),
+                                                                         timings=timings)),
+                           ("async", lambda url, timings: asyncio.run(async_scan_domain(url, patterns, retries=0,
+                                                                                        timings=timings)))):
+            host = f"fallback-{name}.test"
+            DNS_CACHE.put(host, "dns_ok", ["127.0.0.2", "127.0.0.1"], seconds=0.25)
+            first, second = {}, {}
+            self.assertEqual(scan(f"http://{host}:{port}/parked", first)["category"], "godaddy_error", name)
+            self.assertEqual(scan(f"http://{host}:{port}/parked", second)["category"], "godaddy_error", name)
+            self.assertEqual((first.get("dns"), second.get("dns")), (0.25, None), name)
+
+    def test_async_engine_short_circuits_nxdomain(self):
+        dns = DnsResolver(resolver=stub_resolver({"127.0.0.1": ["127.0.0.1"]}), cache=DnsCache())
+        results = run_async_scan(["gone.test", f"{self.base_url}/ok"], load_hosting_patterns(), retries=0, dns_resolver=dns)
+        categories = {r["domain"]: r["category"] for r in results}
+        self.assertEqual(categories, {"gone.test": "dns_nxdomain", f"{self.base_url}/ok": "no_error"})
+
+class TestAsyncEngine(LocalServerTestCase):
+    def test_async_results_match_thread_engine(self):
+        patterns = load_hosting_patterns()
+        urls = [f"{self.base_url}/{path}" for path in ("ok", "parked", "chunked", "redirect", "missing")]
+        expected = [scan_domain(url, patterns, retries=0) for url in urls]
+        results = run_async_scan(urls, patterns, concurrency=3, retries=0)
+        self.assertEqual(sorted(results, key=lambda r: r["domain"]), sorted(expected, key=lambda r: r["domain"]))
+        self.assertEqual({r["category"] for r in results},
+                         {"no_error", "godaddy_error", "nazwa_error", "custom_503"})
+
+    def test_async_unreachable(self):
+        patterns = load_hosting_patterns()
+        seen = []
+        results = run_async_scan(["http://127.0.0.1:9/closed"], patterns, retries=0, timeout=1, on_result=seen.append)
+        self.assertEqual(seen, [{"domain": "http://127.0.0.1:9/closed", "status_code": None, "category": "unreachable"}])
+        # Results handed to on_result are not kept a second time
+        self.assertEqual(results, [])
+
+class TestSessionPool(LocalServerTestCase):
+    def test_keep_alive_connections_are_reused(self):
+        patterns = load_hosting_patterns()
+        pool, other = SessionPool(pool_hosts=2, pool_size=1), SessionPool()
+        other.get()
+        urls = [f"{self.base_url}/{path}" for path in ("ok", "parked", "missing", "chunked")]
+        results = [scan_domain(url, patterns, retries=0, session=pool.get()) for url in urls]
+        pool.close()
+        other.close()
+        self.assertEqual([r["status_code"] for r in results], [200, 404, 503, 500])
+        self.assertEqual(pool.stats(), {"requests": 4, "hits": 3, "misses": 1})
+        # Counters belong to the pool, not to every pool in the process
+        self.assertEqual(other.stats(), {"requests": 0, "hits": 0, "misses": 0})
+
+    def test_one_session_per_thread(self):
+        pool = SessionPool()
+        sessions = []
+        worker = threading.Thread(target=lambda: sessions.append(pool.get()))
+        worker.start()
+        worker.join()
+        self.assertIs(pool.get(), pool.get())
+        self.assertIsNot(pool.get(), sessions[0])
+        pool.close()
+
+class TestProgressJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.progress_file = os.path.join(self.tmpdir.name, "progress.jsonl")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_append_and_replay(self):
+        journal = ProgressJournal(self.progress_file, resume=False, fsync_every=2)
+        rows = [{"domain": f"d{i}.com", "status_code": 404, "category": "custom_404"} for i in range(5)]
+        for row in rows:
+            journal.append(row)
+        journal.close()
+        self.assertEqual(load_progress(self.progress_file), rows)
+
+    def test_truncated_last_line_is_ignored_and_overwritten_on_resume(self):
+        first = {"domain": "a.com", "status_code": 200, "category": "no_error"}
+        with open(self.progress_file, "w") as f:
+            f.write(json.dumps(first) + "\n" + '{"domain": "b.c')
+        self.assertEqual(load_progress(self.progress_file), [first])
+        second = {"domain": "b.com", "status_code": None, "category": "unreachable"}
+        journal = ProgressJournal(self.progress_file, resume=True)
+        journal.append(second)
+        journal.close()
+        self.assertEqual(load_progress(self.progress_file), [first, second])
+
+    def test_legacy_json_array(self):
+        rows = [{"domain": "a.com", "status_code": 200, "category": "no_error"}]
+        with open(self.progress_file, "w") as f:
+            json.dump(rows, f)
+        self.assertEqual(load_progress(self.progress_file), rows)
+
+class TestResultStore(unittest.TestCase):
+    def test_round_trip_membership_and_replacement(self):
+        rows = [{"domain": "a.com", "status_code": 404, "category": "godaddy_error"},
+                {"domain": "b.com", "status_code": None, "category": "unreachable"},
+                {"domain": "c.com", "status_code": 404, "category": "godaddy_error", "confidence": "inferred"},
+                {"domain": "d.com", "status_code": 200, "category": "no_error", "timings_ms": {"ttfb": 1.5}},
+                {"domain": "e.com", "status_code": 404, "category": "godaddy_error"}]
+        store = ResultStore(rows)
+        self.assertEqual(list(store), rows)
+        self.assertEqual(len(store), 5)
+        self.assertIn("c.com", store)
+        self.assertNotIn("f.com", store)
+        # Rows with the same status, category and confidence share one interned code
+        self.assertEqual(len(store._keys), 4)
+        store.append({"domain": "a.com", "status_code": 200, "category": "no_error"})
+        self.assertEqual([r["domain"] for r in store], ["a.com", "b.com", "c.com", "d.com", "e.com"])
+        self.assertEqual(store.get("a.com"), {"domain": "a.com", "status_code": 200, "category": "no_error"})
+        self.assertEqual(store.category_counts(), Counter({"no_error": 2, "godaddy_error": 2, "unreachable": 1}))
+        self.assertEqual([r["domain"] for r in store.excluding("no_error")], ["b.com", "c.com", "e.com"])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "summary.txt")
+            summarize_results(store, summary_file=path)
+            with open(path) as f:
+                self.assertIn("no_error: 2", f.read().splitlines())
+
+class TestResultCache(LocalServerTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.cache = ResultCache(os.path.join(self.tmpdir.name, "cache.db"), ttl=60, clock=self.clock)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_fresh_result_is_reused_and_unreachable_is_not_cached(self):
+        self.cache.store({"domain": "a.com", "status_code": 404, "category": "custom_404"}, {}, "<html>404</html>")
+        self.cache.store({"domain": "b.com", "status_code": None, "category": "unreachable"})
+        self.assertEqual(self.cache.fresh_result("a.com"), {"domain": "a.com", "status_code": 404, "category": "custom_404"})
+        self.assertIsNone(self.cache.fresh_result("b.com"))
+        self.clock.now = 61
+        self.assertIsNone(self.cache.fresh_result("a.com"))
+        self.assertEqual(len(self.cache.get("a.com")["fingerprint"]), 32)
+
+    def test_stale_entry_is_revalidated_with_etag(self):
+        patterns = load_hosting_patterns()
+        url = f"{self.base_url}/etag"
+        first = scan_domain(url, patterns, retries=0, result_cache=self.cache)
+        self.assertEqual(self.cache.get(url)["etag"], '"v1"')
+        self.clock.now = 120
+        self.assertEqual(scan_domain(url, patterns, retries=0, result_cache=self.cache), first)
+        self.assertEqual(run_async_scan([url], patterns, retries=0, result_cache=self.cache), [first])
+        self.assertEqual(self.cache.stats(), {"hits": 0, "revalidated": 2, "misses": 1})
+        self.assertEqual(self.cache.get(url)["checked_at"], 120)
+
+    def test_two_writers_share_one_file(self):
+        path = os.path.join(self.tmpdir.name, "shared.db")
+        writers = [ResultCache(path, ttl=60, commit_every=50) for _ in range(2)]
+
+        def fill(index, cache):
+            for i in range(1000):
+                cache.store({"domain": f"w{index}-{i}.com", "status_code": 404, "category": "custom_404"})
+            cache.close()
+
+        threads = [threading.Thread(target=fill, args=(index, cache)) for index, cache in enumerate(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        reader = ResultCache(path, ttl=60)
+        try:
+            self.assertIsNotNone(reader.fresh_result("w0-999.com"))
+            self.assertIsNotNone(reader.fresh_result("w1-0.com"))
+            self.assertEqual(reader._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0], 2000)
+        finally:
+            reader.close()
+
+    def test_locked_database_is_logged_not_raised(self):
+        import sqlite3
+        path = os.path.join(self.tmpdir.name, "locked.db")
+        cache = ResultCache(path, ttl=60, commit_every=1, busy_timeout=0.05)
+        holder = sqlite3.connect(path, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+        try:
+            with self.assertLogs(level="WARNING") as logs:
+                cache.store({"domain": "a.com", "status_code": 404, "category": "custom_404"})
+            self.assertIn("database is locked", logs.output[0])
+        finally:
+            holder.execute("ROLLBACK")
+            holder.close()
+            cache.close()
+
+class TestPhaseMetrics(LocalServerTestCase):
+    def test_histogram_and_exports(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+        for value in (0.005, 0.05, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [1, 3, 4, 5])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        metrics = ScanMetrics()
+        metrics.observe("ttfb", 0.02)
+        metrics.count("requests")
+        metrics.record_result({"domain": "a.com", "status_code": 404, "category": "custom_404"})
+        text = metrics.prometheus_text()
+        self.assertIn('error_checker_phase_seconds_bucket{phase="ttfb",le="0.025"} 1', text)
+        self.assertIn('error_checker_results_total{category="custom_404"} 1', text)
+        self.assertIn("error_checker_requests_total 1", text)
+        self.assertEqual(metrics.to_dict()["phases"]["ttfb"]["count"], 1)
+
+    def test_per_domain_timings_in_both_engines(self):
+        patterns = load_hosting_patterns()
+        url = f"{self.base_url}/parked"
+        timings = {}
+        scan_domain(url, patterns, retries=0, session=SessionPool().get(), timings=timings)
+        self.assertTrue({"connect", "ttfb", "body", "categorize"} <= set(timings))
+        result = run_async_scan([url], patterns, retries=0, with_timings=True)[0]
+        self.assertTrue({"connect", "ttfb", "body", "categorize"} <= set(result["timings_ms"]))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "out.csv")
+            writer = CsvReportWriter(path, timings=True)
+            writer.write(result)
+            writer.close()
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+        self.assertIn('"timings_ms"', content)
+        self.assertIn("ttfb=", content)
+
+class TestRetryQueue(unittest.TestCase):
+    def run_queued(self, domains, attempt, workers=1, **kwargs):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(scan_domains_queued(executor, domains, attempt, workers, backoff=lambda tries: 0.2, **kwargs))
+
+    def test_budget_and_jitter(self):
+        budget = RetryBudget(ratio=0.5, minimum=1)
+        for _ in range(4):
+            budget.record_attempt()
+        self.assertEqual([budget.take() for _ in range(4)], [True, True, True, False])
+        self.assertEqual((budget.spent, budget.denied), (3, 1))
+        self.assertTrue(all(1.0 <= retry_delay(1) <= 3.0 for _ in range(100)))
+
+    def test_backoff_does_not_hold_the_worker(self):
+        import requests
+        calls = []
+
+        def attempt(domain, url):
+            calls.append(url)
+            if domain == "flaky.test" and calls.count(url) == 1:
+                raise requests.ConnectionError("reset")
+            return {"domain": domain, "status_code": 200, "category": "no_error"}
+
+        results = self.run_queued(["flaky.test", "good.test"], attempt, retries=1)
+        # good.test is scanned by the only worker while flaky.test waits for its retry
+        self.assertEqual([r["domain"] for r in results], ["good.test", "flaky.test"])
+        self.assertEqual(calls, ["https://flaky.test", "https://good.test", "https://flaky.test"])
+
+    def test_retry_budget_and_http_fallback(self):
+        import requests
+        calls = []
+
+        def attempt(domain, url):
+            calls.append(url)
+            raise requests.ConnectionError("refused")
+
+        budget = RetryBudget(ratio=0, minimum=1)
+        results = self.run_queued(["dead.test"], attempt, retries=2, retry_budget=budget)
+        self.assertEqual(results, [{"domain": "dead.test", "status_code": None, "category": "unreachable"}])
+        self.assertEqual(calls, ["https://dead.test", "https://dead.test", "http://dead.test"])
+
+    def test_race_and_stagger_keep_first_answer(self):
+        import requests
+        calls = []
+
+        def attempt(domain, url):
+            calls.append(url)
+            if url.startswith("https"):
+                time.sleep(0.1)
+                if domain == "nohttps.test":
+                    raise requests.ConnectionError("refused")
+            return {"domain": domain, "status_code": 200 if url.startswith("https") else 301, "category": "no_error"}
+
+        raced = self.run_queued(["nohttps.test"], attempt, workers=2, retries=0, schemes="race")
+        self.assertEqual(raced[0]["status_code"], 301)
+        calls.clear()
+        staggered = self.run_queued(["fast.test"], attempt, workers=2, retries=0, schemes="stagger", stagger_delay=0.5)
+        self.assertEqual(staggered[0]["status_code"], 200)
+        self.assertEqual(calls, ["https://fast.test"])
+
+class TestCoalescing(unittest.TestCase):
+    def test_agreeing_samples_infer_the_rest_of_the_group(self):
+        hosts = {f"p{i}.com": "10.0.0.1" for i in range(20)}
+        hosts.update({f"s{i}.com": "10.0.0.2" for i in range(5)})
+        domains = [d for pair in itertools.zip_longest(hosts, ["alone.com"]) for d in pair if d]
+        requested = []
+
+        def attempt(domain, url):
+            requested.append(domain)
+            time.sleep(0.01)
+            if domain == "s0.com":
+                return {"domain": domain, "status_code": 200, "category": "no_error"}
+            return {"domain": domain, "status_code": 404, "category": "sedo_parked"}
+
+        coalescer = Coalescer(3, key_func=hosts.get)
+        results = []
+
+        def record(result):
+            results.append(result)
+            for inferred in coalescer.observe(result):
+                record(inferred)
+
+        # Samples go through the politeness scheduler, which passes "not ready" through
+        scheduler = HostScheduler(rate=1000, burst=100, key_func=hosts.get)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for result in scan_domains_queued(executor, scheduler.iter_ready(coalescer.admit(domains)),
+                                              attempt, 4):
+                record(result)
+        self.assertEqual(sorted(r["domain"] for r in results), sorted(domains))
+        self.assertEqual(sorted(requested), sorted(["p0.com", "p1.com", "p2.com", "alone.com"] + [f"s{i}.com" for i in range(5)]))
+        inferred = [r for r in results if r.get("confidence") == "inferred"]
+        self.assertEqual(len(inferred), 17)
+        self.assertTrue(all(r["status_code"] == 404 and r["category"] == "sedo_parked" for r in inferred))
+        self.assertEqual(coalescer.stats(), {"groups": 2, "inferred": 17, "split_groups": 1})
+
+    def test_only_hosting_pages_are_inferred(self):
+        # Agreeing samples of ordinary sites, generic errors or failures say nothing about
+        # the other sites on the address
+        for status_code, category in ((200, "no_error"), (None, "unreachable"), (404, "custom_404")):
+            coalescer = Coalescer(2, key_func=lambda domain: "10.0.0.1")
+            admitted = coalescer.admit(f"d{i}.com" for i in range(5))
+            samples = [next(admitted), next(admitted)]
+            self.assertIsNone(next(admitted))
+            for domain in samples:
+                self.assertEqual(coalescer.observe({"domain": domain, "status_code": status_code, "category": category}), [])
+            self.assertEqual(list(admitted), ["d2.com", "d3.com", "d4.com"])
+            self.assertEqual(coalescer.inferred, 0)
+
+class TestHeadSignals(unittest.TestCase):
+    def test_head_is_parsed_up_to_the_body(self):
+        page = ("<html><head><title>Domain\n  parked</title><meta name='generator' content='Plesk Obsidian'>"
+                "<meta http-equiv='Refresh' content=\"0; url='https://www.sedo.com/lander?d=x'\">"
+                "<link rel='canonical' href='https://example.com/'></head>"
+                "<body><title>ignored</title><meta name='generator' content='ignored'></body></html>")
+        self.assertEqual(extract_head_signals(page),
+                         HeadSignals("Domain parked", "Plesk Obsidian", "0; url='https://www.sedo.com/lander?d=x'",
+                                     "https://example.com/"))
+        # Without a closing </head>, the first body tag ends the head
+        self.assertEqual(extract_head_signals("<title>404</title><div><title>x</title></div>").title, "404")
+        # The CPU budget is checked between slices; what was found so far is kept
+        ticks = itertools.count()
+        signals = extract_head_signals("<title>Slow</title>" + "<meta name='x'>" * 5000, budget=0.5,
+                                       clock=lambda: next(ticks))
+        self.assertEqual(signals.title, "Slow")
+
+    def test_head_rules_classify_pages_the_keyword_scan_misses(self):
+        patterns = load_hosting_patterns()
+        refresh = "<html><head><meta http-equiv='refresh' content='0;URL=http://ww1.sedoparking.com/x'></head><body>404</body></html>"
+        self.assertEqual(categorize_response(refresh, patterns), "sedo_error")
+        canonical = "<html><head><link rel='canonical' href='https://mysite.azurewebsites.net/'></head><body>Oops</body></html>"
+        self.assertEqual(categorize_response(canonical, patterns), "microsoft_error")
+        self.assertEqual(categorize_response("<html><head><title>Welcome to NGINX!</title></head></html>", patterns),
+                         "nginx_error")
+        # A host rule matches whole host labels only
+        lookalike = "<html><head><link rel='canonical' href='https://notsedo.com/'></head><body>404</body></html>"
+        self.assertEqual(categorize_response(lookalike, patterns), "custom_404")
+
+class TestFingerprints(unittest.TestCase):
+    TEMPLATE = ("<html><head><title>{domain} is parked</title></head><body><h1>{domain}</h1>"
+                + "".join(f"<p class='row{i}'>This domain may be for sale, ask the owner about offer {i}.</p>" for i in range(30))
+                + "<footer>Registered {date}</footer></body></html>")
+
+    def page(self, domain, date="2024-01-01"):
+        return self.TEMPLATE.format(domain=domain, date=date)
+
+    def test_pages_differing_in_domain_share_a_fingerprint(self):
+        first, second = page_fingerprint(self.page("shop.com")), page_fingerprint(self.page("other.net", "2025-06-30"))
+        self.assertEqual(first, second)
+        edited = page_fingerprint(self.page("shop.com").replace("offer 4", "a special deal"))
+        self.assertNotEqual(edited.digest, first.digest)
+        self.assertLessEqual(hamming_distance(edited.simhash, first.simhash), 3)
+        unrelated = page_fingerprint("<html><body><h1>Welcome to our bakery</h1><p>Fresh bread daily</p></body></html>")
+        self.assertGreater(hamming_distance(unrelated.simhash, first.simhash), 3)
+
+    def test_unknown_templates_are_clustered_labeled_and_persisted(self):
+        patterns = load_hosting_patterns()
+        index = FingerprintIndex()
+        with tempfile.TemporaryDirectory() as tmpdir, mock.patch.object(error_checker, "FINGERPRINTS", index):
+            path = os.path.join(tmpdir, "fingerprints.json")
+            index.load(path)
+            for domain in ("a.com", "b.com", "c.com"):
+                self.assertEqual(error_checker.classify_response(domain, 404, self.page(domain), patterns)["category"], "custom")
+            clusters = index.unknown_clusters()
+            self.assertEqual((len(clusters), clusters[0]["count"], clusters[0]["sample_domains"]),
+                             (1, 3, ["a.com", "b.com", "c.com"]))
+            # Pages matched by a hosting keyword teach the index their template
+            godaddy = "<html><body>" + "<p>Lorem ipsum dolor sit amet</p>" * 20 + "This domain is parked</body></html>"
+            self.assertEqual(categorize_response(godaddy, patterns), "godaddy_error")
+            index.save()
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            data["unknown"][0]["category"] = "sedo_parked"
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            reloaded = FingerprintIndex().load(path)
+        with mock.patch.object(error_checker, "FINGERPRINTS", reloaded):
+            self.assertEqual(categorize_response(self.page("d.com").replace("offer 4", "a special deal"), patterns),
+                             "sedo_parked")
+            self.assertEqual(categorize_response(godaddy.replace("This domain is parked", "Parked"), patterns),
+                             "godaddy_error")
+        self.assertEqual(reloaded.stats()["near_hits"], 2)
+
+    def test_host_keyword_matches_do_not_teach_templates(self):
+        # Fingerprints mask host names, so a template learned from the "ovh.com" keyword
+        # would label the same page naming any other host
+        patterns = load_hosting_patterns()
+        page = "<html><body>" + "<p>Lorem ipsum dolor sit amet</p>" * 20 + "Write to support@{host}</body></html>"
+        index = FingerprintIndex()
+        index.enabled = True
+        with mock.patch.object(error_checker, "FINGERPRINTS", index):
+            self.assertEqual(categorize_response(page.format(host="ovh.com"), patterns), "ovh_error")
+            self.assertEqual(categorize_response(page.format(host="example.org"), patterns), "custom")
+        self.assertEqual(index.stats()["templates"], 0)
+
+    def test_exact_digests_are_bounded_and_persisted(self):
+        index = FingerprintIndex(max_exact=2)
+        for i in range(3):
+            index.learn(page_fingerprint(self.page("shop.com").replace("offer 4", "x " * i)), f"cat{i}")
+        self.assertEqual(list(index._exact.values()), ["cat1", "cat2"])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "fingerprints.json")
+            index.save(path)
+            reloaded = FingerprintIndex().load(path)
+        self.assertEqual(reloaded._exact, index._exact)
+        self.assertEqual(reloaded.lookup(page_fingerprint(self.page("a.com").replace("offer 4", "x x "))), "cat2")
+        self.assertEqual(reloaded.stats()["exact_hits"], 1)
+
+    def test_templates_are_bounded_least_recently_used_first(self):
+        index = FingerprintIndex(max_templates=2)
+        first, second, third = (PageFingerprint("", value, "") for value in (0, (1 << 64) - 1, (1 << 32) - 1))
+        index.learn(first, "first")
+        index.learn(second, "second")
+        self.assertEqual(index.lookup(first), "first")
+        index.learn(third, "third")
+        self.assertEqual(index.stats()["templates"], 2)
+        self.assertIsNone(index.lookup(PageFingerprint("", second.simhash ^ 1, "")))
+        self.assertEqual(index.lookup(third), "third")
+        # Evicted templates leave no entries behind in the band buckets
+        self.assertEqual(sorted(v for bucket in index._bands.values() for v in bucket),
+                         sorted([first.simhash, third.simhash] * 4))
+
+class TestConcurrencyController(unittest.TestCase):
+    def test_aimd_within_bounds(self):
+        clock = FakeClock()
+        controller = ConcurrencyController(minimum=2, maximum=20, initial=2, min_round=4, history_interval=5, clock=clock)
+
+        def round_of(latency=0.1, overloaded=False):
+            clock.now += 1
+            for _ in range(max(4, controller.limit)):
+                controller.observe(latency, overloaded)
+            return controller.limit
+
+        # Slow start doubles up to the maximum, then an overloaded round halves the limit
+        self.assertEqual([round_of() for _ in range(4)], [4, 8, 16, 20])
+        self.assertEqual(round_of(overloaded=True), 10)
+        # After the first back-off the limit grows by one per healthy round
+        self.assertEqual([round_of(), round_of()], [11, 12])
+        # Answers to requests sent before the back-off are ignored
+        controller.observe(0.1, True, epoch=0)
+        self.assertEqual(controller._overloaded, 0)
+        # A round much slower than the baseline counts as overload as well
+        self.assertEqual(round_of(latency=1.0), 6)
+        for _ in range(5):
+            round_of(overloaded=True)
+        self.assertEqual(controller.limit, 2)
+        self.assertEqual(controller.history[0], (0.0, 2))
+        self.assertTrue(all(later[0] - earlier[0] >= 5 for earlier, later in zip(controller.history[1:], controller.history[2:])))
+
+    def test_queued_scan_backs_off_when_the_server_is_overloaded(self):
+        lock = threading.Lock()
+        active = [0]
+
+        def attempt(domain, url):
+            with lock:
+                active[0] += 1
+                busy = active[0]
+            time.sleep(0.005)
+            with lock:
+                active[0] -= 1
+            status = 503 if busy > 6 else 404
+            return {"domain": domain, "status_code": status, "category": f"custom_{status}"}
+
+        controller = ConcurrencyController(minimum=1, maximum=32, initial=1, min_round=8)
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            results = list(scan_domains_queued(executor, (f"d{i}.com" for i in range(600)), attempt, 1,
+                                               controller=controller))
+        self.assertEqual(len(results), 600)
+        self.assertGreater(controller.decreases, 0)
+        self.assertLessEqual(controller.limit, 16)
+        self.assertGreater(controller.peak, 6)
+
+class TestScanner(LocalServerTestCase):
+    def test_batches_share_warm_connections(self):
+        urls = [f"{self.base_url}/{path}" for path in ("ok", "parked", "chunked", "missing")]
+        with Scanner(load_hosting_patterns(), retries=0) as scanner:
+            first = {r["domain"]: r["category"] for r in scanner.scan_many(urls)}
+            self.assertEqual(first, {urls[0]: "no_error", urls[1]: "godaddy_error", urls[2]: "nazwa_error",
+                                     urls[3]: "custom_503"})
+            misses = scanner.session_pool.stats()["misses"]
+            self.assertEqual(scanner.scan(urls[1])["category"], "godaddy_error")
+            # The second batch reuses a keep-alive connection of the first one
+            self.assertEqual(scanner.session_pool.stats()["misses"], misses)
+
+    def test_scan_many_pulls_input_only_when_there_is_room(self):
+        pulled = []
+
+        def endless():
+            for i in itertools.count():
+                pulled.append(i)
+                yield f"d{i}.com"
+
+        for engine in ("threads", "async"):
+            pulled.clear()
+            with Scanner(engine=engine, threads=2, concurrency=2, dry_run=True) as scanner:
+                results = list(itertools.islice(scanner.scan_many(endless()), 5))
+            self.assertEqual(len(results), 5)
+            self.assertLess(len(pulled), 12, engine)
+
+    def test_time_budget_is_checked_after_the_politeness_wait(self):
+        urls = [f"{self.base_url}/ok?{i}" for i in range(10)]
+        with Scanner(retries=0, dns=False, host_rate=2) as scanner:
+            start = time.monotonic()
+            results = list(scanner.scan_many(urls, deadline=start + 1))
+            elapsed = time.monotonic() - start
+        self.assertLessEqual(len(results), 4)
+        self.assertLess(elapsed, 2.5)
+
+    def test_async_engine_and_cached_results(self):
+        url = f"{self.base_url}/parked"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ResultCache(os.path.join(tmpdir, "cache.db"), ttl=60)
+            with Scanner(engine="async", retries=0, result_cache=cache) as scanner:
+                self.assertEqual([r["category"] for r in scanner.scan_many([url, f"{self.base_url}/ok"])].count("godaddy_error"), 1)
+            with Scanner(retries=0, dns=False, result_cache=cache) as scanner:
+                self.assertEqual(scanner.scan(url)["category"], "godaddy_error")
+            self.assertEqual(cache.stats()["hits"], 1)
+            cache.close()
+
+    def test_reloaded_patterns_apply_to_a_running_async_scan(self):
+        url = f"{self.base_url}/parked"
+        with Scanner({"acme": ["Parked by Acme"]}, engine="async", dns=False, retries=0, concurrency=1) as scanner:
+            def domains():
+                yield url
+                # Taken by the running scan after the first domain started
+                scanner.reload_patterns(load_hosting_patterns())
+                yield url
+            categories = [r["category"] for r in scanner.scan_many(domains())]
+        self.assertNotEqual(categories[0], "godaddy_error")
+        self.assertEqual(categories[1], "godaddy_error")
+
+    def test_async_engine_keeps_blocking_work_off_the_loop(self):
+        class RecordingCache(ResultCache):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.calls = []
+
+            def record(self, name):
+                self.calls.append((name, threading.current_thread().name))
+
+            def get(self, domain):
+                self.record("get")
+                return super().get(domain)
+
+            def store(self, *args, **kwargs):
+                self.record("store")
+                return super().store(*args, **kwargs)
+
+            def revalidated_result(self, entry):
+                self.record("revalidated_result")
+                return super().revalidated_result(entry)
+        clock = FakeClock()
+        etag_url = f"{self.base_url}/etag"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = RecordingCache(os.path.join(tmpdir, "cache.db"), ttl=60, clock=clock)
+            try:
+                scan_domain(etag_url, load_hosting_patterns(), retries=0, result_cache=cache)
+                clock.now = 50
+                cache.store({"domain": "d0.com", "status_code": 404, "category": "sedo_error"})
+                # At 90 the /etag entry is stale and must be revalidated; d0.com is still fresh
+                clock.now = 90
+                cache.calls.clear()
+                puts = set()
+                real_put = queue.Queue.put
+
+                def put(q, item, *args, **kwargs):
+                    if isinstance(item, dict):
+                        puts.add(threading.current_thread().name)
+                    return real_put(q, item, *args, **kwargs)
+                with Scanner(load_hosting_patterns(), engine="async", dns=False, concurrency=2, retries=0,
+                             result_cache=cache) as scanner, mock.patch.object(queue.Queue, "put", put):
+                    results = list(scanner.scan_many(["d0.com", etag_url, f"{self.base_url}/parked"]))
+                stats = cache.stats()
+            finally:
+                cache.close()
+        self.assertEqual(len(results), 3)
+        self.assertEqual(stats, {"hits": 1, "revalidated": 1, "misses": 3})
+        names = [name for name, _ in cache.calls]
+        self.assertEqual(names.count("get"), 3)
+        self.assertEqual(sorted(set(names)), ["get", "revalidated_result", "store"])
+        threads = {thread for _, thread in cache.calls}
+        self.assertNotIn("async-scan", threads)
+        self.assertTrue(puts and "async-scan" not in puts, puts)
+
+class TestConsoleOutput(unittest.TestCase):
+    def test_lines_are_batched_until_the_next_redraw(self):
+        clock = FakeClock()
+        progress = mock.Mock()
+        console = ConsoleRenderer(interval=0.5, clock=clock)
+        console.attach(progress)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda i: console.line(f"d{i}.com: 404"), range(20)))
+        console.result({"domain": "d0.com", "category": "custom_404"})
+        progress.write.assert_not_called()
+        clock.now += 0.5
+        console.result({"domain": "d1.com", "category": "no_error"})
+        progress.write.assert_called_once()
+        self.assertEqual(sorted(progress.write.call_args[0][0].split("\n")), sorted(f"d{i}.com: 404" for i in range(20)))
+        progress.set_postfix_str.assert_called_with("custom_404 1, no_error 1", refresh=False)
+        self.assertEqual(progress.update.call_count, 2)
+
+    def test_verbosity_levels(self):
+        progress = mock.Mock()
+        console = ConsoleRenderer(verbosity=CONSOLE_NORMAL, interval=0)
+        console.attach(progress)
+        console.line("a.com: 404")
+        console.result({"domain": "a.com", "category": "custom_404"})
+        progress.write.assert_not_called()
+        progress.set_postfix_str.assert_called_once()
+        console.verbosity = CONSOLE_QUIET
+        with mock.patch("builtins.print") as printed:
+            console.message("Estimated scan time: 1s")
+            console.detach()
+            console.line("b.com: 404")
+        printed.assert_not_called()
+
+    def test_library_use_prints_nothing(self):
+        probe = ("import error_checker; "
+                 "error_checker.Scanner(dry_run=True).scan('a.com'); error_checker.scan_domain('b.com', {}, dry_run=True)")
+        proc = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual((proc.returncode, proc.stdout), (0, ""), proc.stderr)
+
+    def test_log_records_are_written_by_one_background_thread(self):
+        root = logging.getLogger()
+        saved_handlers, saved_level = root.handlers[:], root.level
+        written = []
+        formatted_in = set()
+
+        real_format = logging.Formatter.format
+
+        def format(formatter, record):
+            formatted_in.add(threading.current_thread())
+            return real_format(formatter, record)
+
+        class Recorder(logging.Handler):
+            def emit(self, record):
+                written.append((self.format(record), threading.current_thread()))
+        for handler in saved_handlers:
+            root.removeHandler(handler)
+        recorder = Recorder()
+        recorder.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        root.addHandler(recorder)
+        root.setLevel(logging.INFO)
+
+        def log_failure():
+            try:
+                raise ValueError("bad page")
+            except ValueError:
+                logging.exception("d100.com failed")
+        try:
+            stop = start_log_writer()
+            with ThreadPoolExecutor(max_workers=8) as executor, mock.patch.object(logging.Formatter, "format", format):
+                list(executor.map(lambda i: logging.info(f"d{i}.com returned status 200"), range(100)))
+                executor.submit(log_failure).result()
+                stop()
+            stop()
+        finally:
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            for handler in saved_handlers:
+                root.addHandler(handler)
+            root.setLevel(saved_level)
+        failure = written.pop()[0]
+        self.assertTrue(failure.startswith("ERROR d100.com failed\nTraceback"), failure)
+        self.assertIn("ValueError: bad page", failure)
+        self.assertEqual(sorted(message for message, _ in written), sorted(f"INFO d{i}.com returned status 200" for i in range(100)))
+        self.assertEqual(len({thread for _, thread in written}), 1)
+        self.assertNotEqual(written[0][1], threading.current_thread())
+        # Records are formatted by the writer thread, not by the threads that log them
+        self.assertEqual(formatted_in, {written[0][1]})
+
+class TestIncremental(unittest.TestCase):
+    DAY = 24 * 3600
+
+    def write_runs(self, tmpdir):
+        # Three earlier runs: a finished one with only a CSV report, one with JSON Lines
+        # output and an interrupted one with only its progress journal
+        runs = {
+            "scan_results_20260101_000000": {"flip.com": 200, "parked.com": 404, "stale.com": 404},
+            "scan_results_20260201_000000": {"flip.com": 500, "parked.com": 404},
+            "scan_results_20260210_000000": {"flip.com": 200, "parked.com": 404},
+        }
+        for i, (name, statuses) in enumerate(runs.items()):
+            run_dir = os.path.join(tmpdir, name)
+            os.makedirs(run_dir)
+            results = [{"domain": d, "status_code": code, "category": "no_error" if code == 200 else
+                        "godaddy_error" if d == "parked.com" else f"custom_{code}"} for d, code in statuses.items()]
+            if i == 0:
+                writer = CsvReportWriter(os.path.join(run_dir, "scan_results.csv"))
+                for result in results:
+                    writer.write(result)
+                writer.close()
+            else:
+                write_jsonl(results, os.path.join(run_dir, "progress.jsonl" if i == 2 else "out.jsonl"))
+            with open(os.path.join(run_dir, "metrics.json"), "w") as f:
+                json.dump({"results": {}}, f)
+        return runs
+
+    def test_history_ranks_new_volatile_and_stale_domains_first(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.write_runs(tmpdir)
+            os.makedirs(os.path.join(tmpdir, "scan_results_current"))
+            history = RunHistory.load(os.path.join(tmpdir, "scan_results_*"),
+                                      exclude=[os.path.join(tmpdir, "scan_results_current")])
+        self.assertEqual(len(history.runs), 3)
+        self.assertEqual(history.domains["flip.com"][3:], [history.domains["flip.com"][2], 3, 2])
+        now = history.domains["flip.com"][2] + self.DAY
+        order = history.prioritize(["parked.com", "stale.com", "flip.com", "new.com"], now=now)
+        self.assertEqual(order, ["new.com", "flip.com", "stale.com", "parked.com"])
+
+    def test_changes_report_lists_category_transitions(self):
+        history = RunHistory()
+        history.add_run([{"domain": "a.com", "status_code": 200, "category": "no_error"},
+                         {"domain": "b.com", "status_code": 404, "category": "custom_404"}], 0.0)
+        self.assertIsNone(history.change({"domain": "b.com", "status_code": 404, "category": "custom_404"}))
+        self.assertIsNone(history.change({"domain": "c.com", "status_code": 500, "category": "custom_500"}))
+        change = history.change({"domain": "a.com", "status_code": 500, "category": "custom_500"})
+        self.assertEqual((change["previous_category"], change["category"]), ("no_error", "custom_500"))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "changes.csv")
+            writer = ChangesReportWriter(path)
+            writer.write(change)
+            writer.close()
+            with open(path) as f:
+                rows = [line for line in f if not line.startswith("#")]
+        self.assertEqual(rows[1].split(",")[:5], ['"a.com"', '"no_error"', '"custom_500"', '"200"', '"500"'])
+
+    def test_time_budget_stops_taking_domains(self):
+        clock = FakeClock()
+        taken = []
+        for domain in until_deadline((f"d{i}.com" for i in range(10)), deadline=3, clock=clock):
+            taken.append(domain)
+            clock.now += 1
+        self.assertEqual(taken, ["d0.com", "d1.com", "d2.com"])
+
+class TestSharding(unittest.TestCase):
+    def test_shards_partition_the_input(self):
+        domains = [f"site{i}.com" for i in range(1000)]
+        shards = [[d for d in domains if shard_index(d, 4) == i] for i in range(4)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(domains))
+        self.assertTrue(all(150 < len(shard) < 350 for shard in shards))
+        self.assertEqual(shard_index("Site1.COM", 4), shard_index("site1.com", 4))
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        for value in ("4/4", "-1/4", "1", "a/b"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
+
+    def test_merge_shard_results(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            first, second = os.path.join(tmpdir, "shard_0"), os.path.join(tmpdir, "shard_1.jsonl")
+            os.makedirs(first)
+            write_jsonl([{"domain": "a.com", "status_code": 404, "category": "custom_404"}],
+                        os.path.join(first, "shard_results.jsonl"))
+            write_jsonl([{"domain": "b.com", "status_code": 200, "category": "no_error"}], second)
+            merged = merge_shard_results([first, second, os.path.join(tmpdir, "missing")])
+        self.assertEqual([r["domain"] for r in merged], ["a.com", "b.com"])
+
+    def test_max_domains_is_split_across_shards(self):
+        self.assertEqual(split_limit(10, 4), [3, 3, 2, 2])
+        self.assertEqual(split_limit(2, 4), [1, 1, 0, 0])
+
+    def test_resume_choice_does_not_prompt_unless_asked(self):
+        with mock.patch("builtins.input", side_effect=EOFError), mock.patch("builtins.print"):
+            self.assertTrue(ask_resume(["progress.jsonl"], "yes"))
+            self.assertFalse(ask_resume(["progress.jsonl"], "no"))
+            self.assertFalse(ask_resume([], "ask"))
+        with mock.patch("builtins.input", return_value="y"), mock.patch("builtins.print"):
+            self.assertTrue(ask_resume(["progress.jsonl"], "ask"))
+
+    def test_processes_reject_stdin_input(self):
+        proc = subprocess.run([sys.executable, error_checker.__file__, "--input", "-", "--processes", "2"],
+                              capture_output=True, text=True, stdin=subprocess.DEVNULL)
+        self.assertEqual(proc.returncode, 2)
+        self.assertIn("stdin", proc.stderr)
+
+class TestImportTime(unittest.TestCase):
+    # Microseconds spent importing error_checker's own dependencies (-X importtime),
+    # excluding the module body itself; pulling requests in eagerly costs over 100ms
+    DEPENDENCY_BUDGET_US = 100_000
+
+    def import_probe(self):
+        probe = ("import signal, sys; import error_checker; "
+                 "print(sorted(m for m in ('requests', 'urllib3', 'bs4', 'colorama', 'tqdm', 'asyncio', 'sqlite3') if m in sys.modules)); "
+                 "print(signal.getsignal(signal.SIGINT) is signal.default_int_handler)")
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stdout.split("\n")[:2], ["[]", "True"])
+        for line in proc.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == "error_checker":
+                return int(fields[1]) - int(fields[0].split(":")[1])
+        self.fail("error_checker missing from -X importtime output")
+
+    def test_import_is_cheap_and_side_effect_free(self):
+        # Best of three, so a busy machine does not fail the budget
+        self.assertLess(min(self.import_probe() for _ in range(3)), self.DEPENDENCY_BUDGET_US)
+
 if __name__ == "__main__":
     unittest.main()